@@ -0,0 +1,589 @@
+"""Benchmarks του bot απέναντι σε τοπικό fake Bot API.
+
+    python bench.py                          # 10k, 100k, 1M chats
+    python bench.py --sizes 10000 --out bench_results.jsonl
+    python bench.py --serve 8081             # μόνο ο fake server
+    python bench.py --parse                  # parser: golden corpus + microbenchmark
+
+Κάθε αποτέλεσμα είναι μία JSON γραμμή (bench, chats, value, unit, ...), ώστε
+δύο τρεξίματα να συγκρίνονται γραμμή-γραμμή.
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from urllib.parse import parse_qs
+from email.parser import BytesParser
+from email.policy import HTTP
+
+try:
+    import resource
+except ImportError:   # Windows (run.bat)
+    resource = None
+
+BENCH_TOKEN = "123456:BENCH"
+HOT_SLOT = (0, 8, 0)   # Δευτέρα 08:00, το default του /start
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parse_corpus.tsv")
+CHATTER = [
+    "καλημέρα σε όλους!",
+    "Ποιος έρχεται απόψε; εγώ μάλλον αργώ λίγο",
+    "χαχαχα 😂😂",
+    "ok",
+    "Στείλε μου το link όταν μπορείς",
+    "Την Τρίτη έχω γιατρό, μιλάμε μετά",
+    "έχουμε 3 εισιτήρια για το Σάββατο",
+    "Did anyone see the match last night?",
+    "Ραντεβού στην πλατεία, είμαι 5 λεπτά μακριά",
+    "Δεν ξέρω αν προλαβαίνω αύριο το πρωί, θα σας πω το βράδυ " * 2,
+]
+
+
+# =======================
+# FAKE BOT API
+# =======================
+class FakeBotAPI:
+    # Απαντάει στα methods που χρησιμοποιεί το bot. Προσομοιώνει latency,
+    # global όριο (429 + retry_after) και chats που έχουν κάνει block (403).
+    def __init__(
+        self,
+        latency: float = 0.02,
+        jitter: float = 0.01,
+        rate_limit: float = 0.0,
+        retry_after_every: int = 0,
+        forbidden_every: int = 0,
+    ) -> None:
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.retry_after_every = retry_after_every
+        self.forbidden_every = forbidden_every
+        self.calls: dict[str, int] = {}
+        self.uploads = 0
+        self.sent = 0
+        self.throttled = 0
+        self.forbidden = 0
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._message_id = 0
+        self.server: asyncio.AbstractServer | None = None
+
+    async def start(self, port: int = 0) -> int:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def _over_limit(self) -> bool:
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start = now
+            self._window_count = 0
+        self._window_count += 1
+        return self._window_count > self.rate_limit
+
+    def _params(self, headers: dict[str, str], body: bytes) -> dict:
+        if not body:
+            return {}
+        content_type = headers.get("content-type", "")
+        if content_type.startswith("application/json"):
+            return json.loads(body)
+        if content_type.startswith("multipart/form-data"):
+            # upload αρχείου: τα πεδία ως str, τα αρχεία μετριούνται στο uploads
+            message = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body
+            )
+            params = {}
+            for part in message.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                if part.get_filename() is not None:
+                    self.uploads += 1
+                    params[name] = f"upload-{self.uploads}"
+                else:
+                    params[name] = part.get_content().strip()
+            return params
+        return {k: v[0] for k, v in parse_qs(body.decode()).items()}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        import bot
+
+        try:
+            while request := await bot.read_http_request(reader):
+                _, path, headers, body = request
+                method = path.rsplit("/", 1)[-1]
+                self.calls[method] = self.calls.get(method, 0) + 1
+                status, payload = await self._dispatch(method, self._params(headers, body))
+                await bot.write_http_response(
+                    writer, status, json.dumps(payload).encode(), "application/json"
+                )
+        except (ConnectionError, asyncio.IncompleteReadError, TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, params: dict) -> tuple[int, dict]:
+        if self.latency:
+            await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+        if method == "getMe":
+            return 200, {"ok": True, "result": {
+                "id": 123456, "is_bot": True, "first_name": "bench", "username": "bench_bot",
+            }}
+
+        if method in ("sendMessage", "editMessageText", "sendPhoto", "sendDocument"):
+            chat_id = int(params.get("chat_id", 0))
+            if self._over_limit() or (
+                self.retry_after_every and self.calls[method] % self.retry_after_every == 0
+            ):
+                self.throttled += 1
+                return 429, {
+                    "ok": False, "error_code": 429,
+                    "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                }
+            if self.forbidden_every and chat_id % self.forbidden_every == 0:
+                self.forbidden += 1
+                return 403, {
+                    "ok": False, "error_code": 403,
+                    "description": "Forbidden: bot was blocked by the user",
+                }
+            self.sent += 1
+            self._message_id += 1
+            result = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+            # file_id: όποιο ήρθε ή ένα νέο για το upload (attach://…)
+            if method == "sendPhoto":
+                file_id = params["photo"].removeprefix("attach://")
+                result["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}]
+            elif method == "sendDocument":
+                file_id = params["document"].removeprefix("attach://")
+                result["document"] = {"file_id": file_id, "file_unique_id": file_id}
+            return 200, {"ok": True, "result": result}
+
+        return 200, {"ok": True, "result": True}
+
+
+# =======================
+# HARNESS
+# =======================
+def seed_db(path: str, chats: int, hot_share: float, seed: int = 1) -> None:
+    # hot_share των chats στο default slot, οι υπόλοιποι τυχαία μέσα στη βδομάδα
+    rnd = random.Random(seed)
+
+    def rows():
+        for chat_id in range(1, chats + 1):
+            if rnd.random() < hot_share:
+                dow, hour, minute = HOT_SLOT
+            else:
+                dow, hour, minute = rnd.randrange(7), rnd.randrange(24), rnd.randrange(60)
+            yield chat_id, 1 if rnd.random() < 0.9 else 0, dow, hour, minute
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id INTEGER PRIMARY KEY,
+            enabled INTEGER NOT NULL DEFAULT 1,
+            dow INTEGER NOT NULL DEFAULT 0,
+            hour INTEGER NOT NULL DEFAULT 8,
+            minute INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    conn.executemany(
+        "INSERT INTO chats (chat_id, enabled, dow, hour, minute) VALUES (?, ?, ?, ?, ?)", rows()
+    )
+    conn.commit()
+    conn.close()
+
+
+def max_rss_mb() -> float | None:
+    # None (n/a στο JSON) όπου δεν υπάρχει getrusage
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    if not samples:
+        return {}
+    samples = sorted(samples)
+
+    def pick(q: float) -> float:
+        return round(samples[min(len(samples) - 1, int(q * len(samples)))] * 1000, 3)
+
+    return {"p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+def message_update(update_id: int, chat_id: int, text: str) -> dict:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": "bench"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def callback_update(update_id: int, chat_id: int, data: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "bench"},
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": "menu",
+            },
+        },
+    }
+
+
+class Recorder:
+    def __init__(self, out: str | None, run: dict) -> None:
+        self.out = out
+        self.run = run
+
+    def __call__(self, bench: str, value: float | None, unit: str, **extra) -> None:
+        entry = {**self.run, "bench": bench, "value": None if value is None else round(value, 3), "unit": unit, **extra}
+        line = json.dumps(entry, ensure_ascii=False)
+        print(line)
+        if self.out:
+            with open(self.out, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+def load_corpus(path: str) -> list[tuple[str, tuple | None]]:
+    cases = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line or line.startswith("#"):
+                continue
+            text, expected = line.split("\t")
+            if expected == "None":
+                cases.append((text, None))
+                continue
+            days, hhmm = expected.split()
+            hour, minute = map(int, hhmm.split(":"))
+            cases.append((text, (() if days == "-" else tuple(map(int, days.split(","))), hour, minute)))
+    return cases
+
+
+def bench_parse(bot, args, record) -> int:
+    # golden corpus και μετά χρόνος ανά μήνυμα για συζήτηση/ρυθμίσεις
+    cases = load_corpus(CORPUS_PATH)
+    failed = 0
+    for text, expected in cases:
+        got = bot.parse_day_time(text)
+        if got != expected:
+            failed += 1
+            print(f"MISMATCH {text!r}: expected {expected}, got {got}", file=sys.stderr)
+    record("parse_golden_failed", failed, "count", cases=len(cases))
+
+    schedules = [text for text, expected in cases if expected is not None]
+    for name, messages in (("chatter", CHATTER), ("schedule", schedules)):
+        rounds = max(1, args.parse_iterations // len(messages))
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for text in messages:
+                bot.parse_day_time(text)
+        elapsed = time.perf_counter() - start
+        record(f"parse_{name}", elapsed / (rounds * len(messages)) * 1e6, "us/msg", messages=rounds * len(messages))
+    return failed
+
+
+async def drain(bot, app, api: FakeBotAPI, deliveries: int, method: str = "sendMessage") -> tuple[int, float]:
+    # τρέχει τον outbox worker μέχρι να φύγουν `deliveries` μηνύματα
+    start_calls = api.calls.get(method, 0)
+    worker = asyncio.create_task(bot.outbox_worker(bot.bulk_bot(app)))
+    start = time.perf_counter()
+    try:
+        while api.calls.get(method, 0) - start_calls < deliveries:
+            if worker.done():
+                worker.result()
+            await asyncio.sleep(0.05)
+    finally:
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+    return api.calls.get(method, 0) - start_calls, time.perf_counter() - start
+
+
+def import_time(rounds: int = 5) -> float:
+    # cold start σε καθαρό interpreter· το καλύτερο από `rounds` (χωρίς το startup του python)
+    code = "import time; t = time.perf_counter(); import bot; print(time.perf_counter() - t)"
+    repo = os.path.dirname(os.path.abspath(__file__))
+    samples = [
+        float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=repo, check=True).stdout)
+        for _ in range(rounds)
+    ]
+    return min(samples) * 1000
+
+
+async def bench_size(bot, args, api: FakeBotAPI, base_url: str, chats: int, record) -> None:
+    db_path = os.path.abspath(f"bench_{chats}.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    start = time.perf_counter()
+    seed_db(db_path, chats, args.hot_share)
+    record("seed", time.perf_counter() - start, "s", chats=chats)
+
+    bot.DB_PATH = db_path
+    start = time.perf_counter()
+    await bot.init_db()
+    record("init_db", time.perf_counter() - start, "s", chats=chats)
+    # restart: η βάση είναι ήδη στο SCHEMA_VERSION, δεν τρέχει κανένα migration
+    await bot.db_close()
+    start = time.perf_counter()
+    await bot.init_db()
+    record("init_db_warm", time.perf_counter() - start, "s", chats=chats)
+    # ένα instance: παίρνει όλα τα shards του outbox (χωρίς cluster_loop)
+    await bot.cluster_heartbeat()
+    bot._send_bucket = bot.TokenBucket(args.rate)
+    start = time.perf_counter()
+    indexed = await bot.load_schedule_index()
+    record("load_index", time.perf_counter() - start, "s", chats=chats, indexed=indexed)
+    record("max_rss", max_rss_mb(), "MB", chats=chats)
+
+    app = bot.build_application(BENCH_TOKEN, base_url=base_url)
+    await app.initialize()
+    await bot.bulk_bot(app).initialize()
+    try:
+        # schedule_tick: enqueue όλου του hot slot + αποστολή των πρώτων N
+        hot = bot.zone_slot(bot.minute_of_week(*HOT_SLOT), bot.TZ.key)
+        epoch_min = bot.next_fire_minute(int(time.time() // 60))
+        while bot.utc_slot(epoch_min) != hot:
+            epoch_min = bot.next_fire_minute(epoch_min)
+        epoch_min -= bot.MINUTES_PER_WEEK   # περασμένη εβδομάδα: next_at = αρχή του λεπτού, ήδη claimable
+        due = len(bot._due_index.get(hot, ()))
+        start = time.perf_counter()
+        await bot.schedule_tick(epoch_min, epoch_min)
+        record("schedule_tick_enqueue", time.perf_counter() - start, "s", chats=chats, due=due)
+        sent, elapsed = await drain(bot, app, api, min(due, args.deliveries))
+        record("schedule_tick_send", sent / elapsed, "msg/s", chats=chats, sent=sent)
+        await bot.db_write("DELETE FROM outbox")
+
+        # sendnow: enqueue σε όλους τους ενεργούς + αποστολή των πρώτων N
+        start = time.perf_counter()
+        chat_ids = await bot.get_enabled_chat_ids()
+        await bot.outbox_enqueue("broadcast", "bench", chat_ids)
+        record("sendnow_enqueue", time.perf_counter() - start, "s", chats=chats, recipients=len(chat_ids))
+        sent, elapsed = await drain(bot, app, api, min(len(chat_ids), args.deliveries))
+        record("sendnow_send", sent / elapsed, "msg/s", chats=chats, sent=sent)
+        await bot.db_write("DELETE FROM outbox")
+
+        # broadcast φωτογραφίας από αρχείο με λεζάντα-template: ένα upload, μετά file_id
+        bot.MEDIA_DIR = os.getcwd()   # workdir του bench
+        photo = os.path.abspath("bench_photo.jpg")
+        with open(photo, "wb") as f:
+            f.write(os.urandom(256 * 1024))
+        uploads = api.uploads
+        renders = bot.metrics.value("bot_template_renders_total")
+        start = time.perf_counter()
+        await bot.outbox_enqueue(
+            "broadcast", "📷 {day} {time} ({when})", chat_ids, media_type="photo", media=photo
+        )
+        record("sendnow_media_enqueue", time.perf_counter() - start, "s", chats=chats, recipients=len(chat_ids))
+        sent, elapsed = await drain(bot, app, api, min(len(chat_ids), args.deliveries), "sendPhoto")
+        record("sendnow_media_send", sent / elapsed, "msg/s", chats=chats, sent=sent,
+               uploads=api.uploads - uploads, renders=bot.metrics.value("bot_template_renders_total") - renders)
+        await bot.db_write("DELETE FROM outbox")
+
+        # ιστορικό αποστολών: τα δύο admin queries πάνω σε ό,τι μόλις στάλθηκε
+        for name, query in (
+            ("chat", lambda: bot.chat_deliveries(random.choice(chat_ids))),
+            ("slot", lambda: bot.slot_deliveries([hot])),
+        ):
+            samples = []
+            for _ in range(args.handler_iterations):
+                start = time.perf_counter()
+                await query()
+                samples.append(time.perf_counter() - start)
+            record("delivery_query", sum(samples) / len(samples) * 1000, "ms",
+                   chats=chats, query=name, **percentiles(samples))
+
+        # handlers: ολόκληρο το process_update (DB + απάντηση στο fake API)
+        from telegram import Update
+
+        scenarios = {
+            "/set": lambda i, c: message_update(i, c, "/set Τρίτη 09:30"),
+            "/when": lambda i, c: message_update(i, c, "/when"),
+            "text": lambda i, c: message_update(i, c, "Πέμπτη 18:45"),
+            "action:when": lambda i, c: callback_update(i, c, "action:when"),
+            "action:start": lambda i, c: callback_update(i, c, "action:start"),
+            "setday": lambda i, c: callback_update(i, c, "setday:4"),
+        }
+        update_id = 0
+        for name, make in scenarios.items():
+            samples = []
+            for _ in range(args.handler_iterations):
+                update_id += 1
+                chat_id = random.randint(1, chats)
+                if args.forbidden_every and chat_id % args.forbidden_every == 0:
+                    chat_id += 1   # οι απαντήσεις των handlers δεν πρέπει να πάρουν 403
+                update = Update.de_json(make(update_id, chat_id), app.bot)
+                start = time.perf_counter()
+                await app.process_update(update)
+                samples.append(time.perf_counter() - start)
+            record("handler", sum(samples) / len(samples) * 1000, "ms",
+                   chats=chats, handler=name, **percentiles(samples))
+
+        # /when ενώ τρέχει broadcast: το interactive pool δεν περιμένει το bulk
+        await bot.outbox_enqueue("broadcast", "bench", chat_ids)
+        worker = asyncio.create_task(bot.outbox_worker(bot.bulk_bot(app)))
+        await asyncio.sleep(0.2)
+        samples = []
+        for _ in range(args.handler_iterations):
+            update_id += 1
+            chat_id = random.randint(1, chats)
+            if args.forbidden_every and chat_id % args.forbidden_every == 0:
+                chat_id += 1
+            update = Update.de_json(message_update(update_id, chat_id, "/when"), app.bot)
+            start = time.perf_counter()
+            await app.process_update(update)
+            samples.append(time.perf_counter() - start)
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+        await bot.db_write("DELETE FROM outbox")
+        record("handler", sum(samples) / len(samples) * 1000, "ms",
+               chats=chats, handler="/when+broadcast", **percentiles(samples))
+        # flood: ένα chat πατάει κουμπιά όσο πιο γρήγορα γίνεται (ίδιο και εναλλάξ)
+        chat_id = 1 if not args.forbidden_every or args.forbidden_every > 1 else 2
+        before = {r: bot.metrics.value("bot_inbound_total", result=r) for r in ("ok", "debounced", "chat_limited")}
+        samples = []
+        for i in range(args.handler_iterations):
+            update_id += 1
+            data = "setday:4" if i % 4 else "action:when"
+            update = Update.de_json(callback_update(update_id, chat_id, data), app.bot)
+            start = time.perf_counter()
+            await app.process_update(update)
+            samples.append(time.perf_counter() - start)
+        record("handler", sum(samples) / len(samples) * 1000, "ms", chats=chats, handler="flood", **percentiles(samples),
+               **{r: bot.metrics.value("bot_inbound_total", result=r) - n for r, n in before.items()})
+
+        for pool in ("interactive", "bulk"):
+            wait = bot.metrics.histograms.get(("bot_http_pool_wait_seconds", (("pool", pool),)))
+            if wait is not None:
+                record("http_pool_wait_p95", wait.quantile(0.95) * 1000, "ms", chats=chats, pool=pool, requests=wait.count)
+        hits = bot.metrics.value("bot_cache_hits_total", cache="settings")
+        misses = bot.metrics.value("bot_cache_misses_total", cache="settings")
+        record("settings_cache_hit_ratio", hits / max(hits + misses, 1), "ratio", chats=chats, lookups=hits + misses)
+        record("max_rss", max_rss_mb(), "MB", chats=chats, phase="end")
+    finally:
+        await bot.bulk_bot(app).shutdown()
+        await app.shutdown()
+        await bot.db_close()
+
+
+async def run(args) -> None:
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bot-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    out = os.path.abspath(args.out) if args.out else None
+    os.chdir(workdir)   # logs και βάσεις του bench μένουν εκτός repo
+    import bot
+
+    if args.parse:
+        record = Recorder(out, {"run": time.strftime("%Y-%m-%dT%H:%M:%S")})
+        if bench_parse(bot, args, record):
+            sys.exit(1)
+        return
+
+    bot.setup_logging()
+    api = FakeBotAPI(
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=args.api_rate,
+        retry_after_every=args.retry_after_every,
+        forbidden_every=args.forbidden_every,
+    )
+    port = await api.start()
+    base_url = f"http://127.0.0.1:{port}/bot"
+
+    try:
+        rev = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        rev = ""
+    record = Recorder(out, {
+        "run": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "rev": rev,
+        "latency": args.latency,
+        "rate": args.rate,
+    })
+
+    try:
+        record("import_bot", import_time(), "ms")
+        for chats in args.sizes:
+            await bench_size(bot, args, api, base_url, chats, record)
+        record("fake_api_throttled", api.throttled, "count")
+        record("fake_api_forbidden", api.forbidden, "count")
+    finally:
+        await api.stop()
+
+
+async def serve(args) -> None:
+    api = FakeBotAPI(
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=args.api_rate,
+        retry_after_every=args.retry_after_every,
+        forbidden_every=args.forbidden_every,
+    )
+    port = await api.start(args.serve)
+    print(f"fake Bot API στο http://127.0.0.1:{port}/bot<token>/", file=sys.stderr)
+    await asyncio.Event().wait()
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(description="Benchmarks του bot με fake Bot API")
+    p.add_argument("--sizes", type=lambda v: [int(x) for x in v.split(",")],
+                   default=[10_000, 100_000, 1_000_000], help="πλήθος chats, π.χ. 10000,100000")
+    p.add_argument("--hot-share", type=float, default=0.05, help="ποσοστό chats στη Δευτέρα 08:00")
+    p.add_argument("--deliveries", type=int, default=5000, help="μηνύματα ανά μέτρηση αποστολής")
+    p.add_argument("--handler-iterations", type=int, default=200)
+    p.add_argument("--rate", type=float, default=1000.0, help="msg/s του bot (BROADCAST_RATE)")
+    p.add_argument("--latency", type=float, default=0.02, help="latency του fake API σε s")
+    p.add_argument("--jitter", type=float, default=0.01)
+    p.add_argument("--api-rate", type=float, default=0.0, help="όριο msg/s του fake API (0=κανένα)")
+    p.add_argument("--retry-after-every", type=int, default=0, help="429 κάθε N sendMessage")
+    p.add_argument("--forbidden-every", type=int, default=50, help="403 για chat_id %% N == 0")
+    p.add_argument("--workdir", help="φάκελος για βάσεις/logs (default: προσωρινός)")
+    p.add_argument("--out", help="προσθέτει τα αποτελέσματα (JSON lines) σε αυτό το αρχείο")
+    p.add_argument("--serve", type=int, metavar="PORT", help="τρέχει μόνο τον fake Bot API")
+    p.add_argument("--parse", action="store_true", help="μόνο parser: golden corpus + microbenchmark")
+    p.add_argument("--parse-iterations", type=int, default=200_000, help="κλήσεις parse_day_time ανά μέτρηση")
+    return p.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    asyncio.run(serve(args) if args.serve else run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,87 @@
+from __future__ import annotations
+
 import os
+import sys
+import csv
+import json
+import sqlite3
+import argparse
+import gzip
+import queue
+import atexit
+import hmac
+import signal
+import socket
+import secrets
+import functools
+import itertools
+import string
+import shutil
 import asyncio
 import logging
-from logging.handlers import RotatingFileHandler
-from datetime import time, datetime
-from zoneinfo import ZoneInfo
+import time
+from collections import OrderedDict, deque
+from contextlib import suppress, asynccontextmanager
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import importlib.util
+from typing import TYPE_CHECKING
 import aiosqlite
 import re
-from telegram.ext import MessageHandler, filters
-from telegram import Update
-from telegram.error import RetryAfter, Forbidden
-from telegram.ext import Application, CommandHandler, ContextTypes
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import CallbackQueryHandler
-from collections import deque
+from bisect import bisect_left, bisect_right
 from dotenv import load_dotenv
 load_dotenv()
 
 
+# =======================
+# TELEGRAM (lazy import)
+# =======================
+# Το telegram stack (και το httpx) είναι το μισό χρόνο του import· τα CLI
+# εργαλεία (export/import/backup/logs/migrate) και το bench --parse δεν το
+# χρειάζονται. Φορτώνεται μία φορά από το build_application, πριν στηθεί
+# οτιδήποτε που μιλάει με το Bot API. Μέχρι τότε τα ονόματα υπάρχουν ως
+# placeholders: τα exceptions είναι κλάσεις που απλώς δεν ταιριάζουν ποτέ
+# (κανένα telegram error δεν γίνεται raise χωρίς το telegram), ώστε κάθε
+# except/suppress να δουλεύει ίδια και σε CLI/bench· ο type checker βλέπει τα κανονικά.
+if TYPE_CHECKING:
+    import httpx
+    from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
+    from telegram.request import HTTPXRequest
+    from telegram.error import RetryAfter, Forbidden, BadRequest, NetworkError, TelegramError
+    from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, filters
+else:
+    class TelegramError(Exception):
+        pass
+
+    class NetworkError(TelegramError):
+        pass
+
+    class BadRequest(NetworkError):
+        pass
+
+    class Forbidden(TelegramError):
+        pass
+
+    class RetryAfter(TelegramError):
+        pass
+
+    httpx = Bot = Update = InlineKeyboardButton = InlineKeyboardMarkup = HTTPXRequest = None
+    Application = CommandHandler = CallbackQueryHandler = MessageHandler = ContextTypes = filters = None
+
+
+def load_telegram() -> None:
+    global httpx, Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, HTTPXRequest
+    global RetryAfter, Forbidden, BadRequest, NetworkError, TelegramError
+    global Application, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, filters
+    import httpx
+    from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
+    from telegram.request import HTTPXRequest
+    from telegram.error import RetryAfter, Forbidden, BadRequest, NetworkError, TelegramError
+    from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, filters
+
+
 # =======================
 # LOG FILES
 # =======================
@@ -25,6 +90,14 @@ ERROR_LOG = "errors.log"
 
 MAX_LOG_LINES = 4000          # προστασία μνήμης
 MAX_TELEGRAM_CHARS = 3500     # για να μην κόβεται το μήνυμα
+MAX_SEARCH_HITS = 200
+LOG_MAX_BYTES = 5 * 1024 * 1024  # 5MB
+LOG_BACKUPS = 5
+LOG_GZIP = os.getenv("LOG_GZIP", "0") == "1"   # συμπίεση των rotated αρχείων
+TAIL_BLOCK = 64 * 1024
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")        # text | json (JSON lines)
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_ERROR_RESERVE = int(os.getenv("LOG_ERROR_RESERVE", "500"))   # θέσεις μόνο για ERROR+
 # =======================
 # BOT LOGGER
 # =======================
@@ -33,18 +106,149 @@ logger.setLevel(logging.INFO)
 
 
 
+def _gz_lines(f):
+    return (line for line in (raw.rstrip("\r\n") for raw in f) if line)
+
+
+def _reverse_lines(path: str, keep: int = MAX_LOG_LINES):
+    # διαβάζει από το τέλος προς την αρχή σε blocks, χωρίς να περάσει όλο το αρχείο.
+    # Το .gz δεν κάνει seek προς τα πίσω: ένα πέρασμα προς τα εμπρός που κρατάει
+    # μόνο τις τελευταίες `keep` γραμμές
+    if path.endswith(".gz"):
+        with gzip.open(path, "rt", encoding="utf-8", errors="ignore") as f:
+            lines = deque(_gz_lines(f), maxlen=keep)
+        yield from reversed(lines)
+        return
+
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        rest = b""
+        while pos > 0:
+            step = min(TAIL_BLOCK, pos)
+            pos -= step
+            f.seek(pos)
+            parts = (f.read(step) + rest).split(b"\n")
+            rest = parts[0]
+            for line in reversed(parts[1:]):
+                if line:
+                    yield line.decode("utf-8", errors="ignore").rstrip("\r")
+        if rest:
+            yield rest.decode("utf-8", errors="ignore").rstrip("\r")
+
+
+def _first_line(path: str) -> str:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", errors="ignore") as f:
+        return f.readline()
+
+
+def log_files(path: str) -> list[str]:
+    # ενεργό αρχείο + backups του RotatingFileHandler, από το νεότερο στο παλιότερο
+    files = [path]
+    for i in range(1, LOG_BACKUPS + 1):
+        for name in (f"{path}.{i}", f"{path}.{i}.gz"):
+            if os.path.exists(name):
+                files.append(name)
+    return files
+
+
 def tail_lines(path: str, n: int) -> str:
     n = max(1, min(n, MAX_LOG_LINES))
     try:
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            dq = deque(f, maxlen=n)
-        return "".join(dq).strip()
+        lines = []
+        for line in _reverse_lines(path):
+            lines.append(line)
+            if len(lines) >= n:
+                break
+        return "\n".join(reversed(lines)).strip()
     except FileNotFoundError:
         return f"(Δεν βρέθηκε αρχείο: {path})"
     except Exception as e:
         return f"(Σφάλμα ανάγνωσης log: {e})"
 
 
+def _log_ts(line: str) -> str | None:
+    # "2026-01-04 18:25:19,269 INFO - ..." -> "2026-01-04 18:25:19"
+    # '{"ts": "2026-01-04 18:25:19,269", ...' (LOG_FORMAT=json) -> το ίδιο
+    ts = line[8:27] if line.startswith('{"ts": "') else line[:19]
+    if len(ts) == 19 and ts[4] == "-" and ts[10] == " " and ts[13] == ":":
+        return ts
+    return None
+
+
+def _parse_log_time(value: str) -> str | None:
+    for fmt in ("%Y-%m-%dT%H:%M", "%Y-%m-%d", "%H:%M"):
+        try:
+            dt = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if fmt == "%H:%M":
+            dt = datetime.combine(datetime.now().date(), dt.time())
+        return dt.strftime("%Y-%m-%d %H:%M:%S")
+    return None
+
+
+def _search_gz(
+    path: str, match, since: str | None, until: str | None, limit: int
+) -> tuple[list[str], bool]:
+    # προς τα εμπρός με μνήμη μόνο για τα τελευταία `limit` hits· True αν
+    # βρέθηκαν γραμμές πριν το since (τα παλιότερα αρχεία δεν χρειάζονται)
+    hits: deque[str] = deque(maxlen=limit)
+    older = False
+    with gzip.open(path, "rt", encoding="utf-8", errors="ignore") as f:
+        for line in _gz_lines(f):
+            if since or until:
+                ts = _log_ts(line)
+                if ts is None:
+                    continue
+                if since and ts < since:
+                    older = True
+                    continue
+                if until and ts > until:
+                    break
+            if match(line):
+                hits.append(line)
+    return list(hits), older
+
+
+def search_logs(
+    path: str,
+    match,
+    since: str | None = None,
+    until: str | None = None,
+    limit: int = MAX_SEARCH_HITS,
+) -> list[str]:
+    # Από το νεότερο προς το παλιότερο σε όλα τα rotated αρχεία· σταματάει
+    # μόλις βρει `limit` γραμμές ή περάσει πριν το `since`.
+    hits: list[str] = []
+    for name in log_files(path):
+        try:
+            if until:
+                first_ts = _log_ts(_first_line(name))
+                if first_ts and first_ts > until:
+                    continue   # όλο το αρχείο είναι μετά το until
+            if name.endswith(".gz"):
+                found, older = _search_gz(name, match, since, until, limit - len(hits))
+                hits.extend(reversed(found))
+                if older or len(hits) >= limit:
+                    return list(reversed(hits))
+                continue
+            for line in _reverse_lines(name):
+                if since or until:
+                    ts = _log_ts(line)
+                    if ts is None or (until and ts > until):
+                        continue
+                    if since and ts < since:
+                        return list(reversed(hits))
+                if match(line):
+                    hits.append(line)
+                    if len(hits) >= limit:
+                        return list(reversed(hits))
+        except FileNotFoundError:
+            continue
+    return list(reversed(hits))
+
+
 async def reply_code(update: Update, text: str) -> None:
     # κόψε για να χωράει στο Telegram
     if len(text) > MAX_TELEGRAM_CHARS:
@@ -68,7 +272,7 @@ async def logs_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if context.args and context.args[0].isdigit():
         n = int(context.args[0])
 
-    text = tail_lines(ACTIVITY_LOG, n) or "(κενό)"
+    text = await asyncio.to_thread(tail_lines, ACTIVITY_LOG, n) or "(κενό)"
     await reply_code(update, text)
 
 
@@ -82,10 +286,28 @@ async def errors_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     if context.args and context.args[0].isdigit():
         n = int(context.args[0])
 
-    text = tail_lines(ERROR_LOG, n) or "(κενό)"
+    text = await asyncio.to_thread(tail_lines, ERROR_LOG, n) or "(κενό)"
     await reply_code(update, text)
 
 
+def log_matcher(pattern: str):
+    # "re:..." = regex, αλλιώς substring· και τα δύο χωρίς πεζά/κεφαλαία
+    if pattern.startswith("re:"):
+        return re.compile(pattern[3:], re.IGNORECASE).search
+    needle = pattern.lower()
+
+    def match(line: str) -> bool:
+        return needle in line.lower()
+    return match
+
+
+USAGE_LOGSEARCH = (
+    "Χρήση: /logsearch λέξη [hits] [since=...] [until=...]\n"
+    "π.χ. /logsearch set 50\n"
+    "/logsearch re:chat_id=64\\d+ since=2026-01-04T18:00"
+)
+
+
 async def logsearch_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.effective_chat.id
     if not is_admin(chat_id):
@@ -93,52 +315,159 @@ async def logsearch_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         return
 
     if not context.args:
-        await update.message.reply_text("Χρήση: /logsearch λέξη [lines]\nπ.χ. /logsearch set 500")
+        await update.message.reply_text(USAGE_LOGSEARCH)
+        return
+
+    pattern = None
+    limit = MAX_SEARCH_HITS
+    since = until = None
+    for arg in context.args:
+        if arg.isdigit():
+            limit = max(1, min(int(arg), MAX_LOG_LINES))
+        elif arg.startswith(("since=", "until=")):
+            key, _, value = arg.partition("=")
+            ts = _parse_log_time(value)
+            if ts is None:
+                await update.message.reply_text(f"❌ Λάθος ώρα: {value} (π.χ. 2026-01-04T18:00)")
+                return
+            if key == "since":
+                since = ts
+            else:
+                until = ts
+        elif pattern is None:
+            pattern = arg
+
+    if pattern is None:
+        await update.message.reply_text(USAGE_LOGSEARCH)
         return
 
-    needle = context.args[0].lower()
-    n = 500
-    if len(context.args) >= 2 and context.args[1].isdigit():
-        n = int(context.args[1])
+    try:
+        match = log_matcher(pattern)
+    except re.error as e:
+        await update.message.reply_text(f"❌ Λάθος regex: {e}")
+        return
 
-    block = tail_lines(ACTIVITY_LOG, n)
-    hits = [line for line in block.splitlines() if needle in line.lower()]
+    hits = await asyncio.to_thread(search_logs, ACTIVITY_LOG, match, since, until, limit)
+    await reply_code(update, "\n".join(hits) or "(δεν βρέθηκε)")
 
-    out = "\n".join(hits[-200:])  # κόφ’το για να μη γίνεται τεράστιο
-    await reply_code(update, out or "(δεν βρέθηκε)")
 
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
 
 
-# ---- Activity handler (INFO+) ----
-activity_handler = RotatingFileHandler(
-    ACTIVITY_LOG,
-    maxBytes=5 * 1024 * 1024,  # 5MB
-    backupCount=5,
-    encoding="utf-8",
-)
-activity_handler.setLevel(logging.INFO)
-activity_handler.setFormatter(
-    logging.Formatter("%(asctime)s %(levelname)s - %(message)s")
-)
+class JsonLineFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
 
-# ---- Error handler (ERROR+) ----
-error_handler = RotatingFileHandler(
-    ERROR_LOG,
-    maxBytes=5 * 1024 * 1024,  # 5MB
-    backupCount=5,
-    encoding="utf-8",
-)
-error_handler.setLevel(logging.ERROR)
-error_handler.setFormatter(
-    logging.Formatter("%(asctime)s %(levelname)s - %(message)s")
-)
 
-# ---- Attach handlers ----
-logger.addHandler(activity_handler)
-logger.addHandler(error_handler)
+def _log_formatter() -> logging.Formatter:
+    if LOG_FORMAT == "json":
+        return JsonLineFormatter()
+    return logging.Formatter("%(asctime)s %(levelname)s - %(message)s")
+
+
+class BoundedQueueHandler(QueueHandler):
+    # Ο logger μόνο βάζει το record σε ουρά· τα αρχεία (και το rotation) τα
+    # γράφει το thread του QueueListener. Ποτέ δεν περιμένει (καλείται από το
+    # event loop): πάνω από `limit` χάνονται τα INFO/WARNING, τα ERROR έχουν
+    # τις τελευταίες LOG_ERROR_RESERVE θέσεις της ουράς· ό,τι χαθεί μετριέται.
+    def __init__(self, q: queue.Queue, limit: int) -> None:
+        super().__init__(q)
+        self.limit = limit
+        self.dropped = 0
+        self.dropped_errors = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # κρατάμε exc_info ώστε ο formatter του αρχείου (text/json) να
+        # γράψει μόνος του το traceback
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if (self.dropped or self.dropped_errors) and self.queue.qsize() < self.limit // 2:
+            lost, errors, self.dropped, self.dropped_errors = self.dropped, self.dropped_errors, 0, 0
+            self._put(logging.makeLogRecord({
+                "name": record.name, "levelno": logging.WARNING, "levelname": "WARNING",
+                "msg": f"LOG queue overflow, dropped={lost} errors={errors}",
+            }))
+        self._put(record)
+
+    def _put(self, record: logging.LogRecord) -> None:
+        error = record.levelno >= logging.ERROR
+        try:
+            if not error and self.queue.qsize() >= self.limit:
+                raise queue.Full
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if error:
+                self.dropped_errors += 1
+            else:
+                self.dropped += 1
+            metrics.inc("bot_log_dropped_total", level=record.levelname)
+
+
+# Τα file handlers και ο listener thread στήνονται μόνο από το main()/bench,
+# όχι στο import: ένα CLI εργαλείο ή ένα test που κάνει `import bot` δεν
+# ανοίγει αρχεία log ούτε ξεκινά thread.
+_log_listener: QueueListener | None = None
+
+
+def setup_logging() -> None:
+    global _log_listener
+    if _log_listener is not None:
+        return
+    # ---- Activity handler (INFO+) ----
+    activity_handler = RotatingFileHandler(
+        ACTIVITY_LOG,
+        maxBytes=LOG_MAX_BYTES,
+        backupCount=LOG_BACKUPS,
+        encoding="utf-8",
+    )
+    activity_handler.setLevel(logging.INFO)
+    activity_handler.setFormatter(_log_formatter())
+
+    # ---- Error handler (ERROR+) ----
+    error_handler = RotatingFileHandler(
+        ERROR_LOG,
+        maxBytes=LOG_MAX_BYTES,
+        backupCount=LOG_BACKUPS,
+        encoding="utf-8",
+    )
+    error_handler.setLevel(logging.ERROR)
+    error_handler.setFormatter(_log_formatter())
+
+    if LOG_GZIP:
+        for _h in (activity_handler, error_handler):
+            _h.namer = lambda name: name + ".gz"
+            _h.rotator = _gzip_rotator
+
+    # ---- Attach handlers (μέσω ουράς, τα αρχεία γράφονται σε άλλο thread) ----
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE + LOG_ERROR_RESERVE)
+    queue_handler = BoundedQueueHandler(log_queue, LOG_QUEUE_SIZE)
+    log_listener = QueueListener(log_queue, activity_handler, error_handler, respect_handler_level=True)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    logger.addHandler(queue_handler)
+
+    # ---- No console output ----
+    logger.propagate = False
+    _log_listener = log_listener
 
-# ---- No console output ----
-logger.propagate = False
 
 # =======================
 # DISABLE LIBRARY LOGS
@@ -151,16 +480,16 @@ logging.getLogger("apscheduler").disabled = True
 DB_PATH = "bot.db"
 TZ = ZoneInfo("Europe/Athens")
 ADMIN_CHAT_IDS = {6447601553}
-DAY_MAP = {
-    "δευτερα": 0, "δευτέρα": 0, "δευτ": 0,
-    "τριτη": 1, "τρίτη": 1, "τριτ": 1,
-    "τεταρτη": 2, "τετάρτη": 2, "τεταρ": 2,
-    "πεμπτη": 3, "πέμπτη": 3, "πεμπ": 3,
-    "παρασκευη": 4, "παρασκευή": 4, "παρασκ": 4,
-    "σαββατο": 5, "σάββατο": 5, "σαβ": 5,
-    "κυριακη": 6, "κυριακή": 6, "κυρ": 6,
-}
 DAY_NAMES = ["Δευτέρα", "Τρίτη", "Τετάρτη", "Πέμπτη", "Παρασκευή", "Σάββατο", "Κυριακή"]
+# ομάδες ημερών, χωρίς τόνους (βλ. parse_days)
+DAY_SETS = {
+    "καθε μερα": (0, 1, 2, 3, 4, 5, 6),
+    "καθημερινα": (0, 1, 2, 3, 4, 5, 6),
+    "καθημερινες": (0, 1, 2, 3, 4),
+    "σαββατοκυριακο": (5, 6),
+    "σαββατοκυριακα": (5, 6),
+}
+PARSE_MAX_LEN = 120   # μεγαλύτερο μήνυμα δεν είναι ρύθμιση, απορρίπτεται αμέσως
 HELP_TEXT = (
     "🤖 *Ρυθμίσεις μηνύματος*\n\n"
     "Με αυτό το bot διαλέγεις *πότε* θέλεις να σου έρχεται το μήνυμα.\n\n"
@@ -174,458 +503,4011 @@ HELP_TEXT = (
     "Απλά αντέγραψε ένα από τα παρακάτω (ή γράψε το δικό σου):\n\n"
     "`/set Κυριακή 23:58`\n"
     "`Δευτέρα 08:00`\n"
-    "`/set 21:15`\n\n"
+    "`/set 21:15`\n"
+    "`/set καθημερινές 07:30`\n"
+    "`/set Δευ-Παρ 08:00`\n\n"
+    "➕ *Κι άλλη μέρα/ώρα*\n"
+    "`/add Σάββατο 10:00`\n"
+    "`/del Σάββατο`\n\n"
     "━━━━━━━━━━━━━━\n"
     "📅 *Δες τη ρύθμισή σου*\n"
     "/when\n\n"
+    "🌍 *Ζώνη ώρας* (default Αθήνα)\n"
+    "`/tz Europe/London`\n\n"
     "━━━━━━━━━━━━━━\n"
     "💡 *Tips*\n"
-    "• Αν γράψεις μόνο ώρα, κρατάει την ίδια μέρα\n"
+    "• Αν γράψεις μόνο ώρα, κρατάει τις ίδιες μέρες\n"
     "• Μπορείς να στείλεις και σκέτο μήνυμα, χωρίς /set\n"
     "• Παράδειγμα: `Τετάρτη 18:30`\n"
 )
 
-def main_menu_keyboard() -> InlineKeyboardMarkup:
+# Τα keyboards είναι immutable (frozen TelegramObject): φτιάχνονται μία φορά,
+# στην πρώτη χρήση (μετά το load_telegram), και ξαναχρησιμοποιούνται σε κάθε απάντηση.
+@functools.cache
+def main_menu() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [InlineKeyboardButton("▶️ Ενεργοποίηση", callback_data="action:start"),
          InlineKeyboardButton("⏸️ Παύση", callback_data="action:stop")],
         [InlineKeyboardButton("🛠️ Ρύθμιση", callback_data="action:set"),
          InlineKeyboardButton("📅 Tρέχουσα Ρύθμιση", callback_data="action:when")],
-        [InlineKeyboardButton("ℹ️ Help", callback_data="action:help")],
+        [InlineKeyboardButton("🌍 Ζώνη ώρας", callback_data="action:tz"),
+         InlineKeyboardButton("ℹ️ Help", callback_data="action:help")],
     ])
 
-def parse_day_time(text: str) -> tuple[int, int, int] | None:
-    t = text.strip().lower()
 
-    m = re.search(r"(\d{1,2})[:.](\d{2})", t)
-    if not m:
+@functools.cache
+def day_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        [
+            [InlineKeyboardButton(DAY_NAMES[dow], callback_data=f"setday:{dow}") for dow in range(i, min(i + 2, 7))]
+            for i in range(0, 7, 2)
+        ]
+        + [[InlineKeyboardButton("⬅️ Πίσω", callback_data="action:help")]]
+    )
+
+
+# Ένα compiled regex για όλα: το κείμενο γίνεται πεζά χωρίς τόνους και
+# διαβάζεται σε ένα πέρασμα. Μέρα = ολόκληρη λέξη που είναι το όνομα (και
+# πτώσεις/πληθυντικός) ή πρόθεμά του με 3+ γράμματα· τα "τρ", "τε" κτλ. δεν
+# ταιριάζουν ποτέ, και οι εναλλακτικές είναι ταξινομημένες από τη μεγαλύτερη.
+_FOLD = str.maketrans("άέήίόύώϊϋΐΰ", "αεηιουωιυιυ")
+_TIME_RE = re.compile(r"(?<!\d)([01]?\d|2[0-3])[:.]([0-5]\d)(?!\d)")
+
+
+def _day_forms() -> dict[str, int]:
+    forms: dict[str, int] = {}
+    for dow, name in enumerate(DAY_NAMES):
+        base = name.lower().translate(_FOLD)
+        for n in range(3, len(base) + 1):
+            forms[base[:n]] = dow
+        # δευτερας, δευτερες, σαββατου, σαββατα
+        for form in (base + "ς", base[:-1] + "ες", base[:-1] + "ου", base[:-1] + "α"):
+            forms.setdefault(form, dow)
+    return forms
+
+
+_DAY_FORMS = _day_forms()
+_LETTER = r"[^\W\d_]"
+_TOKEN_RE = re.compile(
+    rf"(?<!{_LETTER})(?:"
+    rf"(?P<set>καθε\s+μερα|{'|'.join(sorted((k for k in DAY_SETS if ' ' not in k), key=len, reverse=True))})"
+    rf"|(?P<day>{'|'.join(sorted(_DAY_FORMS, key=len, reverse=True))})"
+    rf"|(?P<range>εως|ως|μεχρι)"
+    rf")(?!{_LETTER})"
+    rf"|(?P<dash>[-–])"
+)
+
+
+def parse_days(text: str) -> tuple[int, ...]:
+    # "Δευτέρα, Τετάρτη", "Δευ-Παρ", "Παρασκευή έως Δευτέρα", "καθημερινές"
+    days: set[int] = set()
+    prev = None          # τελευταία μέρα, για εύρος
+    in_range = False
+    for m in _TOKEN_RE.finditer(text.lower().translate(_FOLD)):
+        kind = m.lastgroup
+        if kind == "day":
+            dow = _DAY_FORMS[m.group("day")]
+            if in_range:
+                days.update((prev + k) % 7 for k in range((dow - prev) % 7 + 1))
+            else:
+                days.add(dow)
+            prev, in_range = dow, False
+        elif kind == "set":
+            days.update(DAY_SETS[" ".join(m.group("set").split())])
+            prev, in_range = None, False
+        else:
+            in_range = prev is not None
+    return tuple(sorted(days))
+
+
+def parse_day_time(text: str) -> tuple[tuple[int, ...], int, int] | None:
+    # (μέρες, ώρα, λεπτό)· μέρες=() όταν δόθηκε μόνο ώρα. Ό,τι δεν έχει ώρα
+    # (η συζήτηση σε groups) κόβεται εδώ, πριν από κάθε άλλη δουλειά.
+    if len(text) > PARSE_MAX_LEN:
         return None
-    hour = int(m.group(1))
-    minute = int(m.group(2))
-    if not (0 <= hour <= 23 and 0 <= minute <= 59):
+    m = _TIME_RE.search(text)
+    if m is None:
         return None
+    return parse_days(text), int(m.group(1)), int(m.group(2))
 
-    dow = None
-    for k, v in DAY_MAP.items():
-        if k in t:
-            dow = v
-            break
 
-    return (dow if dow is not None else -1, hour, minute)
+def describe_days(days: list[int]) -> str:
+    for label, group in (("Κάθε μέρα", 7), ("Καθημερινές", 5)):
+        if days == list(range(group)):
+            return label
+    if days == [5, 6]:
+        return "Σαββατοκύριακο"
+    return ", ".join(DAY_NAMES[d] for d in days)
 
 
-async def init_db() -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            """
-            CREATE TABLE IF NOT EXISTS chats (
-                chat_id INTEGER PRIMARY KEY,
-                enabled INTEGER NOT NULL DEFAULT 1,
-                dow INTEGER NOT NULL DEFAULT 0,      -- 0=Mon ... 6=Sun
-                hour INTEGER NOT NULL DEFAULT 8,
-                minute INTEGER NOT NULL DEFAULT 0
-            )
-            """
-        )
+def describe_schedules(scheds: list[tuple[int, int, int]]) -> str:
+    # μία γραμμή ανά ώρα: "Καθημερινές στις 08:00"
+    by_time: dict[tuple[int, int], list[int]] = {}
+    for dow, hour, minute in scheds:
+        by_time.setdefault((hour, minute), []).append(dow)
+    return "\n".join(
+        f"{describe_days(sorted(days))} στις {hour:02d}:{minute:02d}"
+        for (hour, minute), days in sorted(by_time.items())
+    ) or "(κανένα πρόγραμμα)"
 
-        # Migration για παλιές βάσεις που είχαν μόνο chat_id/enabled
-        cols = {row[1] async for row in await db.execute("PRAGMA table_info(chats)")}
-        if "dow" not in cols:
-            await db.execute("ALTER TABLE chats ADD COLUMN dow INTEGER NOT NULL DEFAULT 0")
-        if "hour" not in cols:
-            await db.execute("ALTER TABLE chats ADD COLUMN hour INTEGER NOT NULL DEFAULT 8")
-        if "minute" not in cols:
-            await db.execute("ALTER TABLE chats ADD COLUMN minute INTEGER NOT NULL DEFAULT 0")
 
-        await db.commit()
+# =======================
+# METRICS
+# =======================
+# Counters/gauges/histograms στη μνήμη. Τα βλέπει ο admin με /metrics και,
+# αν οριστεί METRICS_PORT, ένα Prometheus endpoint μόνο στο 127.0.0.1.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))   # 0 = κλειστό
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+HTTP_MAX_BODY = 1024 * 1024
+HTTP_MAX_HEADERS = 100
+HTTP_IDLE_TIMEOUT = 30.0          # s, keep-alive χωρίς νέο request
+HTTP_READ_TIMEOUT = 10.0          # s, για όλο το request (και για την απάντηση)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))   # ανά server· >= WEBHOOK_MAX_CONNECTIONS
 
 
-async def set_enabled(chat_id: int, enabled: bool) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            """
-            INSERT INTO chats (chat_id, enabled)
-            VALUES (?, ?)
-            ON CONFLICT(chat_id) DO UPDATE SET enabled=excluded.enabled
-            """,
-            (chat_id, 1 if enabled else 0),
-        )
-        await db.commit()
+def _prom_escape(value) -> str:
+    # exposition format: \\, \" και \n μέσα στις τιμές των labels
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
 
 
-async def get_enabled_chat_ids() -> list[int]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT chat_id FROM chats WHERE enabled=1")
-        rows = await cur.fetchall()
-        return [r[0] for r in rows]
+class Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
 
-async def get_counts() -> tuple[int, int]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT COUNT(*) FROM chats WHERE enabled=1")
-        enabled_count = (await cur.fetchone())[0]
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # τελευταίο = +Inf
+        self.total = 0.0
+        self.count = 0
 
-        cur = await db.execute("SELECT COUNT(*) FROM chats")
-        total_count = (await cur.fetchone())[0]
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
 
-        return enabled_count, total_count
+    def quantile(self, q: float) -> float:
+        # άνω όριο του bucket όπου πέφτει το q (αρκετό για p50/p95)
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
 
-async def set_schedule(chat_id: int, dow: int, hour: int, minute: int) -> None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute(
-            """
-            INSERT INTO chats (chat_id, enabled, dow, hour, minute)
-            VALUES (?, 1, ?, ?, ?)
-            ON CONFLICT(chat_id) DO UPDATE SET
-                dow=excluded.dow,
-                hour=excluded.hour,
-                minute=excluded.minute
-            """,
-            (chat_id, dow, hour, minute),
-        )
-        await db.commit()
 
+class Metrics:
+    def __init__(self) -> None:
+        self.counters: dict[tuple, float] = {}
+        self.gauges: dict[tuple, float] = {}
+        self.histograms: dict[tuple, Histogram] = {}
 
-async def get_schedule(chat_id: int) -> tuple[int, int, int] | None:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT dow, hour, minute FROM chats WHERE chat_id=?", (chat_id,))
-        row = await cur.fetchone()
-        if not row:
-            return None
-        return int(row[0]), int(row[1]), int(row[2])
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return (name, tuple(sorted(labels.items())))
 
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = self._key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
 
-async def get_due_chat_ids(dow: int, hour: int, minute: int) -> list[int]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "SELECT chat_id FROM chats WHERE enabled=1 AND dow=? AND hour=? AND minute=?",
-            (dow, hour, minute),
-        )
-        rows = await cur.fetchall()
-        return [r[0] for r in rows]
+    def set(self, name: str, value: float, **labels) -> None:
+        self.gauges[self._key(name, labels)] = value
 
-async def schedule_tick(context: ContextTypes.DEFAULT_TYPE) -> None:
-    now = datetime.now(TZ)
-    dow = now.weekday()     # 0=Mon..6=Sun
-    hour = now.hour
-    minute = now.minute
+    def observe(self, name: str, value: float, buckets: tuple = LATENCY_BUCKETS, **labels) -> None:
+        key = self._key(name, labels)
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram(buckets)
+        hist.observe(value)
 
-    chat_ids = await get_due_chat_ids(dow, hour, minute)
-    if not chat_ids:
-        return
+    def value(self, name: str, **labels) -> float:
+        key = self._key(name, labels)
+        return self.counters.get(key, self.gauges.get(key, 0))
 
-    text = "☀️ Καλημέρα! Αυτό είναι το προγραμματισμένο μήνυμά σου (Δήλωσε ωράρια)."
-    logger.info("SCHEDULE send due=%d day=%s time=%02d:%02d", len(chat_ids), DAY_NAMES[dow], hour, minute)
+    def render_prometheus(self) -> str:
+        def fmt(name: str, labels: tuple, extra: tuple = ()) -> str:
+            items = labels + extra
+            if not items:
+                return name
+            return name + "{" + ",".join(f'{k}="{_prom_escape(v)}"' for k, v in items) + "}"
 
-    for chat_id in chat_ids:
-        try:
-            await context.bot.send_message(chat_id=chat_id, text=text)
-            await asyncio.sleep(0.05)
-        except RetryAfter as e:
-            await asyncio.sleep(e.retry_after)
-        except Forbidden:
-            await set_enabled(chat_id, False)
-        except Exception:
-            logger.exception("Failed sending to chat_id=%s", chat_id)
+        out = []
+        for kind, series in (("counter", self.counters), ("gauge", self.gauges)):
+            for name in sorted({n for n, _ in series}):
+                out.append(f"# TYPE {name} {kind}")
+                for (n, labels), value in sorted(series.items()):
+                    if n == name:
+                        out.append(f"{fmt(name, labels)} {value}")
+        for name in sorted({n for n, _ in self.histograms}):
+            out.append(f"# TYPE {name} histogram")
+            for (n, labels), hist in sorted(self.histograms.items(), key=lambda kv: kv[0]):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, c in zip(hist.buckets + (float("inf"),), hist.counts):
+                    cumulative += c
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    out.append(f"{fmt(name + '_bucket', labels, (('le', le),))} {cumulative}")
+                out.append(f"{fmt(name + '_sum', labels)} {hist.total}")
+                out.append(f"{fmt(name + '_count', labels)} {hist.count}")
+        return "\n".join(out) + "\n"
 
+    def render_summary(self) -> str:
+        lines = []
+        for (name, labels), hist in sorted(self.histograms.items(), key=lambda kv: kv[0]):
+            if not name.endswith("_seconds"):
+                continue
+            label = ",".join(str(v) for _, v in labels) or "-"
+            lines.append(
+                f"{name.removeprefix('bot_').removesuffix('_seconds'):<14} {label:<22} "
+                f"n={hist.count:<7} p50={hist.quantile(0.5) * 1000:.1f}ms "
+                f"p95={hist.quantile(0.95) * 1000:.1f}ms"
+            )
+        for (name, labels), value in sorted(self.counters.items()):
+            if name.endswith("_seconds"):
+                continue
+            label = ",".join(f"{k}={v}" for k, v in labels)
+            lines.append(f"{name.removeprefix('bot_')} {label} = {value:g}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            label = ",".join(f"{k}={v}" for k, v in labels)
+            lines.append(f"{name.removeprefix('bot_')} {label} = {value:.2f}")
+        return "\n".join(lines)
 
-async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text(HELP_TEXT, parse_mode="Markdown")
 
+metrics = Metrics()
 
-async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    logger.info("USER start chat_id=%s user_id=%s", update.effective_chat.id, update.effective_user.id)
 
-    chat_id = update.effective_chat.id
+def timed(metric: str, label: str = "op"):
+    # χρονομετρεί ένα async function: <metric>_seconds{label=όνομα} + errors
+    def decorator(func):
+        name = func.__name__
 
-    # Αν δεν έχει πρόγραμμα ακόμα, βάλε default: Δευτέρα 08:00
-    sched = await get_schedule(chat_id)
-    if not sched:
-        await set_schedule(chat_id, 0, 8, 0)
-        sched = (0, 8, 0)
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                metrics.inc(f"{metric}_errors_total", **{label: name})
+                raise
+            finally:
+                metrics.observe(f"{metric}_seconds", time.perf_counter() - start, **{label: name})
+        return wrapper
+    return decorator
 
-    # Ενεργοποίησε (χωρίς να αλλάξεις την ώρα/μέρα)
-    await set_enabled(chat_id, True)
 
-    dow, hour, minute = sched
+instrument_handler = timed("bot_handler", label="handler")
 
-    await update.message.reply_text(
-        "✅ Ενεργοποιήθηκε!\n\n"
-        f"🗓️ Τρέχουσα ρύθμιση:\n"
-        f"{DAY_NAMES[dow]} στις {hour:02d}:{minute:02d}\n\n"
-        "🔧 Για αλλαγή ώρας, απλά αντέγραψε ένα από τα παρακάτω "
-        "ή στείλε το δικό σου με την ίδια λογική:\n\n"
-        "`/set Κυριακή 23:58`\n"
-        "`Δευτέρα 08:00`\n"
-        "`/set 21:15`\n\n"
-        "ℹ️ Tips:\n"
-        "• Αν γράψεις μόνο ώρα, κρατάει την ίδια μέρα\n"
-        "• Μπορείς να δεις τη ρύθμισή σου με /when\n"
-        "• Οδηγίες: /help",
-        parse_mode="Markdown",
-        reply_markup=main_menu_keyboard(),  # (αν έχεις βάλει τα κουμπιά)
-    )
 
-async def set_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = update.effective_chat.id
-    raw = " ".join(context.args).strip()
+# =======================
+# PER-CHAT ORDERING
+# =======================
+# Με concurrent_updates τα updates τρέχουν παράλληλα· δύο updates του ίδιου
+# chat όμως περνάνε από το ίδιο (FIFO) lock, ώστε π.χ. ένα setday: και η ώρα
+# που ακολουθεί να εφαρμοστούν με τη σειρά που ήρθαν.
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
 
-    if not raw:
-        await update.message.reply_text(
-                "🕒 Ρύθμιση ώρας\n\n"
-                "Παραδείγματα (tap για copy):\n"
-                "`/set Κυριακή 23:58`\n"
-                "`Δευτέρα 08:00`\n"
-                "`/set 21:15`\n\n"
-                "💡 Tip: Αν γράψεις μόνο ώρα, κρατάει την ίδια μέρα.",
-                parse_mode="Markdown",
-        )
-        return
+_chat_locks: dict[int, list] = {}   # chat_id -> [lock, πόσοι το περιμένουν]
 
-    parsed = parse_day_time(raw)
-    if not parsed:
-        await update.message.reply_text("❌ Δεν κατάλαβα. Δοκίμασε π.χ. /set Τετάρτη 18:30")
-        return
 
-    dow, hour, minute = parsed
+def serialize_per_chat(func):
+    @functools.wraps(func)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        chat = update.effective_chat
+        if chat is None:
+            return await func(update, context)
+        entry = _chat_locks.get(chat.id)
+        if entry is None:
+            entry = _chat_locks[chat.id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await func(update, context)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del _chat_locks[chat.id]
+    return wrapper
 
-    # αν δεν έδωσε μέρα, κράτα την παλιά (ή default Δευτέρα)
-    current = await get_schedule(chat_id)
-    if dow == -1:
-        dow = current[0] if current else 0
 
-    await set_schedule(chat_id, dow, hour, minute)
-    logger.info("USER set chat_id=%s day=%s time=%02d:%02d", chat_id, DAY_NAMES[dow], hour, minute)
-    await set_enabled(chat_id, True)
+def chat_handler(func):
+    return instrument_handler(flood_limited(serialize_per_chat(func)))
 
-    await update.message.reply_text(f"✅ ΟΚ! {DAY_NAMES[dow]} στις {hour:02d}:{minute:02d}")
 
+# =======================
+# FLOOD CONTROL (εισερχόμενα)
+# =======================
+# Πριν από το per-chat lock και τη βάση: token bucket ανά chat και ένα
+# global, χωρίς αναμονή (ναι/όχι αμέσως). Ίδιο callback από το ίδιο chat
+# μέσα σε FLOOD_DEBOUNCE s αγνοείται. Ό,τι κόβεται παίρνει φτηνή απάντηση
+# (answerCallbackQuery ή ένα "πιο αργά" ανά FLOOD_NOTICE_INTERVAL), και σε
+# global υπερφόρτωση μόνο τα callbacks απαντιούνται, για να μη φάμε το
+# όριο αποστολών. Μετράει μόνο ό,τι ταίριαξε σε handler (όχι η κουβέντα
+# σε groups)· οι admins εξαιρούνται.
+FLOOD_CHAT_RATE = float(os.getenv("FLOOD_CHAT_RATE", "1"))         # updates/s ανά chat
+FLOOD_CHAT_BURST = float(os.getenv("FLOOD_CHAT_BURST", "5"))
+FLOOD_GLOBAL_RATE = float(os.getenv("FLOOD_GLOBAL_RATE", "100"))    # updates/s συνολικά
+FLOOD_GLOBAL_BURST = float(os.getenv("FLOOD_GLOBAL_BURST", "200"))
+FLOOD_MAX_CHATS = int(os.getenv("FLOOD_MAX_CHATS", "10000"))        # buckets στη μνήμη (LRU)
+FLOOD_DEBOUNCE = float(os.getenv("FLOOD_DEBOUNCE", "1.0"))          # s
+FLOOD_NOTICE_INTERVAL = 30.0
+FLOOD_OK, FLOOD_DEBOUNCED, FLOOD_CHAT, FLOOD_GLOBAL = "ok", "debounced", "chat_limited", "global_limited"
 
-async def when_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = update.effective_chat.id
-    sched = await get_schedule(chat_id)
-    if not sched:
-        await update.message.reply_text("Δεν έχεις ρύθμιση ακόμα. Στείλε /start ή /set Δευτέρα 08:00")
-        return
-    dow, hour, minute = sched
-    await update.message.reply_text(f"🗓️ Ρύθμιση: {DAY_NAMES[dow]} στις {hour:02d}:{minute:02d}\n\n Πάτα Help για επιστροφή στο μενού.")
 
+class FloodGate:
+    def __init__(self, rate: float, burst: float, global_rate: float, global_burst: float, max_chats: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.global_tokens = global_burst
+        self.global_updated = time.monotonic()
+        self.max_chats = max_chats
+        # chat_id -> [tokens, updated, τελευταίο callback, πότε, τελευταία ειδοποίηση]
+        self.chats: OrderedDict[int, list] = OrderedDict()
 
-async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    txt = (update.message.text or "").strip()
-    if not txt or txt.startswith("/"):
-        return
+    def check(self, chat_id: int, callback: str | None = None) -> str:
+        now = time.monotonic()
+        entry = self.chats.get(chat_id)
+        if entry is None:
+            entry = self.chats[chat_id] = [self.burst, now, None, 0.0, 0.0]
+            if len(self.chats) > self.max_chats:
+                self.chats.popitem(last=False)
+        else:
+            self.chats.move_to_end(chat_id)
+            if callback is not None and callback == entry[2] and now - entry[3] < FLOOD_DEBOUNCE:
+                return FLOOD_DEBOUNCED
+            entry[0] = min(self.burst, entry[0] + (now - entry[1]) * self.rate)
+            entry[1] = now
+        self.global_tokens = min(self.global_burst, self.global_tokens + (now - self.global_updated) * self.global_rate)
+        self.global_updated = now
+        if entry[0] < 1:
+            return FLOOD_CHAT
+        if self.global_tokens < 1:
+            return FLOOD_GLOBAL
+        entry[0] -= 1
+        self.global_tokens -= 1
+        if callback is not None:
+            entry[2], entry[3] = callback, now
+        return FLOOD_OK
 
-    parsed = parse_day_time(txt)
-    if not parsed:
-        return
+    def should_notify(self, chat_id: int) -> bool:
+        entry = self.chats.get(chat_id)
+        now = time.monotonic()
+        if entry is None or now - entry[4] < FLOOD_NOTICE_INTERVAL:
+            return False
+        entry[4] = now
+        return True
 
-    dow, hour, minute = parsed
-    chat_id = update.effective_chat.id
-    current = await get_schedule(chat_id)
-    if dow == -1:
-        dow = current[0] if current else 0
 
-    await set_schedule(chat_id, dow, hour, minute)
-    logger.info("USER set_text chat_id=%s day=%s time=%02d:%02d", chat_id, DAY_NAMES[dow], hour, minute)
-    await set_enabled(chat_id, True)
-    await update.message.reply_text(f"✅ Ρυθμίστηκε: {DAY_NAMES[dow]} στις {hour:02d}:{minute:02d}")
+_flood = FloodGate(FLOOD_CHAT_RATE, FLOOD_CHAT_BURST, FLOOD_GLOBAL_RATE, FLOOD_GLOBAL_BURST, FLOOD_MAX_CHATS)
 
 
-async def stop_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    logger.info("USER stop chat_id=%s user_id=%s", update.effective_chat.id, update.effective_user.id)
-    chat_id = update.effective_chat.id
-    await set_enabled(chat_id, False)
-    await update.message.reply_text("⏸️ Έγινε παύση. Στείλε /start για να ξαναξεκινήσει.")
+def flood_limited(func):
+    @functools.wraps(func)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        chat = update.effective_chat
+        if chat is None or chat.id in ADMIN_CHAT_IDS:
+            return await func(update, context)
+        query = update.callback_query
+        verdict = _flood.check(chat.id, query.data if query is not None else None)
+        metrics.inc("bot_inbound_total", result=verdict)
+        metrics.set("bot_inbound_chats", len(_flood.chats))
+        if verdict == FLOOD_OK:
+            return await func(update, context)
 
-async def sendnow_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    admin_chat_id = update.effective_chat.id
-    if admin_chat_id not in ADMIN_CHAT_IDS:
-        await update.message.reply_text("⛔ Δεν έχεις δικαίωμα για αυτή την εντολή.")
-        return
+        # φτηνή απάντηση, χωρίς βάση και χωρίς edit
+        with suppress(TelegramError):
+            if query is not None:
+                await query.answer("⏳ Πιο αργά…" if verdict != FLOOD_DEBOUNCED else None)
+            elif verdict == FLOOD_CHAT and update.effective_message and _flood.should_notify(chat.id):
+                metrics.inc("bot_inbound_notices_total")
+                await update.effective_message.reply_text("⏳ Πολλά μηνύματα μαζί, δοκίμασε ξανά σε λίγο.")
+    return wrapper
 
-    # Παίρνουμε το custom μήνυμα μετά το /sendnow
-    custom_text = " ".join(context.args).strip()
-    if not custom_text:
-        await update.message.reply_text("Χρήση: /sendnow το μήνυμα εδώ")
-        return
 
-    chat_ids = await get_enabled_chat_ids()
-    if not chat_ids:
-        await update.message.reply_text("❌ Δεν υπάρχουν ενεργοί χρήστες.")
+async def edit_menu(query, text: str, reply_markup=None, parse_mode: str | None = None) -> None:
+    # ίδιο κείμενο και κουμπιά με το τρέχον μήνυμα: κανένα edit
+    # (το Telegram θα απαντούσε "message is not modified")
+    message = query.message
+    if parse_mode is None and message is not None and message.text == text and message.reply_markup == reply_markup:
+        metrics.inc("bot_edits_skipped_total")
         return
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            raise
+        metrics.inc("bot_edits_skipped_total")
 
-    sent = 0
-    failed = 0
 
-    for target_chat_id in chat_ids:
-        try:
-            await context.bot.send_message(chat_id=target_chat_id, text=custom_text)
-            sent += 1
-            await asyncio.sleep(0.05)
-        except RetryAfter as e:
-            await asyncio.sleep(e.retry_after)
-            # retry μία φορά μετά το sleep
-            try:
-                await context.bot.send_message(chat_id=target_chat_id, text=custom_text)
-                sent += 1
-            except Exception:
-                failed += 1
-        except Forbidden:
-            await set_enabled(target_chat_id, False)
-            failed += 1
-        except Exception:
-            logger.exception("Failed sending to chat_id=%s", target_chat_id)
-            failed += 1
+async def read_http_request(reader: asyncio.StreamReader) -> tuple[str, str, dict[str, str], bytes] | None:
+    # ελάχιστο HTTP/1.1: request line, headers, Content-Length body. Keep-alive
+    # μέχρι HTTP_IDLE_TIMEOUT και μετά όλο το request μέσα σε HTTP_READ_TIMEOUT,
+    # ώστε ένας αργός (slowloris) client να μην κρατάει τη σύνδεση για πάντα
+    line = await asyncio.wait_for(reader.readline(), HTTP_IDLE_TIMEOUT)
+    if not line:
+        return None
+    return await asyncio.wait_for(_read_http_rest(reader, line), HTTP_READ_TIMEOUT)
 
-    await update.message.reply_text(f"✅ Στάλθηκε σε {sent} | ❌ Απέτυχε σε {failed}")
 
+async def _read_http_rest(reader: asyncio.StreamReader, line: bytes) -> tuple[str, str, dict[str, str], bytes]:
+    method, path, _ = line.decode("latin-1").split(" ", 2)
+    headers = {}
+    while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+        if len(headers) >= HTTP_MAX_HEADERS:
+            raise ValueError("too many headers")
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0") or 0)
+    if length > HTTP_MAX_BODY:
+        raise ValueError(f"body too large: {length}")
+    body = await reader.readexactly(length) if length else b""
+    return method, path, headers, body
 
-async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    chat_id = update.effective_chat.id
-    if chat_id not in ADMIN_CHAT_IDS:
-        await update.message.reply_text("⛔ Δεν έχεις δικαίωμα για αυτή την εντολή.")
-        return
 
-    enabled_count, total_count = await get_counts()
-    await update.message.reply_text(
-        f"📊 Stats:\n✅ Ενεργοί: {enabled_count}\n👥 Σύνολο: {total_count}"
+async def write_http_response(
+    writer: asyncio.StreamWriter,
+    status: int,
+    body: bytes,
+    content_type: str = "text/plain; charset=utf-8",
+) -> None:
+    reason = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden",
+              404: "Not Found", 405: "Method Not Allowed", 429: "Too Many Requests",
+              503: "Service Unavailable"}.get(status, "OK")
+    writer.write(
+        f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
     )
+    await asyncio.wait_for(writer.drain(), HTTP_READ_TIMEOUT)
 
 
-async def on_startup(app: Application) -> None:
-    await init_db()
+def http_limited(handler, server: str, limit: int = HTTP_MAX_CONNECTIONS):
+    # όριο ταυτόχρονων συνδέσεων: πάνω από αυτό κλείνει αμέσως
+    active = 0
 
-    # Scheduler: τρέχει κάθε 60 δευτερόλεπτα
-    app.job_queue.run_repeating(
-        schedule_tick,
-        interval=60,
-        first=1,
-        name="schedule_tick",
-    )
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        nonlocal active
+        if active >= limit:
+            metrics.inc("bot_http_rejected_total", server=server)
+            writer.close()
+            return
+        active += 1
+        metrics.set("bot_http_connections", active, server=server)
+        try:
+            await handler(reader, writer)
+        finally:
+            active -= 1
+            metrics.set("bot_http_connections", active, server=server)
 
-async def menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query
-    await query.answer()  # σημαντικό!
+    return handle
 
-    chat_id = query.message.chat_id
-    data = query.data
-    if data in {"action:start", "action:stop", "action:set"}:
-        logger.info("USER button chat_id=%s action=%s", chat_id, data)
 
+async def _metrics_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while request := await read_http_request(reader):
+            method, path, _, _ = request
+            if method == "GET" and path.split("?")[0] == "/metrics":
+                await write_http_response(
+                    writer, 200, metrics.render_prometheus().encode(),
+                    "text/plain; version=0.0.4; charset=utf-8",
+                )
+            else:
+                await write_http_response(writer, 404, b"not found")
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError, TimeoutError):
+        pass
+    finally:
+        writer.close()
 
-    if data == "action:start":
-        sched = await get_schedule(chat_id)
-        if not sched:
-            await set_schedule(chat_id, 0, 8, 0)
-            sched = (0, 8, 0)
-        await set_enabled(chat_id, True)
-        dow, hour, minute = sched
-        await query.edit_message_text(
-            f"✅ Ενεργοποιήθηκε!\n🗓️ {DAY_NAMES[dow]} στις {hour:02d}:{minute:02d}",
-            reply_markup=main_menu_keyboard(),
-        )
 
-    elif data == "action:stop":
-        await set_enabled(chat_id, False)
-        await query.edit_message_text(
-            "⏸️ Έγινε παύση.",
-            reply_markup=main_menu_keyboard(),
-        )
-    elif data == "action:set":
-        keyboard = [
-            [
-                InlineKeyboardButton("Δευτέρα", callback_data="setday:0"),
-                InlineKeyboardButton("Τρίτη", callback_data="setday:1"),
-            ],
-            [
-                InlineKeyboardButton("Τετάρτη", callback_data="setday:2"),
-                InlineKeyboardButton("Πέμπτη", callback_data="setday:3"),
-            ],
-            [
-                InlineKeyboardButton("Παρασκευή", callback_data="setday:4"),
-                InlineKeyboardButton("Σάββατο", callback_data="setday:5"),
-            ],
-            [
-                InlineKeyboardButton("Κυριακή", callback_data="setday:6"),
-            ],
-            [
-                InlineKeyboardButton("⬅️ Πίσω", callback_data="action:help"),
-            ],
-        ]
-        await query.edit_message_text(
-            "📅 Διάλεξε μέρα για το μήνυμα:",
-            reply_markup=InlineKeyboardMarkup(keyboard),
-        )
+async def start_metrics_server() -> asyncio.AbstractServer | None:
+    if not METRICS_PORT:
+        return None
+    server = await asyncio.start_server(http_limited(_metrics_http, "metrics"), "127.0.0.1", METRICS_PORT)
+    logger.info("METRICS listening on 127.0.0.1:%d", METRICS_PORT)
+    return server
 
 
+# =======================
+# DATABASE (μία κοινή σύνδεση)
+# =======================
+# Μία μόνιμη σύνδεση για όλο το process: ανοίγει στο on_startup, κλείνει στο
+# on_shutdown. Το aiosqlite τρέχει όλες τις εντολές σε ένα worker thread, οπότε
+# οι αναγνώσεις είναι ήδη σειριακές· οι εγγραφές περνάνε επιπλέον από το
+# _db_write_lock ώστε execute+commit να μη μπλέκονται μεταξύ τους.
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",     # με WAL αρκεί, γλιτώνει fsync ανά commit
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",      # ~16MB page cache
+    "PRAGMA mmap_size=268435456",    # 256MB
+    "PRAGMA busy_timeout=5000",
+)
+DB_CACHED_STATEMENTS = 256
 
+WRITE_BATCH_DELAY = 0.005      # s: πόσο περιμένει ο batcher να μαζέψει εγγραφές
+WRITE_BATCH_MAX = 500
 
-    elif data == "action:when":
-        sched = await get_schedule(chat_id)
-        if not sched:
-            await query.edit_message_text(
-                "Δεν έχεις ρύθμιση ακόμα. Πάτα ▶️ Ενεργοποίηση.",
-                reply_markup=main_menu_keyboard(),
-            )
-            return
-        dow, hour, minute = sched
-        await query.edit_message_text(
-            f"📅 Ρύθμιση:\n{DAY_NAMES[dow]} στις {hour:02d}:{minute:02d}\n\n ━━━━━━━━━━━━━━━━━━━━━━━━━━━━",
-            reply_markup=main_menu_keyboard(),
-        )
+_db: aiosqlite.Connection | None = None
+_db_write_lock = asyncio.Lock()
 
-    elif data == "action:help":
-        await query.edit_message_text(
-            HELP_TEXT,
-            parse_mode="Markdown",
-            reply_markup=main_menu_keyboard(),
-    )
 
-async def setday_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query = update.callback_query
-    await query.answer()
+async def db_open() -> aiosqlite.Connection:
+    global _db
+    if _db is None:
+        _db = await aiosqlite.connect(DB_PATH, cached_statements=DB_CACHED_STATEMENTS)
+        for pragma in DB_PRAGMAS:
+            await _db.execute(pragma)
+    return _db
 
-    chat_id = query.message.chat_id
-    dow = int(query.data.split(":")[1])
 
-    # κράτα την τρέχουσα ώρα αν υπάρχει, αλλιώς default 08:00
-    current = await get_schedule(chat_id)
-    hour, minute = (8, 0) if not current else (current[1], current[2])
+async def db_close() -> None:
+    global _db
+    if _db is None:
+        return
+    await _writer.drain()
+    conn, _db = _db, None
+    async with _db_write_lock:
+        await conn.commit()
+        await conn.close()
 
-    await set_schedule(chat_id, dow, hour, minute)
-    logger.info("USER set_day chat_id=%s day=%s", chat_id, DAY_NAMES[dow])
-    await set_enabled(chat_id, True)
 
-    await query.edit_message_text(
-        f"✅ Ορίστηκε μέρα: {DAY_NAMES[dow]}\n\n"
-        "Τώρα στείλε ώρα (copy/paste):\n"
-        "`21:15`\n\n"
-        "ή γράψε π.χ. `Κυριακή 23:58`",
-        parse_mode="Markdown",
-        reply_markup=main_menu_keyboard(),
-    )
+def get_db() -> aiosqlite.Connection:
+    if _db is None:
+        raise RuntimeError("Η βάση δεν έχει ανοίξει (λείπει το db_open στο startup)")
+    return _db
 
 
-def main() -> None:
+@asynccontextmanager
+async def write_txn():
+    # πολλά statements σε ένα transaction της κοινής σύνδεσης: commit στο
+    # τέλος, rollback σε οποιοδήποτε σφάλμα (και cancel), ώστε ένα μισό
+    # transaction να μην το κάνει commit ο επόμενος writer
+    db = get_db()
+    async with _db_write_lock:
+        try:
+            yield db
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+
+
+class WriteBatcher:
+    # Μαζεύει τις μικρές εγγραφές για WRITE_BATCH_DELAY και τις γράφει σε ένα
+    # transaction: συνεχόμενα ίδια statements με executemany, όσα έχουν
+    # RETURNING ένα-ένα. Έτσι τα commits (fsync) ακολουθούν τον χρόνο και όχι
+    # τον αριθμό των updates.
+    def __init__(self) -> None:
+        self._pending: list[tuple[str, tuple, asyncio.Future]] = []
+        self._task: asyncio.Task | None = None
+
+    def submit(self, sql: str, params: tuple) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append((sql, params, fut))
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return fut
+
+    async def drain(self) -> None:
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    async def _run(self) -> None:
+        try:
+            while self._pending:
+                if len(self._pending) < WRITE_BATCH_MAX:
+                    await asyncio.sleep(WRITE_BATCH_DELAY)
+                batch = self._pending[:WRITE_BATCH_MAX]
+                del self._pending[:WRITE_BATCH_MAX]
+                start = time.perf_counter()
+                try:
+                    await self._flush(batch)
+                except BaseException as e:
+                    # π.χ. κλειστή βάση ή αποτυχημένο rollback: κάθε caller του
+                    # batch παίρνει το σφάλμα αντί να περιμένει για πάντα
+                    _fail_futures(batch, e)
+                    if not isinstance(e, Exception):
+                        raise
+                    logger.exception("DB write batch failed size=%d", len(batch))
+                    continue
+                metrics.observe("bot_db_flush_seconds", time.perf_counter() - start)
+                metrics.observe("bot_db_batch_size", len(batch), buckets=SIZE_BUCKETS)
+        finally:
+            self._task = None
+            # βγαίνουμε με pending μόνο σε cancel (shutdown)
+            pending, self._pending = self._pending, []
+            _fail_futures(pending, asyncio.CancelledError())
+
+    async def _flush(self, batch: list[tuple[str, tuple, asyncio.Future]]) -> None:
+        db = get_db()
+        async with _db_write_lock:
+            try:
+                results = []
+                i = 0
+                while i < len(batch):
+                    sql = batch[i][0]
+                    if "RETURNING" in sql:
+                        async with db.execute(sql, batch[i][1]) as cur:
+                            results.append(await cur.fetchone())
+                        i += 1
+                        continue
+                    j = i
+                    while j < len(batch) and batch[j][0] == sql:
+                        j += 1
+                    await db.executemany(sql, [params for _, params, _ in batch[i:j]])
+                    results.extend([None] * (j - i))
+                    i = j
+                await db.commit()
+            except Exception:
+                # κάποιο statement απέτυχε: rollback και ξανά ένα-ένα, σε ένα
+                # transaction με SAVEPOINT ανά εγγραφή, ώστε το exception να το
+                # πάρει μόνο όποιος το προκάλεσε και τα υπόλοιπα να γίνουν ένα commit
+                await db.rollback()
+                results = []
+                await db.execute("BEGIN")
+                try:
+                    for sql, params, _ in batch:
+                        await db.execute("SAVEPOINT write_op")
+                        try:
+                            async with db.execute(sql, params) as cur:
+                                results.append(await cur.fetchone())
+                        except Exception as e:
+                            await db.execute("ROLLBACK TO write_op")
+                            results.append(e)
+                        await db.execute("RELEASE write_op")
+                    await db.commit()
+                except BaseException:
+                    await db.rollback()
+                    raise
+        for (_, _, fut), row in zip(batch, results):
+            if fut.done():
+                continue
+            if isinstance(row, Exception):
+                fut.set_exception(row)
+            else:
+                fut.set_result(row)
+
+
+def _fail_futures(batch: list[tuple[str, tuple, asyncio.Future]], error: BaseException) -> None:
+    for _, _, fut in batch:
+        if fut.done():
+            continue
+        if isinstance(error, asyncio.CancelledError):
+            fut.cancel()
+        else:
+            fut.set_exception(error)
+
+
+_writer = WriteBatcher()
+
+
+async def db_write(sql: str, params: tuple = ()) -> tuple | None:
+    # επιστρέφει την πρώτη γραμμή αν το sql έχει RETURNING
+    return await _writer.submit(sql, params)
+
+
+async def db_write_many(sql: str, rows: list[tuple]) -> None:
+    await asyncio.gather(*(_writer.submit(sql, params) for params in rows))
+
+
+async def db_fetchone(sql: str, params: tuple = ()) -> tuple | None:
+    async with get_db().execute(sql, params) as cur:
+        return await cur.fetchone()
+
+
+async def db_fetchall(sql: str, params: tuple = ()) -> list[tuple]:
+    return list(await get_db().execute_fetchall(sql, params))
+
+
+async def db_data_version() -> int:
+    # αλλάζει μόνο όταν κάνει commit άλλη σύνδεση (άλλο instance)
+    row = await db_fetchone("PRAGMA data_version")
+    return row[0]
+
+
+class LruCache:
+    # Bounded LRU με προαιρετικό TTL (0 = χωρίς λήξη). Όχι thread-safe: όλα
+    # τα handlers τρέχουν στο ίδιο event loop. name -> metrics hits/misses.
+    MISSING = object()
+
+    def __init__(self, name: str, maxsize: int, ttl: float = 0.0) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is not None and (not self.ttl or entry[0] > time.monotonic()):
+            self._data.move_to_end(key)
+            metrics.inc("bot_cache_hits_total", cache=self.name)
+            return entry[1]
+        if entry is not None:
+            del self._data[key]
+        metrics.inc("bot_cache_misses_total", cache=self.name)
+        return self.MISSING
+
+    def put(self, key, value) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def discard(self, key) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# =======================
+# MIGRATIONS
+# =======================
+# Η έκδοση του schema είναι στο PRAGMA user_version. Κάθε βήμα τρέχει μία
+# φορά, με τη σειρά, σε δικό του transaction μαζί με το νέο user_version·
+# αν αποτύχει, η βάση μένει στην προηγούμενη έκδοση. Όταν η βάση είναι ήδη
+# τρέχουσα, το startup είναι ένα PRAGMA (χωρίς τα CREATE/ALTER/triggers).
+# Νέο βήμα = νέα συνάρτηση στο τέλος του MIGRATIONS, ποτέ αλλαγή σε παλιό.
+MIGRATE_BACKUP = os.getenv("MIGRATE_BACKUP", "1") == "1"   # backup πριν την αναβάθμιση
+
+
+async def _migrate_baseline(db: aiosqlite.Connection) -> None:
+    # v1: ό,τι έκανε το init_db πριν τα versions· idempotent, ώστε να
+    # περνάει και από παλιές βάσεις (user_version=0) σε οποιαδήποτε μορφή
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id INTEGER PRIMARY KEY,
+            enabled INTEGER NOT NULL DEFAULT 1,
+            dow INTEGER NOT NULL DEFAULT 0,      -- 0=Mon ... 6=Sun
+            hour INTEGER NOT NULL DEFAULT 8,
+            minute INTEGER NOT NULL DEFAULT 0,   -- dow/hour/minute: παλιό μοναδικό schedule
+            tz TEXT NOT NULL DEFAULT 'Europe/Athens'
+        )
+        """
+    )
+
+    # Migration για παλιές βάσεις που είχαν μόνο chat_id/enabled
+    cols = {row[1] for row in await db.execute_fetchall("PRAGMA table_info(chats)")}
+    if "dow" not in cols:
+        await db.execute("ALTER TABLE chats ADD COLUMN dow INTEGER NOT NULL DEFAULT 0")
+    if "hour" not in cols:
+        await db.execute("ALTER TABLE chats ADD COLUMN hour INTEGER NOT NULL DEFAULT 8")
+    if "minute" not in cols:
+        await db.execute("ALTER TABLE chats ADD COLUMN minute INTEGER NOT NULL DEFAULT 0")
+    if "tz" not in cols:
+        await db.execute("ALTER TABLE chats ADD COLUMN tz TEXT NOT NULL DEFAULT 'Europe/Athens'")
+
+    await db.execute(
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+    )
+    await init_zones(db)
+    await init_schedules(db)
+    await init_outbox(db)
+    await init_cluster(db)
+    await init_stats(db)
+
+
+async def _migrate_chat_slots(db: aiosqlite.Connection) -> None:
+    # v2: covering index για το load_schedule_index (chat_id, utc_mow χωρίς lookup στον πίνακα)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_schedules_chat_slot ON schedules (chat_id, utc_mow)")
+
+
+MIGRATIONS = [
+    _migrate_baseline,     # v1
+    _migrate_chat_slots,   # v2
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+async def schema_version(db: aiosqlite.Connection) -> int:
+    return (await db.execute_fetchall("PRAGMA user_version"))[0][0]
+
+
+async def migrate(db: aiosqlite.Connection) -> int:
+    version = await schema_version(db)
+    if version == SCHEMA_VERSION:
+        return version
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Η βάση είναι v{version}, ο κώδικας ξέρει μέχρι v{SCHEMA_VERSION}")
+    tables = (await db.execute_fetchall("SELECT count(*) FROM sqlite_master"))[0][0]
+    if MIGRATE_BACKUP and tables:
+        dest = f"{DB_PATH}.v{version}.bak"
+        size = await asyncio.to_thread(_backup_to, dest)
+        logger.info("MIGRATE backup %s bytes=%d", dest, size)
+    for target in range(version + 1, SCHEMA_VERSION + 1):
+        step = MIGRATIONS[target - 1]
+        start = time.perf_counter()
+        async with _db_write_lock:
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                # άλλο instance μπορεί να το πέρασε όσο περιμέναμε το lock
+                if await schema_version(db) >= target:
+                    await db.rollback()
+                    continue
+                await step(db)
+                await db.execute(f"PRAGMA user_version={target}")
+                await db.commit()
+            except BaseException:
+                await db.rollback()
+                raise
+        logger.info("MIGRATE v%d %s seconds=%.2f", target, step.__name__, time.perf_counter() - start)
+    return SCHEMA_VERSION
+
+
+async def init_db() -> None:
+    db = await db_open()
+    await migrate(db)
+    # runtime state από τη βάση (όχι schema): τρέχει σε κάθε startup
+    _zone_offsets.clear()
+    _zone_offsets.update(await db.execute_fetchall("SELECT tz, utc_offset FROM zones"))
+    _payload_cache.clear()   # τα ids ισχύουν μόνο για αυτή τη βάση
+    await init_deliveries(db)
+
+
+# =======================
+# TIMEZONES (ανά chat)
+# =======================
+# Κάθε chat έχει tz (IANA όνομα) και κάθε schedule utc_mow: το τοπικό
+# dow/hour/minute σε UTC minute-of-week με την τρέχουσα μετατόπιση της ζώνης.
+# Οι μετατοπίσεις ζουν στο zones και το utc_mow το γράφουν triggers, οπότε
+# κάθε instance υπολογίζει το ίδιο. Στις αλλαγές ώρας ο scheduler
+# ξαναϋπολογίζει μαζικά τη ζώνη ακριβώς στο λεπτό της αλλαγής (βλ. apply_transitions).
+TZ_CHOICES = [
+    ("🇬🇷 Αθήνα", "Europe/Athens"),
+    ("🇨🇾 Λευκωσία", "Asia/Nicosia"),
+    ("🇬🇧 Λονδίνο", "Europe/London"),
+    ("🇩🇪 Βερολίνο", "Europe/Berlin"),
+    ("🇺🇸 Νέα Υόρκη", "America/New_York"),
+    ("🇦🇺 Μελβούρνη", "Australia/Melbourne"),
+]
+
+
+@functools.cache
+def tz_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        [
+            [InlineKeyboardButton(label, callback_data=f"settz:{tz}") for label, tz in TZ_CHOICES[i:i + 2]]
+            for i in range(0, len(TZ_CHOICES), 2)
+        ]
+        + [[InlineKeyboardButton("⬅️ Πίσω", callback_data="action:help")]]
+    )
+
+
+TZ_TRANSITION_HORIZON = 400   # μέρες μπροστά για την επόμενη αλλαγή ώρας
+EPOCH_DOW = 3                 # 1/1/1970 ήταν Πέμπτη
+
+# (local - offset) mod εβδομάδα, για triggers (NEW.) και bulk updates
+_UTC_MOW_SQL = "(({p}dow * 1440 + {p}hour * 60 + {p}minute - ({off})) % 10080 + 10080) % 10080"
+_ZONE_OFFSET_SQL = """COALESCE((
+    SELECT z.utc_offset FROM chats c JOIN zones z ON z.tz=c.tz WHERE c.chat_id={p}chat_id
+), 0)"""
+
+_zone_offsets: dict[str, int] = {}   # tz -> λεπτά από UTC που ισχύουν στο utc_mow
+_zone_next: dict[str, int] = {}      # tz -> epoch minute της επόμενης αλλαγής
+
+
+def parse_tz(name: str) -> str | None:
+    try:
+        return ZoneInfo(name.strip()).key
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def zone_offset(tz: str, epoch_min: int) -> int:
+    return int(datetime.fromtimestamp(epoch_min * 60, ZoneInfo(tz)).utcoffset().total_seconds() // 60)
+
+
+def utc_slot(epoch_min: int) -> int:
+    return (epoch_min + EPOCH_DOW * 1440) % MINUTES_PER_WEEK
+
+
+def zone_slot(local_mow: int, tz: str) -> int:
+    # τοπικό minute-of-week -> UTC με τη μετατόπιση που ισχύει τώρα για τη ζώνη
+    return (local_mow - _zone_offsets.get(tz, 0)) % MINUTES_PER_WEEK
+
+
+def next_transition(tz: str, after_min: int) -> int:
+    # πρώτο λεπτό μετά το after_min με άλλη μετατόπιση (ανά μέρα, μετά δυαδικά)
+    base = zone_offset(tz, after_min)
+    lo = after_min
+    for day in range(1, TZ_TRANSITION_HORIZON + 1):
+        hi = after_min + day * 1440
+        if zone_offset(tz, hi) != base:
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if zone_offset(tz, mid) == base:
+                    lo = mid
+                else:
+                    hi = mid
+            return hi
+        lo = hi
+    return lo   # καμία αλλαγή: ξανακοιτάμε τότε
+
+
+async def init_zones(db: aiosqlite.Connection) -> None:
+    await db.execute(
+        "CREATE TABLE IF NOT EXISTS zones (tz TEXT PRIMARY KEY, utc_offset INTEGER NOT NULL)"
+    )
+    await db.execute(
+        "INSERT OR IGNORE INTO zones (tz, utc_offset) VALUES (?, ?)",
+        (TZ.key, zone_offset(TZ.key, int(time.time() // 60))),
+    )
+
+
+async def load_zones() -> dict[str, int]:
+    # ζώνες που πρόσθεσαν άλλα instances (ή ξαναϋπολόγισε άλλος leader)
+    rows = await db_fetchall("SELECT tz, utc_offset FROM zones")
+    _zone_offsets.clear()
+    _zone_offsets.update(rows)
+    return _zone_offsets
+
+
+async def ensure_zone(tz: str) -> int:
+    # πριν γραφτεί chat με νέα ζώνη: το trigger του utc_mow τη χρειάζεται
+    row = await db_write(
+        """
+        INSERT INTO zones (tz, utc_offset) VALUES (?, ?)
+        ON CONFLICT(tz) DO UPDATE SET tz=excluded.tz
+        RETURNING utc_offset
+        """,
+        (tz, zone_offset(tz, int(time.time() // 60))),
+    )
+    _zone_offsets[tz] = row[0]
+    return row[0]
+
+
+@timed("bot_db")
+async def recompute_zone(tz: str, offset: int) -> int:
+    # ένα transaction: νέα μετατόπιση + utc_mow όλων των schedules της ζώνης
+    # (και ό,τι γράφουν τα triggers σε slot_counts/chat_changes)
+    async with write_txn() as db:
+        await db.execute("UPDATE zones SET utc_offset=? WHERE tz=?", (offset, tz))
+        cur = await db.execute(
+            f"""
+            UPDATE schedules SET utc_mow={_UTC_MOW_SQL.format(p='', off='?')}
+            WHERE chat_id IN (SELECT chat_id FROM chats WHERE tz=?)
+            """,
+            (offset, tz),
+        )
+    delta = offset - _zone_offsets.get(tz, offset)
+    _zone_offsets[tz] = offset
+    moved = [(c, slots) for c, slots in _slot_of.items() if _tz_of.get(c, TZ.key) == tz]
+    for chat_id, slots in moved:
+        index_update(chat_id, tuple((slot - delta) % MINUTES_PER_WEEK for slot in slots), tz)
+    metrics.inc("bot_tz_recompute_total", zone=tz)
+    logger.info("TZ recompute zone=%s offset=%+d schedules=%d chats=%d", tz, offset, cur.rowcount, len(moved))
+    return len(moved)
+
+
+# =======================
+# SCHEDULE INDEX (στη μνήμη)
+# =======================
+# Κάθε chat έχει όσα schedules θέλει (ένα ανά μέρα/ώρα· τα "καθημερινές" κτλ.
+# γράφονται ως μία γραμμή ανά μέρα). UTC minute-of-week -> ενεργά chat_ids.
+# Φορτώνεται μία φορά στο startup και ενημερώνεται write-through από κάθε
+# εγγραφή, οπότε το tick δεν ρωτάει ποτέ τη βάση.
+MINUTES_PER_WEEK = 7 * 24 * 60
+INDEX_LOAD_CHUNK = 10_000
+DEFAULT_SCHEDULE = (0, 8, 0)   # Δευτέρα 08:00 για νέο chat
+# Read-through cache του get_schedules για τα interactive handlers. Οι εγγραφές
+# αυτού του process την ενημερώνουν/καθαρίζουν· το TTL φράζει πόσο παλιά μπορεί
+# να είναι μια ρύθμιση που άλλαξε από άλλο instance.
+SETTINGS_CACHE_SIZE = int(os.getenv("SETTINGS_CACHE_SIZE", "10000"))
+SETTINGS_CACHE_TTL = float(os.getenv("SETTINGS_CACHE_TTL", "300"))
+
+_due_index: dict[int, set[int]] = {}
+_slot_of: dict[int, tuple[int, ...]] = {}   # ενεργό chat_id -> UTC slots
+_tz_of: dict[int, str] = {}     # μόνο όσα δεν είναι στη default TZ
+_sorted_slots: list[int] | None = None
+_slots_changed = asyncio.Event()   # ξυπνάει τον scheduler όταν εμφανιστεί νέο slot
+_zone_names: dict[str, str] = {}   # ένα str ανά ζώνη για όλα τα chats
+_settings_cache = LruCache("settings", SETTINGS_CACHE_SIZE, SETTINGS_CACHE_TTL)
+# pre-staging (βλ. SCHEDULER): ποιο λεπτό μπήκε ήδη στο outbox και για ποιους
+_prestaged_min: int | None = None
+_prestaged_chats: set[int] = set()
+_prestage_stale: set[int] = set()   # βγήκαν από το slot μετά το pre-stage
+
+# ενεργό + tz + utc_mow κάθε schedule (NULL αν το chat δεν έχει κανένα)
+_CHAT_SLOTS_SQL = """
+    SELECT c.chat_id, c.enabled, c.tz, s.utc_mow
+    FROM chats c LEFT JOIN schedules s ON s.chat_id=c.chat_id
+"""
+
+
+async def init_schedules(db: aiosqlite.Connection) -> None:
+    existed = await db.execute_fetchall(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='schedules'"
+    )
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schedules (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            dow INTEGER NOT NULL,
+            hour INTEGER NOT NULL,
+            minute INTEGER NOT NULL,
+            utc_mow INTEGER,                 -- βλ. TIMEZONES
+            UNIQUE (chat_id, dow, hour, minute)
+        )
+        """
+    )
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_schedules_slot ON schedules (utc_mow)")
+
+    utc_mow = _UTC_MOW_SQL.format(p="NEW.", off=_ZONE_OFFSET_SQL.format(p="NEW."))
+    # WHEN: το import γράφει έτοιμο utc_mow και γλιτώνει το UPDATE ανά γραμμή
+    await db.execute("DROP TRIGGER IF EXISTS trg_schedules_utc_insert")
+    await db.execute(
+        f"""
+        CREATE TRIGGER trg_schedules_utc_insert AFTER INSERT ON schedules WHEN NEW.utc_mow IS NULL
+        BEGIN UPDATE schedules SET utc_mow={utc_mow} WHERE id=NEW.id; END
+        """
+    )
+    await db.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_schedules_utc_update AFTER UPDATE OF dow, hour, minute ON schedules
+        BEGIN UPDATE schedules SET utc_mow={utc_mow} WHERE id=NEW.id; END
+        """
+    )
+    zone = "COALESCE((SELECT utc_offset FROM zones WHERE tz=NEW.tz), 0)"
+    await db.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_chats_tz AFTER UPDATE OF tz ON chats
+        BEGIN UPDATE schedules SET utc_mow={_UTC_MOW_SQL.format(p='', off=zone)} WHERE chat_id=NEW.chat_id; END
+        """
+    )
+    # utc_mow ζούσε στο chats πριν υπάρξει το schedules
+    await db.execute("DROP TRIGGER IF EXISTS trg_chats_utc_insert")
+    await db.execute("DROP TRIGGER IF EXISTS trg_chats_utc_update")
+    await db.execute("DROP INDEX IF EXISTS idx_chats_utc")
+    await db.execute("DROP INDEX IF EXISTS idx_chats_slot")
+
+    if not existed:
+        # Migration: το μοναδικό dow/hour/minute του chats γίνεται το πρώτο schedule
+        await db.execute(
+            "INSERT INTO schedules (chat_id, dow, hour, minute) SELECT chat_id, dow, hour, minute FROM chats"
+        )
+    await db.execute(
+        f"UPDATE schedules SET utc_mow={_UTC_MOW_SQL.format(p='', off=_ZONE_OFFSET_SQL.format(p='schedules.'))} "
+        "WHERE utc_mow IS NULL"
+    )
+
+
+def minute_of_week(dow: int, hour: int, minute: int) -> int:
+    return dow * 1440 + hour * 60 + minute
+
+
+def index_update(chat_id: int, slots: tuple[int, ...] | None, tz: str = TZ.key) -> None:
+    # slots=None/(): το chat βγαίνει από το index (παύση ή χωρίς schedules)
+    global _sorted_slots
+    if chat_id in _prestaged_chats and utc_slot(_prestaged_min) not in (slots or ()):
+        _prestaged_chats.discard(chat_id)
+        _prestage_stale.add(chat_id)
+        _slots_changed.set()
+    if not slots or tz == TZ.key:
+        _tz_of.pop(chat_id, None)
+    else:
+        _tz_of[chat_id] = _zone_names.setdefault(tz, tz)
+    for old in _slot_of.pop(chat_id, ()):
+        bucket = _due_index.get(old)
+        if bucket is not None:
+            bucket.discard(chat_id)
+            if not bucket:
+                del _due_index[old]
+                _sorted_slots = None
+    if not slots:
+        return
+    _slot_of[chat_id] = slots
+    for slot in slots:
+        bucket = _due_index.get(slot)
+        if bucket is None:
+            bucket = _due_index[slot] = set()
+            _sorted_slots = None
+            _slots_changed.set()
+        bucket.add(chat_id)
+
+
+def occupied_slots() -> list[int]:
+    global _sorted_slots
+    if _sorted_slots is None:
+        _sorted_slots = sorted(_due_index)
+    return _sorted_slots
+
+
+def _index_rows(rows) -> None:
+    # rows = (chat_id, enabled, tz, utc_mow) από _CHAT_SLOTS_SQL, ταξινομημένα ανά chat
+    for chat_id, group in itertools.groupby(rows, key=lambda r: r[0]):
+        group = list(group)
+        _, enabled, tz, _ = group[0]
+        slots = tuple(sorted({r[3] for r in group if r[3] is not None}))
+        index_update(chat_id, slots if enabled else None, tz)
+
+
+async def reindex_chat(chat_id: int) -> None:
+    _index_rows(await db_fetchall(_CHAT_SLOTS_SQL + " WHERE c.chat_id=?", (chat_id,)))
+
+
+@timed("bot_db")
+async def load_schedule_index() -> int:
+    _due_index.clear()
+    _slot_of.clear()
+    _tz_of.clear()
+    chat_id, slots, tz = None, [], TZ.key
+    # ORDER BY chat_id από το idx_schedules_chat_slot (covering)· ένα chat μπορεί να μοιραστεί σε δύο chunks
+    async with get_db().execute(
+        """
+        SELECT s.chat_id, s.utc_mow, c.tz FROM schedules s JOIN chats c ON c.chat_id=s.chat_id
+        WHERE c.enabled=1 ORDER BY s.chat_id
+        """
+    ) as cur:
+        while rows := await cur.fetchmany(INDEX_LOAD_CHUNK):
+            for row_chat, utc_mow, row_tz in rows:
+                if row_chat != chat_id:
+                    if slots:
+                        index_update(chat_id, tuple(sorted(set(slots))), tz)
+                    chat_id, slots, tz = row_chat, [], row_tz
+                slots.append(utc_mow)
+    if slots:
+        index_update(chat_id, tuple(sorted(set(slots))), tz)
+    return len(_slot_of)
+
+
+@timed("bot_db")
+async def set_enabled(chat_id: int, enabled: bool) -> None:
+    await db_write(
+        """
+        INSERT INTO chats (chat_id, enabled)
+        VALUES (?, ?)
+        ON CONFLICT(chat_id) DO UPDATE SET enabled=excluded.enabled
+        """,
+        (chat_id, 1 if enabled else 0),
+    )
+    _settings_cache.discard(chat_id)   # μπορεί να δημιούργησε το chat
+    if enabled:
+        await reindex_chat(chat_id)
+    else:
+        index_update(chat_id, None)
+
+
+@timed("bot_db")
+async def disable_chats(chat_ids: list[int]) -> None:
+    # bulk παύση (π.χ. όσοι έκαναν block στο τέλος ενός batch)
+    if not chat_ids:
+        return
+    await db_write_many("UPDATE chats SET enabled=0 WHERE chat_id=?", [(c,) for c in chat_ids])
+    for chat_id in chat_ids:
+        index_update(chat_id, None)
+
+
+async def _replace_schedules(db: aiosqlite.Connection, chat_id: int, scheds: list[tuple[int, int, int]]) -> None:
+    await db.execute("DELETE FROM schedules WHERE chat_id=?", (chat_id,))
+    await db.executemany(
+        "INSERT INTO schedules (chat_id, dow, hour, minute) VALUES (?, ?, ?, ?)",
+        [(chat_id, *s) for s in scheds],
+    )
+
+
+@timed("bot_db")
+async def activate_schedule(
+    chat_id: int,
+    days: tuple[int, ...] | None = None,
+    hour: int | None = None,
+    minute: int | None = None,
+) -> list[tuple[int, int, int]]:
+    # Μία ενέργεια χρήστη = ένα transaction: ενεργοποίηση και, αν δόθηκαν,
+    # νέες μέρες ή/και ώρα. Ό,τι δεν δόθηκε μένει ως έχει (μέρες ή ώρα των
+    # υπαρχόντων, αλλιώς Δευτέρα 08:00 για νέο chat).
+    async with write_txn() as db:
+        async with db.execute(
+            "INSERT INTO chats (chat_id, enabled) VALUES (?, 1) "
+            "ON CONFLICT(chat_id) DO UPDATE SET enabled=1 RETURNING tz",
+            (chat_id,),
+        ) as cur:
+            tz = (await cur.fetchone())[0]
+        current = [tuple(r) for r in await db.execute_fetchall(
+            "SELECT dow, hour, minute FROM schedules WHERE chat_id=? ORDER BY dow, hour, minute", (chat_id,)
+        )]
+        scheds = current
+        if not current or days or hour is not None:
+            first = current[0] if current else DEFAULT_SCHEDULE
+            days = days or sorted({s[0] for s in current}) or (first[0],)
+            if hour is None:
+                hour, minute = first[1], first[2]
+            scheds = [(dow, hour, minute) for dow in sorted(set(days))]
+            if scheds != current:
+                await _replace_schedules(db, chat_id, scheds)
+    _settings_cache.put(chat_id, (scheds, tz))
+    await reindex_chat(chat_id)
+    return scheds
+
+
+@timed("bot_db")
+async def add_schedules(chat_id: int, days: tuple[int, ...], hour: int, minute: int) -> list[tuple[int, int, int]]:
+    async with write_txn() as db:
+        await db.execute("INSERT OR IGNORE INTO chats (chat_id) VALUES (?)", (chat_id,))
+        await db.executemany(
+            "INSERT OR IGNORE INTO schedules (chat_id, dow, hour, minute) VALUES (?, ?, ?, ?)",
+            [(chat_id, dow, hour, minute) for dow in days],
+        )
+    _settings_cache.discard(chat_id)
+    await reindex_chat(chat_id)
+    return (await get_schedules(chat_id))[0]
+
+
+@timed("bot_db")
+async def remove_schedules(chat_id: int, days: tuple[int, ...], hour: int | None = None, minute: int | None = None) -> int:
+    # χωρίς ώρα: όλα τα schedules αυτών των ημερών
+    async with write_txn() as db:
+        cur = await db.executemany(
+            "DELETE FROM schedules WHERE chat_id=?1 AND dow=?2 AND (?3 IS NULL OR (hour=?3 AND minute=?4))",
+            [(chat_id, dow, hour, minute) for dow in days],
+        )
+    _settings_cache.discard(chat_id)
+    await reindex_chat(chat_id)
+    return max(cur.rowcount, 0)
+
+
+@timed("bot_db")
+async def get_enabled_chat_ids() -> list[int]:
+    rows = await db_fetchall("SELECT chat_id FROM chats WHERE enabled=1")
+    return [r[0] for r in rows]
+
+@timed("bot_db")
+async def set_tz(chat_id: int, tz: str) -> None:
+    await ensure_zone(tz)
+    await db_write(
+        "INSERT INTO chats (chat_id, tz) VALUES (?, ?) ON CONFLICT(chat_id) DO UPDATE SET tz=excluded.tz",
+        (chat_id, tz),
+    )
+    _settings_cache.discard(chat_id)
+    await reindex_chat(chat_id)
+
+
+async def get_schedules(chat_id: int) -> tuple[list[tuple[int, int, int]], str] | None:
+    # read-through: cache hit χωρίς καμία ερώτηση στη βάση. Το "δεν υπάρχει"
+    # δεν κρατιέται: το chat το δημιουργεί κάθε εγγραφή (/stop, /tz, ...)
+    cached = _settings_cache.get(chat_id)
+    if cached is LruCache.MISSING:
+        cached = await _load_schedules(chat_id)
+        if cached is not None:
+            _settings_cache.put(chat_id, cached)
+    return cached
+
+
+@timed("bot_db")
+async def _load_schedules(chat_id: int) -> tuple[list[tuple[int, int, int]], str] | None:
+    row = await db_fetchone("SELECT tz FROM chats WHERE chat_id=?", (chat_id,))
+    if not row:
+        return None
+    scheds = await db_fetchall(
+        "SELECT dow, hour, minute FROM schedules WHERE chat_id=? ORDER BY dow, hour, minute", (chat_id,)
+    )
+    return [tuple(s) for s in scheds], row[0]
+
+
+def get_due_chat_ids(epoch_min: int) -> list[int]:
+    return list(_due_index.get(utc_slot(epoch_min), ()))
+
+# =======================
+# BROADCAST ENGINE
+# =======================
+# Κοινό για schedule_tick και sendnow: N workers στέλνουν παράλληλα, όλοι
+# παίρνουν token από τον ίδιο global bucket (~30 msg/s του Telegram) και
+# κρατάνε ≥1s ανάμεσα σε δύο μηνύματα στο ίδιο chat. Ένα RetryAfter παγώνει
+# τον bucket για όσο ζητάει το Telegram και ρίχνει το rate (AIMD), αντί
+# για τυφλό sleep που σταματάει όλο το loop.
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "28"))          # msg/s
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "16"))
+BROADCAST_MAX_ATTEMPTS = 4
+PER_CHAT_INTERVAL = 1.0
+MIN_BROADCAST_RATE = 1.0
+
+
+def retry_after_seconds(e: RetryAfter) -> float:
+    value = e.retry_after
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:   # FIFO: όποιος ήρθε πρώτος παίρνει πρώτος
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def backoff(self, seconds: float) -> None:
+        now = time.monotonic()
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0
+        self.updated = now
+        self.rate = max(MIN_BROADCAST_RATE, self.rate * 0.7)
+
+    def recover(self) -> None:
+        if self.rate < self.max_rate:
+            self.rate = min(self.max_rate, self.rate + 0.05)
+
+    def set_max_rate(self, rate: float) -> None:
+        # μερίδιο του instance στο όριο του bot token (βλ. CLUSTER)
+        at_max = self.rate >= self.max_rate
+        self.max_rate = rate
+        self.rate = rate if at_max else min(self.rate, rate)
+        self.capacity = max(1.0, rate)
+        self.tokens = min(self.tokens, self.capacity)
+
+
+_send_bucket = TokenBucket(BROADCAST_RATE)
+_chat_last_send: dict[int, float] = {}
+
+
+async def _pace_chat(chat_id: int) -> None:
+    now = time.monotonic()
+    wait = _chat_last_send.get(chat_id, 0.0) + PER_CHAT_INTERVAL - now
+    if wait > 0:
+        await asyncio.sleep(wait)
+        now += wait
+    _chat_last_send[chat_id] = now
+    # κράτα το dict μικρό: ό,τι είναι παλιότερο από το interval δεν χρειάζεται
+    if len(_chat_last_send) > 4 * BROADCAST_CONCURRENCY * max(1, int(BROADCAST_RATE)):
+        cutoff = now - PER_CHAT_INTERVAL
+        for cid in [c for c, t in _chat_last_send.items() if t < cutoff]:
+            del _chat_last_send[cid]
+
+
+SEND_OK, SEND_BLOCKED, SEND_RETRY, SEND_FAILED = range(4)
+
+
+async def send_one(bot, chat_id: int, text: str, payload: "Payload | None" = None) -> int:
+    for _ in range(BROADCAST_MAX_ATTEMPTS):
+        await _send_bucket.acquire()
+        await _pace_chat(chat_id)
+        start = time.perf_counter()
+        try:
+            await send_payload(bot, chat_id, text, payload)
+        except RetryAfter as e:
+            _send_bucket.backoff(retry_after_seconds(e))
+            metrics.inc("bot_send_total", result="retry_after")
+            metrics.set("bot_send_rate_limit", _send_bucket.rate)
+            continue
+        except Forbidden:
+            metrics.inc("bot_send_total", result="forbidden")
+            return SEND_BLOCKED
+        except BadRequest:
+            logger.exception("Failed sending to chat_id=%s", chat_id)
+            metrics.inc("bot_send_total", result="failed")
+            return SEND_FAILED
+        except NetworkError as e:
+            logger.warning("Network error chat_id=%s: %s", chat_id, e)
+            metrics.inc("bot_send_total", result="network")
+            return SEND_RETRY
+        except Exception:
+            logger.exception("Failed sending to chat_id=%s", chat_id)
+            metrics.inc("bot_send_total", result="failed")
+            return SEND_FAILED
+        finally:
+            metrics.observe("bot_send_seconds", time.perf_counter() - start)
+        _send_bucket.recover()
+        metrics.inc("bot_send_total", result="sent")
+        return SEND_OK
+    return SEND_RETRY
+
+
+async def send_batch(bot, jobs: list[tuple]) -> list[int]:
+    # jobs: (chat_id, text) ή (chat_id, text, payload)
+    outcomes = [SEND_FAILED] * len(jobs)
+    pending = iter(enumerate(jobs))   # κοινός iterator: κάθε worker παίρνει το επόμενο
+
+    async def worker() -> None:
+        for i, job in pending:
+            outcomes[i] = await send_one(bot, *job)
+
+    workers = min(BROADCAST_CONCURRENCY, len(jobs))
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    return outcomes
+
+
+# =======================
+# PAYLOADS (templates, media)
+# =======================
+# Το κείμενο ενός payload μπορεί να έχει πεδία ανά chat ({day} {time} {when}
+# {tz}). Γίνεται compile μία φορά ανά payload (στο _payload_cache) και κάθε
+# διαφορετικός συνδυασμός τιμών αποδίδεται μία φορά: ένα sched λεπτό έχει
+# ίδια μέρα/ώρα για όλους, οπότε ένα render για όλο το slot.
+# Media (photo/document): με file_id (π.χ. από μήνυμα του admin) δεν γίνεται
+# ποτέ upload. Αρχεία του server επιτρέπονται μόνο μέσα στο MEDIA_DIR και
+# ανεβαίνουν ήδη στο /sendnow (στο chat του admin), οπότε ο worker που θα τα
+# στείλει δεν χρειάζεται το αρχείο. Από URL το πρώτο send το ανεβάζει (οι
+# υπόλοιποι workers περιμένουν στο upload_lock). Το file_id που επιστρέφει το
+# Telegram μπαίνει στο payload και στο media_cache για επόμενα broadcasts.
+TEMPLATE_FIELDS = ("day", "time", "when", "tz")
+TEMPLATE_MEMO = 1024               # αποδοσμένα κείμενα ανά payload
+MEDIA_TYPES = ("photo", "document")
+MAX_CAPTION_CHARS = 1024
+MEDIA_DIR = os.getenv("MEDIA_DIR", "")   # photo:/doc: αρχεία μόνο από εδώ (κενό = μόνο URL/file_id)
+PAYLOAD_CACHE_SIZE = 64
+SCHEDULE_TEXT = os.getenv(
+    "SCHEDULE_TEXT", "☀️ Καλημέρα! Αυτό είναι το προγραμματισμένο μήνυμά σου (Δήλωσε ωράρια)."
+)
+
+
+def compile_template(text: str) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    # (literals, fields) με len(literals) == len(fields) + 1· ValueError για άγνωστο πεδίο
+    literals, fields = [""], []
+    for literal, field, spec, conversion in string.Formatter().parse(text):
+        literals[-1] += literal
+        if field is None:
+            continue
+        if field not in TEMPLATE_FIELDS or spec or conversion:
+            raise ValueError(f"{{{field}}}")
+        fields.append(field)
+        literals.append("")
+    return tuple(literals), tuple(fields)
+
+
+class Payload:
+    def __init__(
+        self, payload_id: int, kind: str, text: str,
+        media_type: str | None = None, media: str | None = None, file_id: str | None = None,
+    ) -> None:
+        self.payload_id = payload_id
+        self.kind = kind
+        try:
+            self.literals, self.fields = compile_template(text)
+        except ValueError:
+            # παλιό payload με σκέτα { }: στέλνεται όπως είναι
+            self.literals, self.fields = (text,), ()
+        self.media_type = media_type
+        self.media = media
+        self.file_id = file_id
+        self.upload_lock = asyncio.Lock()
+        self._rendered: dict[tuple, str] = {}
+        # ό,τι δεν βγαίνει από το idem key του sched χρειάζεται chats/schedules
+        self.needs_chat = bool(
+            {"when", "tz"} & set(self.fields) or (kind != "sched" and {"day", "time"} & set(self.fields))
+        )
+
+    def render(self, values: dict[str, str] | None) -> str:
+        if not self.fields:
+            return self.literals[0]
+        key = tuple(values[field] for field in self.fields)
+        text = self._rendered.get(key)
+        if text is None:
+            if len(self._rendered) >= TEMPLATE_MEMO:
+                self._rendered.clear()
+            parts = [self.literals[0]]
+            for value, literal in zip(key, self.literals[1:]):
+                parts += (value, literal)
+            text = self._rendered[key] = "".join(parts)
+            metrics.inc("bot_template_renders_total")
+        return text
+
+
+_payload_cache = LruCache("payloads", PAYLOAD_CACHE_SIZE, 3600.0)
+
+
+def next_schedule(scheds: list[tuple[int, int, int]], tz: str) -> tuple[int, int, int] | None:
+    if not scheds:
+        return None
+    now = datetime.now(ZoneInfo(tz))
+    current = minute_of_week(now.weekday(), now.hour, now.minute)
+    return min(scheds, key=lambda s: (minute_of_week(*s) - current) % MINUTES_PER_WEEK)
+
+
+def template_values(payload: Payload, idem_key: str, chat: tuple | None) -> dict[str, str]:
+    # chat: (tz, schedules) όταν payload.needs_chat
+    tz, scheds = chat or (TZ.key, [])
+    if payload.kind == "sched":
+        # sched:YYYY-MM-DDTHH:MM:chat_id, στην τοπική ώρα του chat
+        local = datetime.fromisoformat(idem_key[6:22])
+        slot = (local.weekday(), local.hour, local.minute)
+    else:
+        slot = next_schedule(scheds, tz)
+    values = {"tz": tz, "when": describe_schedules(scheds) if scheds else "—"}
+    if slot is None:
+        values["day"] = values["time"] = "—"
+    else:
+        values["day"] = DAY_NAMES[slot[0]]
+        values["time"] = f"{slot[1]:02d}:{slot[2]:02d}"
+    return values
+
+
+async def load_payloads(payload_ids: set[int]) -> dict[int, Payload]:
+    found = {}
+    for pid in payload_ids:
+        payload = _payload_cache.get(pid)
+        if payload is not LruCache.MISSING:
+            found[pid] = payload
+    missing = tuple(payload_ids - found.keys())
+    if missing:
+        rows = await db_fetchall(
+            f"SELECT id, kind, text, media_type, media, file_id FROM payloads WHERE id IN ({','.join('?' * len(missing))})",
+            missing,
+        )
+        for row in rows:
+            found[row[0]] = Payload(*row)
+            _payload_cache.put(row[0], found[row[0]])
+    return found
+
+
+async def chat_contexts(chat_ids: list[int]) -> dict[int, tuple[str, list[tuple[int, int, int]]]]:
+    if not chat_ids:
+        return {}
+    rows = await db_fetchall(
+        f"""
+        SELECT c.chat_id, c.tz, group_concat(s.dow || ':' || s.hour || ':' || s.minute, ' ')
+        FROM chats c LEFT JOIN schedules s ON s.chat_id=c.chat_id
+        WHERE c.chat_id IN ({','.join('?' * len(chat_ids))}) GROUP BY c.chat_id
+        """,
+        tuple(chat_ids),
+    )
+    return {chat_id: (tz, _parse_schedules(packed or "")) for chat_id, tz, packed in rows}
+
+
+def media_path(name: str) -> Path | None:
+    # αρχείο μέσα στο MEDIA_DIR μετά το resolve (όχι .., symlink ή απόλυτο path προς τα έξω)
+    if not MEDIA_DIR:
+        return None
+    base = Path(MEDIA_DIR).resolve()
+    path = (base / name).resolve()
+    if not path.is_relative_to(base) or not path.is_file():
+        return None
+    return path
+
+
+def media_key(media_type: str, media: str) -> str | None:
+    # κλειδί του media_cache: ίδιο αρχείο (path + mtime + μέγεθος) ή ίδιο URL
+    if os.path.isabs(media):
+        try:
+            st = os.stat(media)
+        except OSError:
+            return None
+        return f"{media_type}:{media}:{st.st_mtime_ns}:{st.st_size}"
+    return f"{media_type}:{media}"
+
+
+async def cached_file_id(media_type: str, media: str) -> str | None:
+    key = media_key(media_type, media)
+    if key is None:
+        return None
+    row = await db_fetchone("SELECT file_id FROM media_cache WHERE key=?", (key,))
+    return row[0] if row else None
+
+
+async def remember_media(media_type: str, media: str, message) -> str:
+    # file_id του upload -> media_cache· επιστρέφει το file_id
+    sent = message.photo[-1] if media_type == "photo" else message.document
+    metrics.inc("bot_media_uploads_total", media=media_type)
+    if key := media_key(media_type, media):
+        await db_write(
+            "INSERT INTO media_cache (key, file_id, created_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET file_id=excluded.file_id, created_at=excluded.created_at",
+            (key, sent.file_id, time.time()),
+        )
+    return sent.file_id
+
+
+async def remember_file_id(payload: Payload, message) -> None:
+    payload.file_id = await remember_media(payload.media_type, payload.media, message)
+    await db_write("UPDATE payloads SET file_id=? WHERE id=?", (payload.file_id, payload.payload_id))
+
+
+async def send_payload(bot, chat_id: int, text: str, payload: Payload | None) -> None:
+    if payload is None or payload.media_type is None:
+        await bot.send_message(chat_id=chat_id, text=text)
+        return
+    send = bot.send_photo if payload.media_type == "photo" else bot.send_document
+    caption = text or None
+    if payload.file_id is None:
+        async with payload.upload_lock:
+            if payload.file_id is None:
+                # URL -> το κατεβάζει το Telegram· path μόνο μέσα στο MEDIA_DIR
+                # (payloads από πριν ανέβαιναν στο /sendnow)
+                media = payload.media
+                if os.path.isabs(media):
+                    media = media_path(media)
+                    if media is None:
+                        raise ValueError(f"media εκτός MEDIA_DIR: {payload.media}")
+                await remember_file_id(payload, await send(chat_id, media, caption=caption))
+                return
+    await send(chat_id, payload.file_id, caption=caption)
+
+
+# =======================
+# OUTBOX
+# =======================
+# Κάθε αποστολή γράφεται πρώτα στο outbox (ένα bulk insert ανά λεπτό/broadcast)
+# και μετά τη στέλνει ο outbox_worker σε batches. Το idem_key είναι UNIQUE,
+# οπότε ένα λεπτό ή broadcast δεν μπαίνει ποτέ δύο φορές. Κάθε γραμμή έχει
+# shard = chat_id % OUTBOX_SHARDS και τη στέλνει μόνο το instance που κρατάει
+# το lease του shard· ό,τι έμεινε "claimed" από instance που έπεσε ξαναγίνεται
+# pending από τον leader (βλ. CLUSTER).
+OUTBOX_PENDING, OUTBOX_CLAIMED, OUTBOX_SENT, OUTBOX_FAILED, OUTBOX_CANCELLED = range(5)
+OUTBOX_BATCH = 200
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_BACKOFF_BASE = 5.0        # s, x2 σε κάθε αποτυχία
+OUTBOX_BACKOFF_MAX = 15 * 60.0
+OUTBOX_IDLE = 60.0
+OUTBOX_POLL = 1.0                # s, έλεγχος για εγγραφές άλλων instances
+OUTBOX_RETENTION = 7 * 24 * 3600
+
+_outbox_wakeup = asyncio.Event()
+
+
+async def init_outbox(db: aiosqlite.Connection) -> None:
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payloads (
+            id INTEGER PRIMARY KEY,
+            kind TEXT NOT NULL,              -- sched | broadcast
+            text TEXT NOT NULL,              -- κείμενο/λεζάντα, μπορεί να είναι template
+            created_at REAL NOT NULL,
+            media_type TEXT,                 -- NULL | photo | document
+            media TEXT,                      -- file_id, path στον server ή URL
+            file_id TEXT                     -- μετά το πρώτο upload
+        )
+        """
+    )
+    cols = {row[1] for row in await db.execute_fetchall("PRAGMA table_info(payloads)")}
+    for col in ("media_type", "media", "file_id"):
+        if col not in cols:
+            await db.execute(f"ALTER TABLE payloads ADD COLUMN {col} TEXT")
+    await db.execute(
+        "CREATE TABLE IF NOT EXISTS media_cache (key TEXT PRIMARY KEY, file_id TEXT NOT NULL, created_at REAL NOT NULL)"
+    )
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY,
+            idem_key TEXT NOT NULL UNIQUE,
+            payload_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            status INTEGER NOT NULL DEFAULT 0,   -- 0=pending 1=claimed 2=sent 3=failed 4=cancelled
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            shard INTEGER NOT NULL DEFAULT 0,
+            claimed_by TEXT,
+            slot INTEGER,                        -- UTC minute-of-week για sched, αλλιώς NULL
+            due_at REAL                          -- αρχικό next_at (για το latency στο DELIVERIES)
+        )
+        """
+    )
+    cols = {row[1] for row in await db.execute_fetchall("PRAGMA table_info(outbox)")}
+    if "shard" not in cols:
+        await db.execute("ALTER TABLE outbox ADD COLUMN shard INTEGER NOT NULL DEFAULT 0")
+    if "claimed_by" not in cols:
+        await db.execute("ALTER TABLE outbox ADD COLUMN claimed_by TEXT")
+    if "slot" not in cols:
+        await db.execute("ALTER TABLE outbox ADD COLUMN slot INTEGER")
+    if "due_at" not in cols:
+        await db.execute("ALTER TABLE outbox ADD COLUMN due_at REAL")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_outbox_ready ON outbox (status, next_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_outbox_payload ON outbox (payload_id, status)")
+
+
+@timed("bot_db")
+async def outbox_enqueue(
+    kind: str,
+    text: str,
+    chat_ids: list[int],
+    key: str | None = None,
+    watermark: int | None = None,
+    keys: list[str] | None = None,
+    at: float | None = None,
+    spread: float = 0.0,
+    slot: int | None = None,
+    media_type: str | None = None,
+    media: str | None = None,
+    file_id: str | None = None,
+) -> int | None:
+    # ένα transaction για όλο το λεπτό/broadcast (μαζί με το watermark του
+    # scheduler)· None αν είχε ήδη μπει. keys: prefix του idem key ανά chat.
+    # at: πότε γίνονται claimable (default τώρα)· spread: s για να μοιραστούν
+    # ομοιόμορφα οι γραμμές μετά το at, με τη σειρά του chat_ids
+    now = time.time()
+    start = now if at is None else at
+    step = spread / len(chat_ids) if spread and chat_ids else 0.0
+    async with write_txn() as db:
+        cur = await db.execute(
+            "INSERT INTO payloads (kind, text, created_at, media_type, media, file_id) VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, text, now, media_type, media, file_id),
+        )
+        payload_id = cur.lastrowid
+        key = key or f"{kind}:{payload_id}"
+        cur = await db.executemany(
+            """
+            INSERT OR IGNORE INTO outbox (idem_key, payload_id, chat_id, next_at, updated_at, shard, slot, due_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                (
+                    f"{prefix}:{chat_id}", payload_id, chat_id, start + i * step, now, chat_id % OUTBOX_SHARDS,
+                    slot, start + i * step,
+                )
+                for i, (prefix, chat_id) in enumerate(zip(keys or itertools.repeat(key), chat_ids))
+            ),
+        )
+        if cur.rowcount <= 0:
+            await db.execute("DELETE FROM payloads WHERE id=?", (payload_id,))
+            payload_id = None
+        if watermark is not None:
+            await db.execute(_SET_META, (WATERMARK_KEY, str(watermark)))
+    if payload_id is not None:
+        _outbox_wakeup.set()
+    return payload_id
+
+
+def _shard_filter() -> tuple[str, tuple[int, ...]] | None:
+    # None: δεν κρατάμε κανένα shard· "" όταν τα κρατάμε όλα (ένα instance)
+    if not _owned_shards:
+        return None
+    if len(_owned_shards) >= OUTBOX_SHARDS:
+        return "", ()
+    shards = tuple(sorted(_owned_shards))
+    return f" AND shard IN ({','.join('?' * len(shards))})", shards
+
+
+@timed("bot_db")
+async def outbox_claim(limit: int) -> list[tuple]:
+    # (id, chat_id, attempts, payload, text, slot, due_at)· text ήδη αποδοσμένο για το chat
+    shard_filter = _shard_filter()
+    if shard_filter is None:
+        return []
+    shard_sql, shard_params = shard_filter
+    now = time.time()
+    async with write_txn() as db:
+        # ό,τι μπήκε νωρίτερα (pre-staged, retry) για chat που έκανε στο μεταξύ
+        # παύση ακυρώνεται εδώ αντί να σταλεί
+        rows = await db.execute_fetchall(
+            f"""
+            UPDATE outbox SET updated_at=?, claimed_by=?, status=CASE
+                WHEN (SELECT enabled FROM chats WHERE chat_id=outbox.chat_id)=0 THEN ? ELSE ? END
+            WHERE id IN (
+                SELECT id FROM outbox WHERE status=? AND next_at<=?{shard_sql}
+                ORDER BY next_at LIMIT ?
+            )
+            RETURNING id, chat_id, attempts, payload_id, status, slot, COALESCE(due_at, next_at), idem_key
+            """,
+            (now, INSTANCE_ID, OUTBOX_CANCELLED, OUTBOX_CLAIMED, OUTBOX_PENDING, now, *shard_params, limit),
+        )
+    skipped = sum(1 for r in rows if r[4] == OUTBOX_CANCELLED)
+    if skipped:
+        metrics.inc("bot_outbox_skipped_disabled_total", skipped)
+        rows = [r for r in rows if r[4] != OUTBOX_CANCELLED]
+    if not rows:
+        return []
+
+    try:
+        payloads = await load_payloads({r[3] for r in rows})
+        orphans = [r[0] for r in rows if r[3] not in payloads]
+        if orphans:
+            # χωρίς payload δεν στέλνεται ποτέ: failed μόνο αυτές, όχι όλο το batch
+            logger.error("OUTBOX missing payload rows=%d", len(orphans))
+            await db_write_many(
+                "UPDATE outbox SET status=?, updated_at=? WHERE id=?",
+                [(OUTBOX_FAILED, now, row_id) for row_id in orphans],
+            )
+            rows = [r for r in rows if r[3] in payloads]
+        chats = await chat_contexts([r[1] for r in rows if payloads[r[3]].needs_chat])
+        claimed = []
+        for row_id, chat_id, attempts, pid, _, slot, due_at, idem_key in rows:
+            payload = payloads[pid]
+            values = template_values(payload, idem_key, chats.get(chat_id)) if payload.fields else None
+            claimed.append((row_id, chat_id, attempts, payload, payload.render(values), slot, due_at))
+    except BaseException:
+        # έχουν ήδη γίνει commit ως claimed: πίσω στο outbox αντί να κολλήσουν
+        await outbox_release([(r[0], r[2]) for r in rows])
+        raise
+    return claimed
+
+
+async def outbox_release(rows: list[tuple[int, int]], sent: set[int] | None = None) -> None:
+    # (id, attempts) που έγιναν claim αλλά δεν ολοκληρώθηκαν (σφάλμα στο
+    # send/complete): ξανά pending με backoff, failed όταν τελειώσουν οι
+    # προσπάθειες, ώστε μια γραμμή που σκάει πάντα να μη γυρίζει για πάντα.
+    # sent: όσα ξέρουμε ότι στάλθηκαν (το complete απέτυχε μετά το send).
+    now = time.time()
+    await db_write_many(
+        """
+        UPDATE outbox SET status=CASE WHEN ?2 THEN ?3 WHEN attempts+1>=?4 THEN ?5 ELSE ?6 END,
+            attempts=attempts+(NOT ?2), next_at=?7, updated_at=?8, claimed_by=NULL
+        WHERE id=?1 AND status=?9 AND claimed_by=?10
+        """,
+        [
+            (
+                row_id, row_id in (sent or ()), OUTBOX_SENT, OUTBOX_MAX_ATTEMPTS, OUTBOX_FAILED, OUTBOX_PENDING,
+                now + min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** attempts), now,
+                OUTBOX_CLAIMED, INSTANCE_ID,
+            )
+            for row_id, attempts in rows
+        ],
+    )
+    metrics.inc("bot_outbox_released_total", len(rows))
+
+
+@timed("bot_db")
+async def outbox_complete(claimed: list[tuple], outcomes: list[int]) -> None:
+    now = time.time()
+    async with write_txn() as db:
+        # μόνο όσα είναι ακόμα δικά μας: αν το claim έληξε και τα πήρε άλλος,
+        # το status/ιστορικό τα γράφει εκείνος
+        owned = {row[0] for row in await db.execute_fetchall(
+            "SELECT id FROM outbox WHERE id IN (SELECT value FROM json_each(?)) AND status=? AND claimed_by=?",
+            (json.dumps([c[0] for c in claimed]), OUTBOX_CLAIMED, INSTANCE_ID),
+        )}
+        if len(owned) < len(claimed):
+            logger.warning("OUTBOX lost claims rows=%d (expired before complete)", len(claimed) - len(owned))
+            metrics.inc("bot_outbox_lost_claims_total", len(claimed) - len(owned))
+        blocked = await _complete_owned(db, now, claimed, outcomes, owned)
+    await disable_chats(blocked)
+
+
+async def _complete_owned(
+    db: aiosqlite.Connection, now: float, claimed: list[tuple], outcomes: list[int], owned: set[int]
+) -> list[int]:
+    done, failed, retry, blocked, history = [], [], [], [], []
+    tally = {"sent": 0, "failed": 0, "blocked": 0, "retry": 0}
+    for (row_id, chat_id, attempts, payload, _, slot, due_at), outcome in zip(claimed, outcomes):
+        if outcome == SEND_BLOCKED:
+            blocked.append(chat_id)   # ισχύει για το chat όποιος κι αν έχει τη γραμμή
+        if row_id not in owned:
+            continue
+        if outcome == SEND_OK:
+            done.append((OUTBOX_SENT, now, row_id))
+            tally["sent"] += 1
+        elif outcome == SEND_RETRY and attempts + 1 < OUTBOX_MAX_ATTEMPTS:
+            delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * 2 ** attempts)
+            retry.append((OUTBOX_PENDING, attempts + 1, now + delay, now, row_id))
+            tally["retry"] += 1
+        else:
+            failed.append((OUTBOX_FAILED, now, row_id))
+            tally["failed"] += 1
+            if outcome == SEND_BLOCKED:
+                tally["blocked"] += 1
+            elif outcome == SEND_RETRY:
+                outcome = SEND_FAILED   # τέλος των προσπαθειών
+        history.append((chat_id, outcome, slot, due_at, payload.payload_id))
+
+    # claimed_by και εδώ: κανείς άλλος δεν τα παίρνει μέσα στο ίδιο transaction,
+    # αλλά το update δεν πρέπει ποτέ να γράψει πάνω σε claim άλλου instance
+    await db.executemany(
+        "UPDATE outbox SET status=?, updated_at=? WHERE id=? AND claimed_by=?",
+        [(*row, INSTANCE_ID) for row in done + failed],
+    )
+    await db.executemany(
+        "UPDATE outbox SET status=?, attempts=?, next_at=?, updated_at=? WHERE id=? AND claimed_by=?",
+        [(*row, INSTANCE_ID) for row in retry],
+    )
+    day = _stats_day(now)
+    await db.executemany(
+        _BUMP_SQL.format(day="?", name="?", n="?"), [(day, name, n) for name, n in tally.items() if n]
+    )
+    await record_deliveries(db, now, history)
+    return blocked
+
+
+async def outbox_renew(row_ids: list[int]) -> None:
+    # όσο τρέχει ένα batch, ανανεώνει το claim (updated_at) ώστε το
+    # OUTBOX_CLAIM_TTL να μη το δώσει σε άλλο instance όσο ακόμα στέλνουμε
+    while True:
+        await asyncio.sleep(OUTBOX_CLAIM_TTL / 3)
+        try:
+            await db_write(
+                "UPDATE outbox SET updated_at=? WHERE id IN (SELECT value FROM json_each(?)) "
+                "AND status=? AND claimed_by=?",
+                (time.time(), json.dumps(row_ids), OUTBOX_CLAIMED, INSTANCE_ID),
+            )
+        except Exception:
+            logger.exception("OUTBOX claim renew failed")
+
+
+async def outbox_next_delay() -> float | None:
+    shard_filter = _shard_filter()
+    if shard_filter is None:
+        return None
+    shard_sql, shard_params = shard_filter
+    row = await db_fetchone(
+        f"SELECT MIN(next_at) FROM outbox WHERE status=?{shard_sql}", (OUTBOX_PENDING, *shard_params)
+    )
+    if not row or row[0] is None:
+        return None
+    return max(0.0, row[0] - time.time())
+
+
+async def outbox_progress(payload_id: int) -> dict[int, int]:
+    rows = await db_fetchall(
+        "SELECT status, COUNT(*) FROM outbox WHERE payload_id=? GROUP BY status", (payload_id,)
+    )
+    return dict(rows)
+
+
+async def outbox_cancel(payload_id: int) -> None:
+    # ό,τι δεν έχει πάρει ακόμα worker δεν θα σταλεί· τα claimed ολοκληρώνονται
+    await db_write(
+        "UPDATE outbox SET status=?, updated_at=? WHERE payload_id=? AND status=?",
+        (OUTBOX_CANCELLED, time.time(), payload_id, OUTBOX_PENDING),
+    )
+
+
+async def outbox_prune() -> None:
+    cutoff = time.time() - OUTBOX_RETENTION
+    async with write_txn() as db:
+        await db.execute(
+            "DELETE FROM outbox WHERE status IN (?, ?, ?) AND updated_at<?",
+            (OUTBOX_SENT, OUTBOX_FAILED, OUTBOX_CANCELLED, cutoff),
+        )
+        await db.execute(
+            "DELETE FROM payloads WHERE created_at<? AND id NOT IN (SELECT payload_id FROM outbox)",
+            (cutoff,),
+        )
+
+
+async def outbox_wait(timeout: float) -> None:
+    # Ξυπνάει με το _outbox_wakeup (εγγραφές αυτού του process) ή όταν αλλάξει
+    # το PRAGMA data_version, δηλαδή όταν έγραψε άλλο instance στη βάση.
+    deadline = time.monotonic() + timeout
+    version = await db_data_version()
+    while (remaining := deadline - time.monotonic()) > 0:
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(_outbox_wakeup.wait(), timeout=min(remaining, OUTBOX_POLL))
+            return
+        if await db_data_version() != version:
+            return
+
+
+async def outbox_worker(bot) -> None:
+    last_prune = 0.0
+    while True:
+        try:
+            _outbox_wakeup.clear()
+            claimed = await outbox_claim(OUTBOX_BATCH)
+            if claimed:
+                start = time.perf_counter()
+                outcomes = None
+                renew = asyncio.create_task(outbox_renew([c[0] for c in claimed]))
+                try:
+                    outcomes = await send_batch(
+                        bot, [(chat_id, text, payload) for _, chat_id, _, payload, text, *_ in claimed]
+                    )
+                    await outbox_complete(claimed, outcomes)
+                except BaseException:
+                    sent = {c[0] for c, o in zip(claimed, outcomes or ()) if o == SEND_OK}
+                    with suppress(Exception):   # αν αποτύχει κι αυτό, τα πιάνει το OUTBOX_CLAIM_TTL
+                        await outbox_release([(c[0], c[2]) for c in claimed], sent)
+                    raise
+                finally:
+                    renew.cancel()
+                elapsed = time.perf_counter() - start
+                metrics.inc("bot_outbox_batches_total")
+                metrics.observe("bot_outbox_batch_seconds", elapsed)
+                metrics.set("bot_outbox_throughput", len(claimed) / elapsed if elapsed else 0.0)
+                continue
+
+            if time.time() - last_prune > 3600:
+                await outbox_prune()
+                await stats_prune()
+                await delivery_prune()
+                last_prune = time.time()
+
+            delay = await outbox_next_delay()
+            await outbox_wait(OUTBOX_IDLE if delay is None else min(delay, OUTBOX_IDLE))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Outbox worker error")
+            await asyncio.sleep(5)
+
+
+# =======================
+# SCHEDULER
+# =======================
+# Αντί για tick κάθε 60s: κοιμάται μέχρι το επόμενο λεπτό που έχει έστω ένα
+# chat και μετά κάνει enqueue όλα τα λεπτά από το watermark μέχρι τώρα. Το
+# watermark (epoch minute) γράφεται στο ίδιο transaction με το outbox, οπότε
+# μετά από restart ή καθυστέρηση καλύπτονται τα χαμένα λεπτά μέσα στο
+# SCHEDULE_CATCHUP_MINUTES. Το index είναι σε UTC, οπότε κάθε λεπτό είναι ένα
+# lookup όσες ζώνες κι αν υπάρχουν. Τα κλειδιά είναι στην τοπική ώρα κάθε
+# chat: όταν γυρίζει η ώρα πίσω, το λεπτό που ξαναφτάνει δεν στέλνεται δύο
+# φορές· όταν πάει μπροστά, όσα τοπικά λεπτά χάθηκαν στέλνονται στην αλλαγή.
+#
+# Pre-staging: SCHEDULE_PRESTAGE s πριν από κάθε λεπτό με chats, οι γραμμές
+# του μπαίνουν ήδη στο outbox με next_at = αρχή του λεπτού, οπότε ο worker
+# ξεκινάει ακριβώς στην ώρα χωρίς query/insert στο κρίσιμο σημείο. Στο tick
+# μπαίνουν μόνο όσοι πρόσθεσαν το slot στο μεταξύ· όσοι το άλλαξαν/έκαναν
+# παύση σβήνονται πριν σταλούν (index_update -> _prestage_stale, και το
+# outbox_claim παρακάμπτει τα disabled). Slots με SCHEDULE_SPREAD_MIN+ chats
+# μοιράζονται σε SCHEDULE_SPREAD_WINDOW s αντί να πέσουν όλα στο ίδιο λεπτό.
+SCHEDULE_CATCHUP_MINUTES = int(os.getenv("SCHEDULE_CATCHUP_MINUTES", "30"))
+SCHEDULE_MAX_SLEEP = 3600.0
+SCHEDULE_PRESTAGE = float(os.getenv("SCHEDULE_PRESTAGE", "30"))            # s· 0 = off
+SCHEDULE_SPREAD_MIN = int(os.getenv("SCHEDULE_SPREAD_MIN", "0"))           # chats· 0 = off
+SCHEDULE_SPREAD_WINDOW = float(os.getenv("SCHEDULE_SPREAD_WINDOW", "300"))  # s
+WATERMARK_KEY = "schedule_watermark"
+_SET_META = "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value"
+
+
+def local_minute(epoch_min: int, tz=TZ) -> datetime:
+    return datetime.fromtimestamp(epoch_min * 60, tz)
+
+
+def next_fire_minute(after_min: int) -> int | None:
+    slots = occupied_slots()
+    if not slots:
+        return None
+    current = utc_slot(after_min)
+    i = bisect_right(slots, current)
+    target = slots[i] if i < len(slots) else slots[0]
+    return after_min + ((target - current) % MINUTES_PER_WEEK or MINUTES_PER_WEEK)
+
+
+async def load_watermark() -> int | None:
+    row = await db_fetchone("SELECT value FROM meta WHERE key=?", (WATERMARK_KEY,))
+    return int(row[0]) if row else None
+
+
+def sched_keys(epoch_min: int, chat_ids: list[int], tz=None) -> list[str]:
+    # idem key ανά chat στην τοπική του ώρα· tz: σταθερή ζώνη για όλα (κενό DST)
+    prefixes: dict[str, str] = {}
+    keys = []
+    for chat_id in chat_ids:
+        zone = _tz_of.get(chat_id, TZ.key)
+        prefix = prefixes.get(zone)
+        if prefix is None:
+            dt = local_minute(epoch_min, tz or ZoneInfo(zone))
+            prefix = prefixes[zone] = f"sched:{dt:%Y-%m-%dT%H:%M}"
+        keys.append(prefix)
+    return keys
+
+
+def spread_window(due: int) -> float:
+    return SCHEDULE_SPREAD_WINDOW if SCHEDULE_SPREAD_MIN and due >= SCHEDULE_SPREAD_MIN else 0.0
+
+
+async def enqueue_due(epoch_min: int, chat_ids: list[int], watermark: int | None = None, tz=None) -> None:
+    # σταθερή σειρά ώστε με spread κάθε chat να παίρνει την ίδια θέση κάθε εβδομάδα
+    chat_ids = sorted(chat_ids)
+    spread = spread_window(len(chat_ids))
+    metrics.inc("bot_scheduler_enqueued_total", len(chat_ids))
+    dt = local_minute(epoch_min)
+    logger.info(
+        "SCHEDULE %s due=%d spread=%.0fs day=%s time=%02d:%02d",
+        "prestage" if epoch_min * 60 > time.time() else "send",
+        len(chat_ids), spread, DAY_NAMES[dt.weekday()], dt.hour, dt.minute,
+    )
+    await outbox_enqueue(
+        "sched", SCHEDULE_TEXT, chat_ids, keys=sched_keys(epoch_min, chat_ids, tz),
+        watermark=watermark, at=epoch_min * 60, spread=spread, slot=utc_slot(epoch_min),
+    )
+
+
+async def prestage(epoch_min: int) -> None:
+    global _prestaged_min
+    chat_ids = list(_due_index.get(utc_slot(epoch_min), ()))
+    _prestaged_min = epoch_min
+    _prestaged_chats.clear()
+    _prestaged_chats.update(chat_ids)
+    if chat_ids:
+        await enqueue_due(epoch_min, chat_ids)
+        metrics.inc("bot_scheduler_prestaged_total", len(chat_ids))
+
+
+async def drop_stale_prestaged() -> None:
+    # σβήνει (όχι cancel) ώστε αν το chat ξαναβάλει το slot να μπει κανονικά στο tick
+    chat_ids = list(_prestage_stale)
+    _prestage_stale.clear()
+    if not chat_ids or _prestaged_min is None:
+        return
+    await db_write_many(
+        "DELETE FROM outbox WHERE idem_key=? AND status=?",
+        [(f"{key}:{chat_id}", OUTBOX_PENDING) for key, chat_id in zip(sched_keys(_prestaged_min, chat_ids), chat_ids)],
+    )
+    metrics.inc("bot_scheduler_prestage_dropped_total", len(chat_ids))
+
+
+async def apply_transitions(epoch_min: int) -> None:
+    # Πριν το λεπτό epoch_min: όποια ζώνη άλλαξε μετατόπιση ξαναϋπολογίζεται.
+    # Αν η ώρα πήγε μπροστά κατά d, τα chats που πλέον πέφτουν στα d λεπτά
+    # πριν την αλλαγή δεν θα έβρισκαν ποτέ το slot τους: στέλνονται τώρα.
+    for tz, stored in list(_zone_offsets.items()):
+        if _zone_next.get(tz, -1) > epoch_min:
+            continue
+        offset = zone_offset(tz, epoch_min)
+        if offset != stored:
+            await recompute_zone(tz, offset)
+            gap = offset - stored
+            for missed in range(epoch_min - gap, epoch_min):
+                chat_ids = [c for c in _due_index.get(utc_slot(missed), ()) if _tz_of.get(c, TZ.key) == tz]
+                if chat_ids:
+                    await enqueue_due(missed, chat_ids, tz=timezone(timedelta(minutes=offset)))
+        _zone_next[tz] = next_transition(tz, epoch_min)
+
+
+async def schedule_tick(first_min: int, last_min: int) -> None:
+    global _prestaged_min
+    await load_zones()
+    for epoch_min in range(first_min, last_min + 1):
+        await apply_transitions(epoch_min)
+        chat_ids = _due_index.get(utc_slot(epoch_min), set())
+        if epoch_min == _prestaged_min:
+            # τα υπόλοιπα είναι ήδη στο outbox από το prestage
+            await drop_stale_prestaged()
+            chat_ids = chat_ids - _prestaged_chats
+            _prestaged_min = None
+            _prestaged_chats.clear()
+        if chat_ids:
+            await enqueue_due(epoch_min, list(chat_ids), watermark=epoch_min)
+    await db_write(_SET_META, (WATERMARK_KEY, str(last_min)))
+
+
+async def scheduler_loop() -> None:
+    global _prestaged_min
+    last = await load_watermark()
+    if last is None:
+        last = int(time.time() // 60) - 1
+    _zone_next.clear()
+    _prestaged_min = None
+    _prestaged_chats.clear()
+    _prestage_stale.clear()
+
+    while True:
+        try:
+            # clear πριν από κάθε await: ό,τι αλλάξει μετά ξαναξυπνάει το loop
+            _slots_changed.clear()
+            await drop_stale_prestaged()
+            now_min = int(time.time() // 60)
+            if now_min > last:
+                first = last + 1
+                if first < now_min - SCHEDULE_CATCHUP_MINUTES:
+                    logger.warning(
+                        "SCHEDULE skipped %d minutes beyond catch-up window",
+                        now_min - SCHEDULE_CATCHUP_MINUTES - first,
+                    )
+                    first = now_min - SCHEDULE_CATCHUP_MINUTES
+                if now_min - first > 1:
+                    logger.info("SCHEDULE catch-up minutes=%d", now_min - first + 1)
+                    metrics.inc("bot_scheduler_catchup_minutes_total", now_min - first)
+                # πόσο αργήσαμε σε σχέση με την αρχή του λεπτού
+                metrics.observe("bot_scheduler_lag_seconds", time.time() - now_min * 60)
+                await schedule_tick(first, now_min)
+                metrics.inc("bot_scheduler_ticks_total")
+                last = now_min
+
+            nxt = next_fire_minute(last)
+            if _zone_next:
+                nxt = min(nxt or last + MINUTES_PER_WEEK, min(_zone_next.values()))
+            timeout = SCHEDULE_MAX_SLEEP
+            if nxt is not None:
+                timeout = min(timeout, max(0.0, nxt * 60 - time.time()))
+                # όχι πάνω σε αλλαγή ώρας: εκεί το slot ξαναϋπολογίζεται στο tick
+                if SCHEDULE_PRESTAGE > 0 and nxt != _prestaged_min and nxt == next_fire_minute(last) \
+                        and min(_zone_next.values(), default=nxt + 1) > nxt:
+                    lead = nxt * 60 - SCHEDULE_PRESTAGE - time.time()
+                    if lead <= 0:
+                        await prestage(nxt)
+                    else:
+                        timeout = min(timeout, lead)
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(_slots_changed.wait(), timeout=timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Scheduler error")
+            await asyncio.sleep(5)
+
+
+# =======================
+# STATS (συντηρούνται σταδιακά)
+# =======================
+# Το /stats δεν κάνει ποτέ COUNT(*) σε chats/schedules/outbox. Triggers
+# κρατάνε τα σύνολα (counters), πόσα ενεργά chats έχει κάθε UTC λεπτό της
+# εβδομάδας (slot_counts) και το churn ανά μέρα (daily_stats)· οι αποστολές
+# μπαίνουν στο daily_stats από το outbox_complete, στο ίδιο transaction.
+STATS_DAYS = 7                     # παράθυρο για churn/αποστολές στο /stats
+STATS_HOT_SLOTS = 5
+STATS_RETENTION_DAYS = 90
+
+_TODAY_SQL = "date('now')"         # UTC μέρα, ίδια με το _stats_day()
+_BUMP_SQL = (
+    "INSERT INTO daily_stats (day, name, value) VALUES ({day}, {name}, {n}) "
+    "ON CONFLICT(day, name) DO UPDATE SET value=value+excluded.value"
+)
+_SLOT_ENABLED_SQL = "(SELECT enabled FROM chats WHERE chat_id={p}.chat_id)=1"
+
+
+def _stats_day(ts: float) -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime(ts))
+
+
+async def init_stats(db: aiosqlite.Connection) -> None:
+    existed = await db.execute_fetchall(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='counters'"
+    )
+    await db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    await db.execute(
+        "CREATE TABLE IF NOT EXISTS slot_counts (utc_mow INTEGER PRIMARY KEY, chats INTEGER NOT NULL)"
+    )
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_slot_counts_chats ON slot_counts (chats)")
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT NOT NULL,               -- YYYY-MM-DD (UTC)
+            name TEXT NOT NULL,              -- new | opt_in | opt_out | sent | failed | blocked | retry
+            value INTEGER NOT NULL,
+            PRIMARY KEY (day, name)
+        ) WITHOUT ROWID
+        """
+    )
+
+    bump = functools.partial(_BUMP_SQL.format, day=_TODAY_SQL)
+    await db.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_chats_insert AFTER INSERT ON chats
+        BEGIN
+            UPDATE counters SET value=value+1 WHERE name='chats_total';
+            UPDATE counters SET value=value+NEW.enabled WHERE name='chats_enabled';
+            {bump(name="'new'", n=1)};
+            {bump(name="'opt_in'", n='NEW.enabled')};
+        END
+        """
+    )
+    await db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_stats_chats_delete AFTER DELETE ON chats
+        BEGIN
+            UPDATE counters SET value=value-1 WHERE name='chats_total';
+            UPDATE counters SET value=value-OLD.enabled WHERE name='chats_enabled';
+            UPDATE slot_counts SET chats=chats-1
+            WHERE OLD.enabled=1 AND utc_mow IN (SELECT utc_mow FROM schedules WHERE chat_id=OLD.chat_id);
+        END
+        """
+    )
+    await db.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_chats_enabled AFTER UPDATE OF enabled ON chats
+        WHEN OLD.enabled<>NEW.enabled
+        BEGIN
+            UPDATE counters SET value=value+NEW.enabled-OLD.enabled WHERE name='chats_enabled';
+            {bump(name="'opt_in'", n='NEW.enabled')};
+            {bump(name="'opt_out'", n='OLD.enabled')};
+            INSERT INTO slot_counts (utc_mow, chats)
+            SELECT utc_mow, 1 FROM schedules WHERE NEW.enabled=1 AND chat_id=NEW.chat_id AND utc_mow IS NOT NULL
+            ON CONFLICT(utc_mow) DO UPDATE SET chats=chats+1;
+            UPDATE slot_counts SET chats=chats-1
+            WHERE NEW.enabled=0 AND utc_mow IN (SELECT utc_mow FROM schedules WHERE chat_id=NEW.chat_id);
+        END
+        """
+    )
+    # το utc_mow γράφεται από trg_schedules_utc_* μετά το INSERT, οπότε το
+    # slot μετράει στο UPDATE OF utc_mow (και στο INSERT μόνο αν ήρθε έτοιμο)
+    await db.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_schedules_insert AFTER INSERT ON schedules
+        WHEN NEW.utc_mow IS NOT NULL AND {_SLOT_ENABLED_SQL.format(p='NEW')}
+        BEGIN
+            INSERT INTO slot_counts (utc_mow, chats) VALUES (NEW.utc_mow, 1)
+            ON CONFLICT(utc_mow) DO UPDATE SET chats=chats+1;
+        END
+        """
+    )
+    await db.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_schedules_slot AFTER UPDATE OF utc_mow ON schedules
+        WHEN OLD.utc_mow IS NOT NEW.utc_mow AND {_SLOT_ENABLED_SQL.format(p='NEW')}
+        BEGIN
+            UPDATE slot_counts SET chats=chats-1 WHERE OLD.utc_mow IS NOT NULL AND utc_mow=OLD.utc_mow;
+            INSERT INTO slot_counts (utc_mow, chats) SELECT NEW.utc_mow, 1 WHERE NEW.utc_mow IS NOT NULL
+            ON CONFLICT(utc_mow) DO UPDATE SET chats=chats+1;
+        END
+        """
+    )
+    await db.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_stats_schedules_delete AFTER DELETE ON schedules
+        WHEN OLD.utc_mow IS NOT NULL AND {_SLOT_ENABLED_SQL.format(p='OLD')}
+        BEGIN UPDATE slot_counts SET chats=chats-1 WHERE utc_mow=OLD.utc_mow; END
+        """
+    )
+
+    if not existed:
+        # πρώτη φορά: ένα πλήρες πέρασμα, μετά μόνο τα triggers
+        await db.execute(
+            """
+            INSERT INTO counters (name, value)
+            SELECT 'chats_total', COUNT(*) FROM chats
+            UNION ALL SELECT 'chats_enabled', COUNT(*) FILTER (WHERE enabled=1) FROM chats
+            """
+        )
+        await db.execute(
+            """
+            INSERT INTO slot_counts (utc_mow, chats)
+            SELECT s.utc_mow, COUNT(*) FROM schedules s JOIN chats c ON c.chat_id=s.chat_id
+            WHERE c.enabled=1 AND s.utc_mow IS NOT NULL GROUP BY s.utc_mow
+            """
+        )
+
+
+@timed("bot_db")
+async def stats_prune() -> None:
+    await db_write(
+        "DELETE FROM daily_stats WHERE day<?", (_stats_day(time.time() - STATS_RETENTION_DAYS * 86400),)
+    )
+
+
+@timed("bot_db")
+async def get_stats() -> dict:
+    counters = dict(await db_fetchall("SELECT name, value FROM counters"))
+    days: dict[str, dict[str, int]] = {}
+    for day, name, value in await db_fetchall(
+        "SELECT day, name, value FROM daily_stats WHERE day>=? ORDER BY day",
+        (_stats_day(time.time() - (STATS_DAYS - 1) * 86400),),
+    ):
+        days.setdefault(day, {})[name] = value
+    hot = await db_fetchall(
+        "SELECT utc_mow, chats FROM slot_counts WHERE chats>0 ORDER BY chats DESC LIMIT ?", (STATS_HOT_SLOTS,)
+    )
+    slots = await db_fetchone("SELECT COUNT(*) FROM slot_counts WHERE chats>0")
+    return {
+        "enabled": counters.get("chats_enabled", 0),
+        "total": counters.get("chats_total", 0),
+        "days": days,
+        "hot": hot,
+        "slots": slots[0],
+    }
+
+
+def describe_slot(utc_mow: int, tz: str = TZ.key) -> str:
+    local = (utc_mow + _zone_offsets.get(tz, 0)) % MINUTES_PER_WEEK
+    return f"{DAY_NAMES[local // 1440][:3]} {local % 1440 // 60:02d}:{local % 60:02d}"
+
+
+# =======================
+# DELIVERIES (ιστορικό αποστολών)
+# =======================
+# Μία γραμμή ανά αποτέλεσμα αποστολής, γραμμένη από το outbox_complete σε
+# ένα executemany ανά batch, στο ίδιο transaction με το outbox. Ένας πίνακας
+# ανά UTC μέρα (deliveries_YYYYMMDD), οπότε η διατήρηση είναι DROP TABLE
+# ολόκληρων ημερών και όχι μεγάλα DELETE. status = SEND_* (SEND_RETRY: θα
+# ξαναδοκιμαστεί), slot = UTC λεπτό της εβδομάδας (NULL για broadcast),
+# latency_ms = από την προγραμματισμένη ώρα μέχρι το αποτέλεσμα.
+DELIVERY_RETENTION_DAYS = max(1, int(os.getenv("DELIVERY_RETENTION_DAYS", "30")))
+DELIVERY_QUERY_DAYS = 7
+DELIVERY_SHOW = 15
+DELIVERY_STATUS = {SEND_OK: "✅", SEND_BLOCKED: "⛔", SEND_RETRY: "🔁", SEND_FAILED: "❌"}
+_DELIVERY_PREFIX = "deliveries_"
+
+_delivery_days: set[str] = set()   # partitions που ξέρουμε ότι υπάρχουν
+
+
+def _delivery_day(ts: float) -> str:
+    return time.strftime("%Y%m%d", time.gmtime(ts))
+
+
+async def init_deliveries(db: aiosqlite.Connection) -> None:
+    rows = await db.execute_fetchall(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name>=? AND name<?",
+        (_DELIVERY_PREFIX, _DELIVERY_PREFIX + "a"),
+    )
+    _delivery_days.clear()
+    _delivery_days.update(name.removeprefix(_DELIVERY_PREFIX) for name, in rows)
+
+
+async def _delivery_partition(db: aiosqlite.Connection, day: str) -> str:
+    table = _DELIVERY_PREFIX + day
+    if day not in _delivery_days:
+        await db.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                chat_id INTEGER NOT NULL,
+                ts INTEGER NOT NULL,
+                status INTEGER NOT NULL,
+                slot INTEGER,
+                latency_ms INTEGER NOT NULL,
+                payload_id INTEGER NOT NULL
+            )
+            """
+        )
+        await db.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_chat ON {table} (chat_id, ts)")
+        # covering για το /slotrate: μετράει και βγάζει latency χωρίς να διαβάσει τον πίνακα
+        await db.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_slot ON {table} (slot, status, latency_ms)")
+        _delivery_days.add(day)
+    return table
+
+
+async def record_deliveries(db: aiosqlite.Connection, now: float, rows: list[tuple]) -> None:
+    # rows: (chat_id, status, slot, due_at, payload_id)· μέσα στο transaction του καλούντα
+    if not rows:
+        return
+    table = await _delivery_partition(db, _delivery_day(now))
+    ts = int(now)
+    await db.executemany(
+        f"INSERT INTO {table} (chat_id, ts, status, slot, latency_ms, payload_id) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (chat_id, ts, status, slot, max(0, int((now - due_at) * 1000)), payload_id)
+            for chat_id, status, slot, due_at, payload_id in rows
+        ],
+    )
+    metrics.inc("bot_deliveries_recorded_total", len(rows))
+
+
+async def delivery_tables(days: int) -> list[str]:
+    # οι partitions των τελευταίων `days` UTC ημερών, νεότερη πρώτη
+    rows = await db_fetchall(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name>=? AND name<? ORDER BY name DESC",
+        (_DELIVERY_PREFIX + _delivery_day(time.time() - (days - 1) * 86400), _DELIVERY_PREFIX + "a"),
+    )
+    return [name for name, in rows]
+
+
+@timed("bot_db")
+async def delivery_prune() -> None:
+    tables = await db_fetchall(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name>=? AND name<?",
+        (_DELIVERY_PREFIX, _DELIVERY_PREFIX + _delivery_day(time.time() - (DELIVERY_RETENTION_DAYS - 1) * 86400)),
+    )
+    if not tables:
+        return
+    async with write_txn() as db:
+        for name, in tables:
+            await db.execute(f"DROP TABLE IF EXISTS {name}")
+    # μετά το commit: σε rollback τα partitions υπάρχουν ακόμα
+    _delivery_days.difference_update(name.removeprefix(_DELIVERY_PREFIX) for name, in tables)
+    logger.info("DELIVERIES dropped %s", " ".join(name for name, in tables))
+
+
+@timed("bot_db")
+async def chat_deliveries(chat_id: int, days: int = DELIVERY_QUERY_DAYS, limit: int = DELIVERY_SHOW) -> list[tuple]:
+    # (ts, status, slot, latency_ms, payload_id), νεότερα πρώτα· index (chat_id, ts) σε κάθε μέρα
+    tables = await delivery_tables(days)
+    if not tables:
+        return []
+    union = " UNION ALL ".join(
+        f"SELECT ts, status, slot, latency_ms, payload_id FROM {table} WHERE chat_id=?" for table in tables
+    )
+    return await db_fetchall(f"{union} ORDER BY ts DESC LIMIT ?", (*[chat_id] * len(tables), limit))
+
+
+@timed("bot_db")
+async def slot_deliveries(slots: list[int], days: int = DELIVERY_QUERY_DAYS) -> list[tuple]:
+    # (day, status, πλήθος, μέσο latency_ms, max latency_ms) ανά μέρα, μόνο από το index (slot, status, latency_ms)
+    tables = await delivery_tables(days)
+    if not tables or not slots:
+        return []
+    marks = ",".join("?" * len(slots))
+    union = " UNION ALL ".join(
+        f"SELECT '{table.removeprefix(_DELIVERY_PREFIX)}', status, COUNT(*), AVG(latency_ms), MAX(latency_ms) "
+        f"FROM {table} WHERE slot IN ({marks}) GROUP BY status"
+        for table in tables
+    )
+    return await db_fetchall(union, tuple(slots) * len(tables))
+
+
+# =======================
+# CLUSTER (πολλά instances)
+# =======================
+# Όλα τα instances μοιράζονται το ίδιο SQLite αρχείο. Συντονίζονται με leases
+# (όνομα -> holder, λήξη) που ανανεώνονται κάθε LEASE_RENEW:
+#   instance:<id>  heartbeat, ποια instances ζουν
+#   scheduler      ο leader· μόνο αυτός τρέχει το scheduler_loop
+#   shard:<n>      ποιος στέλνει τις γραμμές του outbox με chat_id % OUTBOX_SHARDS == n
+# Αν ένα instance πέσει, τα leases του λήγουν μετά από LEASE_TTL και τα
+# παίρνουν τα υπόλοιπα· τα claimed μηνύματά του ξαναγίνονται pending από τον
+# leader. Το index του leader μένει συγχρονισμένο με εγγραφές άλλων instances
+# μέσω του chat_changes (triggers στο chats και στο schedules).
+# Long polling επιτρέπεται σε ένα μόνο instance· τα επιπλέον τρέχουν με
+# BOT_ROLE=worker (μόνο scheduler/αποστολή) ή όλα με BOT_MODE=webhook.
+INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+BOT_ROLE = os.getenv("BOT_ROLE", "all")                # all | worker
+OUTBOX_SHARDS = int(os.getenv("OUTBOX_SHARDS", "16"))  # ίδιο σε όλα τα instances
+LEASE_TTL = float(os.getenv("LEASE_TTL", "15"))
+LEASE_RENEW = LEASE_TTL / 3
+SCHEDULER_LEASE = "scheduler"
+# claim που δεν ολοκληρώθηκε μέσα σε τόσα s ξαναγίνεται pending ακόμα κι αν
+# το instance ζει (worker που έσκασε χωρίς release)· πάνω από τη διάρκεια
+# ενός batch, αλλιώς ένα αργό batch θα σταλεί δύο φορές
+OUTBOX_CLAIM_TTL = float(os.getenv("OUTBOX_CLAIM_TTL", "600"))
+
+_owned_shards: set[int] = set()
+
+
+async def init_cluster(db: aiosqlite.Connection) -> None:
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """
+    )
+    # AUTOINCREMENT: το seq δεν ξαναχρησιμοποιείται μετά το prune
+    await db.execute(
+        "CREATE TABLE IF NOT EXISTS chat_changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL)"
+    )
+    await db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_chats_insert AFTER INSERT ON chats
+        BEGIN INSERT INTO chat_changes (chat_id) VALUES (NEW.chat_id); END
+        """
+    )
+    await db.execute("DROP TRIGGER IF EXISTS trg_chats_update")   # παλιός ορισμός με dow/hour/minute
+    await db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_chats_update AFTER UPDATE OF enabled, tz ON chats
+        BEGIN INSERT INTO chat_changes (chat_id) VALUES (NEW.chat_id); END
+        """
+    )
+    for event, row in (("INSERT", "NEW"), ("DELETE", "OLD"), ("UPDATE OF dow, hour, minute", "NEW")):
+        name = "trg_schedules_" + event.split()[0].lower()
+        await db.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON schedules
+            BEGIN INSERT INTO chat_changes (chat_id) VALUES ({row}.chat_id); END
+            """
+        )
+
+
+class SqliteLeaseStore:
+    # Ό,τι έχει acquire/release_all/live μπορεί να το αντικαταστήσει
+    # (π.χ. ένα dict για τοπικές δοκιμές).
+
+    async def acquire(self, name: str, holder: str, ttl: float) -> bool:
+        # πετυχαίνει αν το lease είναι ελεύθερο, δικό μας ή έχει λήξει
+        now = time.time()
+        row = await db_write(
+            """
+            INSERT INTO leases (name, holder, expires_at) VALUES (?1, ?2, ?3)
+            ON CONFLICT(name) DO UPDATE SET holder=excluded.holder, expires_at=excluded.expires_at
+            WHERE leases.holder=excluded.holder OR leases.expires_at<?4
+            RETURNING holder
+            """,
+            (name, holder, now + ttl, now),
+        )
+        return row is not None
+
+    async def release(self, name: str, holder: str) -> None:
+        await db_write("DELETE FROM leases WHERE name=? AND holder=?", (name, holder))
+
+    async def release_all(self, holder: str) -> None:
+        await db_write("DELETE FROM leases WHERE holder=?", (holder,))
+
+    async def live(self, prefix: str) -> dict[str, str]:
+        rows = await db_fetchall(
+            "SELECT name, holder FROM leases WHERE name LIKE ? AND expires_at>=?",
+            (prefix + "%", time.time()),
+        )
+        return dict(rows)
+
+
+lease_store = SqliteLeaseStore()
+
+
+async def rebalance_shards() -> None:
+    # Κάθε instance κρατάει ως ceil(shards / ζωντανά instances): ανανεώνει
+    # τα δικά του, αφήνει τα επιπλέον και παίρνει ελεύθερα/ληγμένα.
+    instances = await lease_store.live("instance:")
+    fair = -(-OUTBOX_SHARDS // max(1, len(instances)))
+    owners = await lease_store.live("shard:")
+    mine = sorted(int(name[6:]) for name, holder in owners.items() if holder == INSTANCE_ID)
+    keep, extra = mine[:fair], mine[fair:]
+    free = [s for s in range(OUTBOX_SHARDS) if f"shard:{s}" not in owners]
+
+    renewed = await asyncio.gather(*(
+        lease_store.acquire(f"shard:{s}", INSTANCE_ID, LEASE_TTL) for s in keep
+    ))
+    owned = {s for s, ok in zip(keep, renewed) if ok}
+    for shard in extra:
+        await lease_store.release(f"shard:{shard}", INSTANCE_ID)
+    wanted = free[:max(0, fair - len(owned))]
+    acquired = await asyncio.gather(*(
+        lease_store.acquire(f"shard:{s}", INSTANCE_ID, LEASE_TTL) for s in wanted
+    ))
+    owned.update(s for s, ok in zip(wanted, acquired) if ok)
+
+    if owned != _owned_shards:
+        logger.info("CLUSTER shards instance=%s owned=%s", INSTANCE_ID, sorted(owned))
+        gained = bool(owned - _owned_shards)
+        _owned_shards.clear()
+        _owned_shards.update(owned)
+        # το όριο του Telegram είναι ανά bot token: μοιράζεται αναλογικά
+        _send_bucket.set_max_rate(BROADCAST_RATE * max(1, len(owned)) / OUTBOX_SHARDS)
+        if gained:
+            _outbox_wakeup.set()
+    metrics.set("bot_cluster_shards", len(_owned_shards))
+    metrics.set("bot_cluster_instances", len(instances))
+
+
+async def cluster_heartbeat() -> None:
+    await lease_store.acquire(f"instance:{INSTANCE_ID}", INSTANCE_ID, LEASE_TTL)
+    await rebalance_shards()
+
+
+@timed("bot_db")
+async def outbox_recover() -> int:
+    # claimed από instance που δεν ζει πια ή με ληγμένο claim -> ξανά pending
+    now = time.time()
+    async with write_txn() as db:
+        cur = await db.execute(
+            """
+            UPDATE outbox SET status=?, claimed_by=NULL
+            WHERE status=? AND (updated_at<? OR COALESCE(claimed_by, '') NOT IN (
+                SELECT holder FROM leases WHERE name LIKE 'instance:%' AND expires_at>=?
+            ))
+            """,
+            (OUTBOX_PENDING, OUTBOX_CLAIMED, now - OUTBOX_CLAIM_TTL, now),
+        )
+    if cur.rowcount > 0:
+        logger.warning("OUTBOX recovered claimed=%d (dead instance or expired claim)", cur.rowcount)
+        _outbox_wakeup.set()
+    return max(cur.rowcount, 0)
+
+
+async def index_catch_up(cursor: int) -> int:
+    # εφαρμόζει στο index τις αλλαγές σε chats/schedules μετά το cursor (και όσες έγραψαν άλλα instances)
+    while True:
+        rows = await db_fetchall(
+            "SELECT seq, chat_id FROM chat_changes WHERE seq>? ORDER BY seq LIMIT ?",
+            (cursor, INDEX_LOAD_CHUNK),
+        )
+        if not rows:
+            return cursor
+        chat_ids = list({chat_id for _, chat_id in rows})
+        for chat_id in chat_ids:
+            _settings_cache.discard(chat_id)
+        for i in range(0, len(chat_ids), 500):
+            chunk = chat_ids[i:i + 500]
+            _index_rows(await db_fetchall(
+                _CHAT_SLOTS_SQL + f" WHERE c.chat_id IN ({','.join('?' * len(chunk))}) ORDER BY c.chat_id",
+                tuple(chunk),
+            ))
+        cursor = rows[-1][0]
+        await db_write("DELETE FROM chat_changes WHERE seq<=?", (cursor,))
+        if len(rows) < INDEX_LOAD_CHUNK:
+            return cursor
+
+
+async def cluster_loop() -> None:
+    scheduler = None
+    cursor = 0
+    try:
+        while True:
+            try:
+                await cluster_heartbeat()
+                leader = await lease_store.acquire(SCHEDULER_LEASE, INSTANCE_ID, LEASE_TTL)
+                if leader and scheduler is None:
+                    # ό,τι έγραψαν άλλα instances όσο δεν ήμασταν leader
+                    row = await db_fetchone("SELECT COALESCE(MAX(seq), 0) FROM chat_changes")
+                    cursor = row[0]
+                    indexed = await load_schedule_index()
+                    logger.info(
+                        "CLUSTER leader instance=%s chats=%d slots=%d", INSTANCE_ID, indexed, len(_due_index)
+                    )
+                    scheduler = asyncio.create_task(scheduler_loop(), name="scheduler")
+                elif not leader and scheduler is not None:
+                    logger.warning("CLUSTER lost leadership instance=%s", INSTANCE_ID)
+                    scheduler.cancel()
+                    await asyncio.gather(scheduler, return_exceptions=True)
+                    scheduler = None
+                if leader:
+                    cursor = await index_catch_up(cursor)
+                    await outbox_recover()
+                metrics.set("bot_cluster_leader", 1 if leader else 0)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Cluster error")
+            await asyncio.sleep(LEASE_RENEW)
+    finally:
+        if scheduler is not None:
+            scheduler.cancel()
+            await asyncio.gather(scheduler, return_exceptions=True)
+
+
+async def cluster_leave() -> None:
+    # κλείσιμο χωρίς αναμονή LEASE_TTL για failover
+    _owned_shards.clear()
+    await lease_store.release_all(INSTANCE_ID)
+
+
+# =======================
+# IMPORT / EXPORT / BACKUP
+# =======================
+# Export/import των chats (με τα schedules τους) σε CSV ή JSONL (και .gz),
+# ανά DATA_CHUNK γραμμές: σταθερή μνήμη όσο μεγάλο κι αν είναι το αρχείο, και
+# κάθε chunk είναι ένα σύντομο transaction, οπότε scheduler και handlers
+# παίρνουν το write lock ανάμεσα. Τα triggers (utc_mow, chat_changes, stats)
+# τρέχουν όπως σε κάθε εγγραφή, άρα index και /stats ενημερώνονται μόνα τους.
+# Backup: sqlite3 backup API σε thread και δική του σύνδεση, σε βήματα των
+# BACKUP_PAGES πάνω σε ένα read snapshot· με WAL ο reader δεν μπλοκάρει τον
+# writer και το backup δεν ξαναρχίζει όταν γράφει το bot στο μεταξύ.
+DATA_CHUNK = 5000
+DATA_FIELDS = ["chat_id", "enabled", "tz", "schedules"]
+DATA_MAX_ERRORS_LOGGED = 10
+BACKUP_DIR = os.getenv("BACKUP_DIR", "")           # κενό = χωρίς αυτόματο backup
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL", str(24 * 3600)))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_PAGES = 1024                                 # σελίδες ανά βήμα
+BACKUP_LEASE = "backup"
+BACKUP_LAST_KEY = "backup_last"
+
+
+def _open_data(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def _data_format(path: str) -> str:
+    return "jsonl" if path.removesuffix(".gz").endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def format_schedules(scheds: list[tuple[int, int, int]]) -> str:
+    return " ".join(f"{dow}:{hour:02d}:{minute:02d}" for dow, hour, minute in scheds)
+
+
+def _parse_schedules(value) -> list[tuple[int, int, int]] | None:
+    # None: το πεδίο λείπει, τα schedules του chat μένουν ως έχουν
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = [part.split(":") for part in value.split()]
+    scheds = sorted({(int(d), int(h), int(m)) for d, h, m in value})
+    for dow, hour, minute in scheds:
+        if not (0 <= dow <= 6 and 0 <= hour <= 23 and 0 <= minute <= 59):
+            raise ValueError(f"schedule {dow}:{hour}:{minute}")
+    return scheds
+
+
+def _import_row(rec: dict) -> tuple[int, int, str, list[tuple[int, int, int]] | None]:
+    enabled = rec.get("enabled")
+    enabled = 1 if enabled in (None, "") else int(enabled)
+    tz = parse_tz(rec.get("tz") or TZ.key)
+    if enabled not in (0, 1) or tz is None:
+        raise ValueError(f"enabled={rec.get('enabled')!r} tz={rec.get('tz')!r}")
+    return int(rec["chat_id"]), enabled, tz, _parse_schedules(rec.get("schedules"))
+
+
+def _read_chunk(records, size: int) -> tuple[list[tuple], list[str]]:
+    # τρέχει σε thread: διάβασμα + parse ενός chunk χωρίς να κρατάει το event loop.
+    # Ίδιο chat_id δύο φορές (π.χ. δύο exports μαζί): κερδίζει το τελευταίο, όπως
+    # και ανάμεσα σε chunks· χωρίς schedules κρατάει όσα έδωσε το προηγούμενο
+    rows: dict[int, tuple] = {}
+    errors = []
+    for line_no, rec in itertools.islice(records, size):
+        try:
+            row = _import_row(json.loads(rec) if isinstance(rec, str) else rec)
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            errors.append(f"{line_no}: {e}")
+            continue
+        prev = rows.get(row[0])
+        if prev is not None and row[3] is None:
+            row = (*row[:3], prev[3])
+        rows[row[0]] = row
+    return list(rows.values()), errors
+
+
+@timed("bot_db")
+async def _import_chunk(rows: list[tuple]) -> None:
+    for tz in {row[2] for row in rows} - _zone_offsets.keys():
+        await ensure_zone(tz)
+    replace = [row for row in rows if row[3] is not None]
+    schedules = [
+        (row[0], *sched, zone_slot(minute_of_week(*sched), row[2])) for row in replace for sched in row[3]
+    ]
+    async with write_txn() as db:
+        # ένα JSON όρισμα ανά statement: το json_each ξεδιπλώνει τις γραμμές μέσα
+        # στη sqlite, χωρίς bind ανά γραμμή (και GIL) όπως στο executemany.
+        # json_extract και όχι ->> (θέλει sqlite 3.38, παλιότερο στα Windows builds)
+        await db.execute(
+            """
+            INSERT INTO chats (chat_id, enabled, tz)
+            SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]'), json_extract(value, '$[2]')
+            FROM json_each(?) WHERE true
+            ON CONFLICT(chat_id) DO UPDATE SET enabled=excluded.enabled, tz=excluded.tz
+            WHERE enabled<>excluded.enabled OR tz<>excluded.tz
+            """,
+            (json.dumps([row[:3] for row in rows]),),
+        )
+        await db.execute(
+            "DELETE FROM schedules WHERE chat_id IN (SELECT value FROM json_each(?))",
+            (json.dumps([row[0] for row in replace]),),
+        )
+        await db.execute(
+            """
+            INSERT INTO schedules (chat_id, dow, hour, minute, utc_mow)
+            SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]'), json_extract(value, '$[2]'),
+                json_extract(value, '$[3]'), json_extract(value, '$[4]')
+            FROM json_each(?)
+            """,
+            (json.dumps(schedules),),
+        )
+
+
+async def import_chats(path: str, job: "AdminJob | None" = None) -> tuple[int, int]:
+    # upsert ανά chat_id· γραμμές με λάθη προσπερνιούνται (και γράφονται στο log).
+    # Pipeline: όσο γράφεται ένα chunk, το επόμενο διαβάζεται στο thread.
+    imported = skipped = 0
+    writing = None
+    with _open_data(path, "r") as f:
+        if _data_format(path) == "csv":
+            records = enumerate(csv.DictReader(f), start=2)
+        else:
+            records = ((n, line) for n, line in enumerate(f, start=1) if line.strip())
+        try:
+            while True:
+                rows, errors = await asyncio.to_thread(_read_chunk, records, DATA_CHUNK)
+                for error in errors[:max(0, DATA_MAX_ERRORS_LOGGED - skipped)]:
+                    logger.warning("IMPORT skip %s:%s", path, error)
+                skipped += len(errors)
+                if writing is not None:
+                    await writing
+                    writing = None
+                if not rows and not errors:
+                    break
+                if rows:
+                    writing = asyncio.ensure_future(_import_chunk(rows))
+                imported += len(rows)
+                if job is not None:
+                    job.progress = f"{imported} chats"
+        finally:
+            if writing is not None:
+                await writing
+    _settings_cache.clear()
+    logger.info("IMPORT %s imported=%d skipped=%d", path, imported, skipped)
+    return imported, skipped
+
+
+async def export_chats(path: str, job: "AdminJob | None" = None) -> int:
+    # keyset σελίδες ανά chat_id: κάθε query είναι σύντομο, όχι ένας cursor για όλο το export
+    jsonl = _data_format(path) == "jsonl"
+    # το .tmp μπαίνει μπροστά ώστε να μείνει η κατάληξη (.gz) που ορίζει τη συμπίεση
+    tmp = os.path.join(os.path.dirname(path), ".tmp-" + os.path.basename(path))
+    count, last = 0, -(1 << 63)
+    with _open_data(tmp, "w") as f:
+        writer = None if jsonl else csv.writer(f)
+        if writer is not None:
+            writer.writerow(DATA_FIELDS)
+        while True:
+            rows = await db_fetchall(
+                """
+                SELECT c.chat_id, c.enabled, c.tz, group_concat(s.dow || ':' || s.hour || ':' || s.minute)
+                FROM (SELECT * FROM chats WHERE chat_id>? ORDER BY chat_id LIMIT ?) c
+                LEFT JOIN schedules s ON s.chat_id=c.chat_id
+                GROUP BY c.chat_id ORDER BY c.chat_id
+                """,
+                (last, DATA_CHUNK),
+            )
+            if not rows:
+                break
+            for chat_id, enabled, tz, packed in rows:
+                scheds = _parse_schedules((packed or "").replace(",", " "))
+                if jsonl:
+                    f.write(json.dumps(
+                        {"chat_id": chat_id, "enabled": enabled, "tz": tz, "schedules": scheds},
+                        ensure_ascii=False,
+                    ) + "\n")
+                else:
+                    writer.writerow((chat_id, enabled, tz, format_schedules(scheds)))
+            count += len(rows)
+            last = rows[-1][0]
+            if job is not None:
+                job.progress = f"{count} chats"
+    os.replace(tmp, path)
+    logger.info("EXPORT %s chats=%d", path, count)
+    return count
+
+
+def _backup_to(dest: str) -> int:
+    # τρέχει σε thread· το BEGIN + SELECT κρατάει ένα snapshot για όλα τα βήματα
+    tmp = dest + ".tmp"
+    src = sqlite3.connect(f"file:{os.path.abspath(DB_PATH)}?mode=ro", uri=True)
+    try:
+        src.execute("BEGIN")
+        src.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()
+        dst = sqlite3.connect(tmp)
+        try:
+            src.backup(dst, pages=BACKUP_PAGES)
+        finally:
+            dst.close()
+    finally:
+        src.close()
+    os.replace(tmp, dest)
+    return os.path.getsize(dest)
+
+
+@timed("bot_db")
+async def backup_db(dest: str | None = None) -> tuple[str, int]:
+    if dest is None:
+        os.makedirs(BACKUP_DIR or ".", exist_ok=True)
+        dest = os.path.join(BACKUP_DIR or ".", f"bot-{time.strftime('%Y%m%d-%H%M%S')}.db")
+    start = time.perf_counter()
+    size = await asyncio.to_thread(_backup_to, dest)
+    logger.info("BACKUP %s bytes=%d seconds=%.1f", dest, size, time.perf_counter() - start)
+    return dest, size
+
+
+def prune_backups() -> None:
+    names = sorted(n for n in os.listdir(BACKUP_DIR) if n.startswith("bot-") and n.endswith(".db"))
+    for name in names[:-BACKUP_KEEP] if BACKUP_KEEP > 0 else []:
+        os.remove(os.path.join(BACKUP_DIR, name))
+
+
+async def backup_loop() -> None:
+    # το τελευταίο backup είναι στο meta και το lease το κρατάει μόνο όσο
+    # γράφει, οπότε σε cluster γίνεται ένα backup ανά BACKUP_INTERVAL
+    while True:
+        try:
+            row = await db_fetchone("SELECT value FROM meta WHERE key=?", (BACKUP_LAST_KEY,))
+            due = (float(row[0]) if row else 0.0) + BACKUP_INTERVAL - time.time()
+            if due <= 0 and await lease_store.acquire(BACKUP_LEASE, INSTANCE_ID, BACKUP_INTERVAL / 2):
+                try:
+                    await backup_db()
+                    await db_write(_SET_META, (BACKUP_LAST_KEY, str(time.time())))
+                    prune_backups()
+                    metrics.inc("bot_backups_total")
+                finally:
+                    await lease_store.release(BACKUP_LEASE, INSTANCE_ID)
+                continue
+            await asyncio.sleep(min(max(due, 60.0), SCHEDULE_MAX_SLEEP))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Backup error")
+            await asyncio.sleep(300)
+
+
+async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await update.message.reply_text(HELP_TEXT, parse_mode="Markdown")
+
+
+async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    logger.info("USER start chat_id=%s user_id=%s", update.effective_chat.id, update.effective_user.id)
+
+    chat_id = update.effective_chat.id
+
+    # Ενεργοποίησε χωρίς να αλλάξεις την ώρα/μέρα (νέο chat: Δευτέρα 08:00)
+    scheds = await activate_schedule(chat_id)
+
+    await update.message.reply_text(
+        "✅ Ενεργοποιήθηκε!\n\n"
+        f"🗓️ Τρέχουσα ρύθμιση:\n"
+        f"{describe_schedules(scheds)}\n\n"
+        "🔧 Για αλλαγή ώρας, απλά αντέγραψε ένα από τα παρακάτω "
+        "ή στείλε το δικό σου με την ίδια λογική:\n\n"
+        "`/set Κυριακή 23:58`\n"
+        "`Δευτέρα 08:00`\n"
+        "`/set Δευ-Παρ 08:00`\n"
+        "`/set 21:15`\n\n"
+        "ℹ️ Tips:\n"
+        "• Αν γράψεις μόνο ώρα, κρατάει τις ίδιες μέρες\n"
+        "• Κι άλλη ώρα: `/add Σάββατο 10:00`\n"
+        "• Μπορείς να δεις τη ρύθμισή σου με /when\n"
+        "• Οδηγίες: /help",
+        parse_mode="Markdown",
+        reply_markup=main_menu(),
+    )
+
+async def set_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat_id = update.effective_chat.id
+    raw = " ".join(context.args).strip()
+
+    if not raw:
+        await update.message.reply_text(
+                "🕒 Ρύθμιση ώρας\n\n"
+                "Παραδείγματα (tap για copy):\n"
+                "`/set Κυριακή 23:58`\n"
+                "`Δευτέρα 08:00`\n"
+                "`/set καθημερινές 07:30`\n"
+                "`/set Δευτέρα, Τετάρτη 18:00`\n"
+                "`/set 21:15`\n\n"
+                "💡 Tip: Αν γράψεις μόνο ώρα, κρατάει τις ίδιες μέρες.",
+                parse_mode="Markdown",
+        )
+        return
+
+    parsed = parse_day_time(raw)
+    if not parsed:
+        await update.message.reply_text("❌ Δεν κατάλαβα. Δοκίμασε π.χ. /set Τετάρτη 18:30")
+        return
+
+    days, hour, minute = parsed
+
+    # αν δεν έδωσε μέρα, κράτα τις παλιές (ή default Δευτέρα)
+    scheds = await activate_schedule(chat_id, days or None, hour, minute)
+    logger.info("USER set chat_id=%s days=%s time=%02d:%02d", chat_id, days, hour, minute)
+
+    await update.message.reply_text(f"✅ ΟΚ! {describe_schedules(scheds)}")
+
+
+async def add_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat_id = update.effective_chat.id
+    parsed = parse_day_time(" ".join(context.args))
+    if not parsed or not parsed[0]:
+        await update.message.reply_text("❌ Παράδειγμα: /add Σάββατο 10:00 ή /add Δευ-Παρ 07:30")
+        return
+    days, hour, minute = parsed
+    scheds = await add_schedules(chat_id, days, hour, minute)
+    logger.info("USER add chat_id=%s days=%s time=%02d:%02d", chat_id, days, hour, minute)
+    await update.message.reply_text(f"✅ Προστέθηκε!\n🗓️ {describe_schedules(scheds)}")
+
+
+async def del_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat_id = update.effective_chat.id
+    raw = " ".join(context.args)
+    parsed = parse_day_time(raw)
+    if parsed:
+        days, hour, minute = parsed
+    else:
+        days, hour, minute = parse_days(raw), None, None
+    if not days:
+        await update.message.reply_text("❌ Παράδειγμα: /del Σάββατο 10:00 ή /del Σάββατο")
+        return
+    removed = await remove_schedules(chat_id, days, hour, minute)
+    logger.info("USER del chat_id=%s days=%s removed=%d", chat_id, days, removed)
+    sched = await get_schedules(chat_id)
+    await update.message.reply_text(
+        f"🗑️ Αφαιρέθηκαν: {removed}\n🗓️ {describe_schedules(sched[0] if sched else [])}"
+    )
+
+
+async def when_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat_id = update.effective_chat.id
+    sched = await get_schedules(chat_id)
+    if not sched or not sched[0]:
+        await update.message.reply_text("Δεν έχεις ρύθμιση ακόμα. Στείλε /start ή /set Δευτέρα 08:00")
+        return
+    scheds, tz = sched
+    await update.message.reply_text(f"🗓️ Ρύθμιση ({tz}):\n{describe_schedules(scheds)}\n\n Πάτα Help για επιστροφή στο μενού.")
+
+
+async def tz_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat_id = update.effective_chat.id
+    if not context.args:
+        sched = await get_schedules(chat_id)
+        current = sched[1] if sched else TZ.key
+        await update.message.reply_text(
+            f"🌍 Ζώνη ώρας: {current}\n\nΔιάλεξε ή στείλε π.χ. /tz Europe/London",
+            reply_markup=tz_keyboard(),
+        )
+        return
+    tz = parse_tz(context.args[0])
+    if tz is None:
+        await update.message.reply_text("❌ Άγνωστη ζώνη. Παράδειγμα: /tz Europe/London")
+        return
+    await set_tz(chat_id, tz)
+    logger.info("USER set_tz chat_id=%s tz=%s", chat_id, tz)
+    await update.message.reply_text(f"✅ Ζώνη ώρας: {tz}")
+
+
+async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    txt = (update.message.text or "").strip()
+    if not txt or txt.startswith("/"):
+        return
+
+    parsed = parse_day_time(txt)
+    if not parsed:
+        return
+
+    days, hour, minute = parsed
+    chat_id = update.effective_chat.id
+    scheds = await activate_schedule(chat_id, days or None, hour, minute)
+    logger.info("USER set_text chat_id=%s days=%s time=%02d:%02d", chat_id, days, hour, minute)
+    await update.message.reply_text(f"✅ Ρυθμίστηκε: {describe_schedules(scheds)}")
+
+
+async def stop_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    logger.info("USER stop chat_id=%s user_id=%s", update.effective_chat.id, update.effective_user.id)
+    chat_id = update.effective_chat.id
+    await set_enabled(chat_id, False)
+    await update.message.reply_text("⏸️ Έγινε παύση. Στείλε /start για να ξαναξεκινήσει.")
+
+USAGE_SENDNOW = (
+    "Χρήση: /sendnow το μήνυμα εδώ\n"
+    "• Πεδία ανά χρήστη: {day} {time} (επόμενο ωράριο), {when} (όλα τα ωράρια), {tz}\n"
+    "• Φωτογραφία/αρχείο: /sendnow [λεζάντα] ως απάντηση σε αυτό, "
+    "ή /sendnow photo:<αρχείο στο MEDIA_DIR|url> [λεζάντα] (doc: για αρχείο)"
+)
+
+
+def _command_rest(text: str, words: int) -> str:
+    # ό,τι ακολουθεί τις πρώτες `words` λέξεις, με τα newlines/κενά του
+    for _ in range(words):
+        parts = text.split(None, 1)
+        text = parts[1] if len(parts) > 1 else ""
+    return text
+
+
+async def sendnow_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    admin_chat_id = update.effective_chat.id
+    if admin_chat_id not in ADMIN_CHAT_IDS:
+        await update.message.reply_text("⛔ Δεν έχεις δικαίωμα για αυτή την εντολή.")
+        return
+
+    # Παίρνουμε το custom μήνυμα μετά το /sendnow (και media, αν υπάρχει),
+    # όπως γράφτηκε: newlines και κενά μένουν ως έχουν
+    args = context.args or []
+    media_type = media = file_id = None
+    reply = update.message.reply_to_message
+    options = 1   # το /sendnow
+    if args and args[0].startswith(("photo:", "doc:")):
+        options += 1
+        prefix, media = args[0].split(":", 1)
+        media_type = "photo" if prefix == "photo" else "document"
+        if not media.startswith(("http://", "https://")):
+            path = media_path(media)
+            if path is None:
+                await update.message.reply_text(
+                    f"❌ Δεν βρέθηκε το {media} στο MEDIA_DIR" if MEDIA_DIR
+                    else "❌ Αρχεία του server θέλουν MEDIA_DIR· αλλιώς URL ή απάντηση σε φωτογραφία/αρχείο."
+                )
+                return
+            media = str(path)
+        file_id = await cached_file_id(media_type, media)
+    custom_text = _command_rest(update.message.text or "", options).strip()
+    if media_type is None and reply is not None and (reply.photo or reply.document):
+        # ήδη στο Telegram: στέλνεται με το file_id, χωρίς upload
+        media_type = "photo" if reply.photo else "document"
+        media = file_id = reply.photo[-1].file_id if reply.photo else reply.document.file_id
+        custom_text = custom_text or (reply.caption or "")
+    if not custom_text and media_type is None:
+        await update.message.reply_text(USAGE_SENDNOW)
+        return
+    try:
+        compile_template(custom_text)
+    except ValueError as e:
+        await update.message.reply_text(
+            f"❌ Άγνωστο πεδίο {e}. Επιτρέπονται: {' '.join('{%s}' % f for f in TEMPLATE_FIELDS)} "
+            "(για σκέτο { γράψε {{)"
+        )
+        return
+    if media_type is not None and len(custom_text) > MAX_CAPTION_CHARS:
+        await update.message.reply_text(f"❌ Η λεζάντα είναι πάνω από {MAX_CAPTION_CHARS} χαρακτήρες.")
+        return
+
+    chat_ids = await get_enabled_chat_ids()
+    if not chat_ids:
+        await update.message.reply_text("❌ Δεν υπάρχουν ενεργοί χρήστες.")
+        return
+
+    if file_id is None and media is not None and os.path.isabs(media):
+        # upload εδώ και όχι στο send: το αρχείο υπάρχει σε αυτό το node, ο
+        # worker του shard μπορεί να τρέχει σε άλλο
+        send = context.bot.send_photo if media_type == "photo" else context.bot.send_document
+        try:
+            preview = await send(admin_chat_id, Path(media), caption="👀 Προεπισκόπηση")
+        except TelegramError as e:
+            await update.message.reply_text(f"❌ Αποτυχία upload: {e}")
+            return
+        file_id = await remember_media(media_type, media, preview)
+
+    payload_id = await outbox_enqueue(
+        "broadcast", custom_text, chat_ids, media_type=media_type, media=media, file_id=file_id
+    )
+    logger.info(
+        "ADMIN sendnow payload=%s recipients=%d media=%s cached=%s",
+        payload_id, len(chat_ids), media_type or "-", file_id is not None,
+    )
+    message = await update.message.reply_text(f"📤 Μπήκε στην ουρά για {len(chat_ids)} χρήστες…")
+    job = start_admin_job(
+        f"sendnow ({len(chat_ids)})",
+        lambda job: track_broadcast(job, message, payload_id, len(chat_ids)),
+        payload_id=payload_id,
+    )
+    await message.edit_text(
+        f"📤 Μπήκε στην ουρά για {len(chat_ids)} χρήστες… (job #{job.job_id}, /cancel {job.job_id})"
+    )
+
+
+# =======================
+# ADMIN JOBS (στο background)
+# =======================
+# Οι μεγάλες admin εργασίες δεν κρατάνε τον handler: τρέχουν σαν task,
+# ενημερώνουν ένα μήνυμα προόδου και σταματάνε με /cancel <id>.
+JOB_PROGRESS_INTERVAL = 5.0
+
+
+class AdminJob:
+    def __init__(self, job_id: int, title: str, payload_id: int | None) -> None:
+        self.job_id = job_id
+        self.title = title
+        self.payload_id = payload_id
+        self.started = time.time()
+        self.progress = ""
+        self.task: asyncio.Task | None = None
+
+
+_admin_jobs: dict[int, AdminJob] = {}
+_job_ids = itertools.count(1)
+
+
+def start_admin_job(title: str, run, payload_id: int | None = None) -> AdminJob:
+    job = AdminJob(next(_job_ids), title, payload_id)
+
+    async def runner() -> None:
+        try:
+            await run(job)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Admin job #%d failed", job.job_id)
+        finally:
+            _admin_jobs.pop(job.job_id, None)
+
+    _admin_jobs[job.job_id] = job
+    job.task = asyncio.create_task(runner(), name=f"admin_job_{job.job_id}")
+    return job
+
+
+async def track_broadcast(job: AdminJob, message, payload_id: int, total: int) -> None:
+    shown = ""
+    while True:
+        progress = await outbox_progress(payload_id)
+        done = not progress.get(OUTBOX_PENDING) and not progress.get(OUTBOX_CLAIMED)
+        sent = progress.get(OUTBOX_SENT, 0)
+        failed = progress.get(OUTBOX_FAILED, 0)
+        cancelled = progress.get(OUTBOX_CANCELLED, 0)
+        job.progress = f"{sent + failed}/{total}"
+        if done:
+            break
+        text = f"📤 #{job.job_id}: {sent + failed}/{total} (❌ {failed})"
+        if text != shown:
+            with suppress(BadRequest):
+                await message.edit_text(text)
+            shown = text
+        await asyncio.sleep(JOB_PROGRESS_INTERVAL)
+
+    summary = f"✅ Στάλθηκε σε {sent} | ❌ Απέτυχε σε {failed}"
+    if cancelled:
+        summary += f" | ⏹️ Ακυρώθηκε για {cancelled}"
+    await message.reply_text(summary)
+
+
+async def jobs_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin(update.effective_chat.id):
+        await update.message.reply_text("⛔ Δεν έχεις δικαίωμα.")
+        return
+    if not _admin_jobs:
+        await update.message.reply_text("Δεν τρέχει καμία εργασία.")
+        return
+    lines = [
+        f"#{job.job_id} {job.title} {job.progress} ({int(time.time() - job.started)}s)"
+        for job in _admin_jobs.values()
+    ]
+    await update.message.reply_text("\n".join(lines))
+
+
+async def cancel_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin(update.effective_chat.id):
+        await update.message.reply_text("⛔ Δεν έχεις δικαίωμα.")
+        return
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Χρήση: /cancel <id> (δες /jobs)")
+        return
+    job = _admin_jobs.get(int(context.args[0]))
+    if job is None:
+        await update.message.reply_text("❌ Δεν βρέθηκε εργασία.")
+        return
+
+    logger.info("ADMIN cancel job=%d payload=%s", job.job_id, job.payload_id)
+    if job.payload_id is not None:
+        # ο tracker θα δει ότι δεν έμεινε τίποτα και θα στείλει την αναφορά
+        await outbox_cancel(job.payload_id)
+    elif job.task is not None:
+        job.task.cancel()
+    await update.message.reply_text(f"⏹️ Ακύρωση #{job.job_id}…")
+
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    chat_id = update.effective_chat.id
+    if chat_id not in ADMIN_CHAT_IDS:
+        await update.message.reply_text("⛔ Δεν έχεις δικαίωμα για αυτή την εντολή.")
+        return
+
+    stats = await get_stats()
+    lines = [f"📊 Stats:\n✅ Ενεργοί: {stats['enabled']}\n👥 Σύνολο: {stats['total']}"]
+
+    totals: dict[str, int] = {}
+    lines.append(f"\n📈 Τελευταίες {STATS_DAYS} μέρες (UTC): νέοι / on / off · σταλμένα / αποτυχίες")
+    for day, row in stats["days"].items():
+        for name, value in row.items():
+            totals[name] = totals.get(name, 0) + value
+        lines.append(
+            f"{day[5:]}: +{row.get('new', 0)} / +{row.get('opt_in', 0)} / -{row.get('opt_out', 0)} · "
+            f"{row.get('sent', 0)} / {row.get('failed', 0)}"
+        )
+    done = totals.get("sent", 0) + totals.get("failed", 0)
+    if done:
+        lines.append(
+            f"📬 Επιτυχία: {totals.get('sent', 0) / done:.1%} "
+            f"(blocked {totals.get('blocked', 0)}, retries {totals.get('retry', 0)})"
+        )
+
+    lines.append(f"\n🔥 Πιο φορτωμένα λεπτά ({TZ.key}, {stats['slots']} slots):")
+    for utc_mow, chats in stats["hot"]:
+        lines.append(f"{describe_slot(utc_mow)} → {chats}")
+    await update.message.reply_text("\n".join(lines))
+
+
+async def eta_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # ουρά τώρα + επόμενο slot, με ρυθμό BROADCAST_RATE για όλο το cluster
+    if not is_admin(update.effective_chat.id):
+        await update.message.reply_text("⛔ Δεν έχεις δικαίωμα.")
+        return
+    now = time.time()
+    lines = []
+    pending, last_at = await db_fetchone(
+        "SELECT COUNT(*), MAX(next_at) FROM outbox WHERE status IN (?, ?)", (OUTBOX_PENDING, OUTBOX_CLAIMED)
+    )
+    if pending:
+        done_at = max(last_at, now + pending / BROADCAST_RATE)
+        lines.append(f"ουρά: {pending} μηνύματα, τέλος σε ~{done_at - now:.0f}s")
+    else:
+        lines.append("ουρά: άδεια")
+
+    current = utc_slot(int(now // 60))
+    row = await db_fetchone(
+        "SELECT utc_mow, chats FROM slot_counts WHERE chats>0 "
+        "ORDER BY (utc_mow - ? + ?) % ? LIMIT 1",
+        (current + 1, MINUTES_PER_WEEK, MINUTES_PER_WEEK),
+    )
+    if row:
+        utc_mow, due = row
+        starts = ((utc_mow - current) % MINUTES_PER_WEEK or MINUTES_PER_WEEK) * 60 - now % 60
+        duration = max(spread_window(due), due / BROADCAST_RATE)
+        lines.append(
+            f"επόμενο: {describe_slot(utc_mow)} σε {starts / 60:.0f}′, {due} chats, "
+            f"διάρκεια ~{duration:.0f}s" + (" (spread)" if spread_window(due) else "")
+        )
+    lines.append(
+        f"prestage={SCHEDULE_PRESTAGE:g}s spread={'off' if not SCHEDULE_SPREAD_MIN else f'{SCHEDULE_SPREAD_MIN}+ σε {SCHEDULE_SPREAD_WINDOW:g}s'}"
+    )
+    await reply_code(update, "\n".join(lines))
+
+
+async def delivery_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # /delivery <chat_id> [μέρες]: τα τελευταία αποτελέσματα αποστολής του chat
+    if not is_admin(update.effective_chat.id):
+        await update.message.reply_text("⛔ Δεν έχεις δικαίωμα.")
+        return
+    args = context.args or []
+    if not args or not args[0].lstrip("-").isdigit() or (len(args) > 1 and not args[1].isdigit()):
+        await update.message.reply_text("Χρήση: /delivery <chat_id> [μέρες]")
+        return
+    chat_id = int(args[0])
+    days = min(int(args[1]) if len(args) > 1 else DELIVERY_QUERY_DAYS, DELIVERY_RETENTION_DAYS)
+    rows = await chat_deliveries(chat_id, days)
+    if not rows:
+        await update.message.reply_text(f"Καμία αποστολή στο {chat_id} τις τελευταίες {days} μέρες.")
+        return
+    lines = [f"📬 {chat_id} ({TZ.key}):"]
+    for ts, status, slot, latency_ms, payload_id in rows:
+        what = describe_slot(slot) if slot is not None else f"broadcast #{payload_id}"
+        lines.append(
+            f"{datetime.fromtimestamp(ts, TZ):%m-%d %H:%M} {DELIVERY_STATUS.get(status, status)} "
+            f"{what} +{latency_ms / 1000:.1f}s"
+        )
+    await reply_code(update, "\n".join(lines))
+
+
+async def slotrate_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # /slotrate Δευτέρα 08:00 (ώρα TZ, και ομάδες ημερών) ή /slotrate <utc_mow>
+    if not is_admin(update.effective_chat.id):
+        await update.message.reply_text("⛔ Δεν έχεις δικαίωμα.")
+        return
+    text = " ".join(context.args or [])
+    if text.isdigit() and int(text) < MINUTES_PER_WEEK:
+        slots = [int(text)]
+    elif parsed := parse_day_time(text):
+        days, hour, minute = parsed
+        slots = [zone_slot(minute_of_week(dow, hour, minute), TZ.key) for dow in days or range(7)]
+    else:
+        await update.message.reply_text("Χρήση: /slotrate <μέρα ώρα> (π.χ. Δευτέρα 08:00) ή /slotrate <utc_mow>")
+        return
+
+    per_day: dict[str, dict[int, tuple[int, float, int]]] = {}
+    for day, status, count, avg_ms, max_ms in await slot_deliveries(slots):
+        per_day.setdefault(day, {})[status] = (count, avg_ms, max_ms)
+    title = ", ".join(describe_slot(slot) for slot in slots)
+    if not per_day:
+        await update.message.reply_text(f"Καμία αποστολή για {title} τις τελευταίες {DELIVERY_QUERY_DAYS} μέρες.")
+        return
+
+    lines = [f"📊 {title} ({TZ.key}), UTC μέρες:"]
+    totals = dict.fromkeys(DELIVERY_STATUS, 0)
+    for day, row in sorted(per_day.items(), reverse=True):
+        counts = {status: row.get(status, (0, 0, 0))[0] for status in DELIVERY_STATUS}
+        for status, n in counts.items():
+            totals[status] += n
+        final = counts[SEND_OK] + counts[SEND_FAILED] + counts[SEND_BLOCKED]
+        rate = (counts[SEND_FAILED] + counts[SEND_BLOCKED]) / final if final else 0.0
+        sent = row.get(SEND_OK)
+        latency = f" · ⏱ {sent[1] / 1000:.1f}s (max {sent[2] / 1000:.1f}s)" if sent else ""
+        lines.append(
+            f"{day[4:6]}-{day[6:]}: "
+            + " ".join(f"{DELIVERY_STATUS[status]}{n}" for status, n in counts.items() if n)
+            + f" · αποτυχία {rate:.1%}{latency}"
+        )
+    final = totals[SEND_OK] + totals[SEND_FAILED] + totals[SEND_BLOCKED]
+    if final:
+        lines.append(f"Σύνολο: αποτυχία {(totals[SEND_FAILED] + totals[SEND_BLOCKED]) / final:.1%} σε {final}")
+    await reply_code(update, "\n".join(lines))
+
+
+async def export_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # /export [csv|jsonl]: το αρχείο (gzip) έρχεται ως document όταν τελειώσει
+    if not is_admin(update.effective_chat.id):
+        await update.message.reply_text("⛔ Δεν έχεις δικαίωμα.")
+        return
+    fmt = (context.args[0] if context.args else "csv").lower()
+    if fmt not in ("csv", "jsonl"):
+        await update.message.reply_text("Χρήση: /export [csv|jsonl]")
+        return
+    path = os.path.abspath(f"export-{time.strftime('%Y%m%d-%H%M%S')}.{fmt}.gz")
+    message = update.message
+
+    async def run(job: AdminJob) -> None:
+        count = await export_chats(path, job)
+        with open(path, "rb") as f:
+            await message.reply_document(f, filename=os.path.basename(path), caption=f"📦 {count} chats")
+        os.remove(path)
+
+    job = start_admin_job(f"export {fmt}", run)
+    logger.info("ADMIN export job=%d format=%s", job.job_id, fmt)
+    await message.reply_text(f"📦 Export #{job.job_id} ξεκίνησε (/jobs για πρόοδο)")
+
+
+async def import_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # /import ως reply σε αρχείο (.csv/.jsonl, και .gz) ή /import <path στον server>
+    if not is_admin(update.effective_chat.id):
+        await update.message.reply_text("⛔ Δεν έχεις δικαίωμα.")
+        return
+    message = update.message
+    document = message.reply_to_message.document if message.reply_to_message else None
+    if document is None and not context.args:
+        await message.reply_text("Χρήση: /import ως απάντηση σε αρχείο .csv/.jsonl(.gz) ή /import <path>")
+        return
+
+    async def run(job: AdminJob) -> None:
+        path, downloaded = (context.args[0] if context.args else None), False
+        if document is not None:
+            path = os.path.abspath(f"import-{job.job_id}-{os.path.basename(document.file_name or 'chats.csv')}")
+            await (await document.get_file()).download_to_drive(path)
+            downloaded = True
+        try:
+            imported, skipped = await import_chats(path, job)
+        finally:
+            if downloaded:
+                os.remove(path)
+        await message.reply_text(f"📥 Import #{job.job_id}: {imported} chats, ⚠️ {skipped} γραμμές με λάθη")
+
+    job = start_admin_job("import", run)
+    logger.info("ADMIN import job=%d", job.job_id)
+    await message.reply_text(f"📥 Import #{job.job_id} ξεκίνησε (/jobs για πρόοδο)")
+
+
+async def backup_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin(update.effective_chat.id):
+        await update.message.reply_text("⛔ Δεν έχεις δικαίωμα.")
+        return
+    message = update.message
+
+    async def run(job: AdminJob) -> None:
+        dest, size = await backup_db()
+        if BACKUP_DIR:
+            prune_backups()
+        await message.reply_text(f"💾 Backup: {dest} ({size / 1024 / 1024:.1f} MB)")
+
+    job = start_admin_job("backup", run)
+    logger.info("ADMIN backup job=%d", job.job_id)
+    await message.reply_text(f"💾 Backup #{job.job_id} ξεκίνησε (/jobs για πρόοδο)")
+
+
+async def metrics_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin(update.effective_chat.id):
+        await update.message.reply_text("⛔ Δεν έχεις δικαίωμα.")
+        return
+    await reply_code(update, metrics.render_summary() or "(κενό)")
+
+
+async def cluster_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not is_admin(update.effective_chat.id):
+        await update.message.reply_text("⛔ Δεν έχεις δικαίωμα.")
+        return
+    instances = await lease_store.live("instance:")
+    leader = (await lease_store.live(SCHEDULER_LEASE)).get(SCHEDULER_LEASE, "-")
+    shards: dict[str, list[int]] = {}
+    for name, holder in (await lease_store.live("shard:")).items():
+        shards.setdefault(holder, []).append(int(name[6:]))
+    lines = [f"this={INSTANCE_ID}", f"leader={leader}", f"shards={OUTBOX_SHARDS}"]
+    for holder in sorted(instances.values()):
+        lines.append(f"{holder}: {','.join(map(str, sorted(shards.get(holder, [])))) or '-'}")
+    orphan = OUTBOX_SHARDS - sum(len(v) for v in shards.values())
+    if orphan:
+        lines.append(f"χωρίς owner: {orphan}")
+    await reply_code(update, "\n".join(lines))
+
+
+_background_tasks: list[asyncio.Task] = []
+_servers: list[asyncio.AbstractServer] = []
+
+
+async def on_startup(app: Application) -> None:
+    await init_db()
+    logger.info("CLUSTER start instance=%s role=%s mode=%s", INSTANCE_ID, BOT_ROLE, BOT_MODE)
+
+    # το index το φορτώνει ο cluster_loop όταν γίνει leader
+    _background_tasks.append(asyncio.create_task(cluster_loop(), name="cluster"))
+    await bulk_bot(app).initialize()
+    _background_tasks.append(asyncio.create_task(outbox_worker(bulk_bot(app)), name="outbox_worker"))
+    if BACKUP_DIR:
+        _background_tasks.append(asyncio.create_task(backup_loop(), name="backup"))
+
+    if server := await start_metrics_server():
+        _servers.append(server)
+
+
+async def on_stop(app: Application) -> None:
+    # πριν κλείσει ο HTTP client του bot
+    for job in list(_admin_jobs.values()):
+        if job.task is not None:
+            _background_tasks.append(job.task)
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+    for server in _servers:
+        server.close()
+    _servers.clear()
+    await bulk_bot(app).shutdown()
+    try:
+        await cluster_leave()
+    except Exception:
+        logger.exception("Cluster leave error")
+
+
+async def on_shutdown(app: Application) -> None:
+    await db_close()
+
+async def menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()  # σημαντικό!
+
+    chat_id = query.message.chat_id
+    data = query.data
+    if data in {"action:start", "action:stop", "action:set"}:
+        logger.info("USER button chat_id=%s action=%s", chat_id, data)
+
+
+    if data == "action:start":
+        scheds = await activate_schedule(chat_id)
+        await edit_menu(
+            query,
+            f"✅ Ενεργοποιήθηκε!\n🗓️ {describe_schedules(scheds)}",
+            reply_markup=main_menu(),
+        )
+
+    elif data == "action:stop":
+        await set_enabled(chat_id, False)
+        await edit_menu(
+            query,
+            "⏸️ Έγινε παύση.",
+            reply_markup=main_menu(),
+        )
+    elif data == "action:set":
+        await edit_menu(
+            query,
+            "📅 Διάλεξε μέρα για το μήνυμα:",
+            reply_markup=day_keyboard(),
+        )
+
+
+
+
+    elif data == "action:when":
+        sched = await get_schedules(chat_id)
+        if not sched or not sched[0]:
+            await edit_menu(
+                query,
+                "Δεν έχεις ρύθμιση ακόμα. Πάτα ▶️ Ενεργοποίηση.",
+                reply_markup=main_menu(),
+            )
+            return
+        scheds, tz = sched
+        await edit_menu(
+            query,
+            f"📅 Ρύθμιση ({tz}):\n{describe_schedules(scheds)}\n\n ━━━━━━━━━━━━━━━━━━━━━━━━━━━━",
+            reply_markup=main_menu(),
+        )
+
+    elif data == "action:tz":
+        sched = await get_schedules(chat_id)
+        await edit_menu(
+            query,
+            f"🌍 Ζώνη ώρας: {sched[1] if sched else TZ.key}\n\nΔιάλεξε ζώνη:",
+            reply_markup=tz_keyboard(),
+        )
+
+    elif data == "action:help":
+        await edit_menu(
+            query,
+            HELP_TEXT,
+            parse_mode="Markdown",
+            reply_markup=main_menu(),
+    )
+
+async def settz_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+
+    chat_id = query.message.chat_id
+    tz = parse_tz(query.data.split(":", 1)[1])
+    if tz is None:
+        return
+    await set_tz(chat_id, tz)
+    logger.info("USER set_tz chat_id=%s tz=%s", chat_id, tz)
+
+    await edit_menu(query, f"✅ Ζώνη ώρας: {tz}", reply_markup=main_menu())
+
+
+async def setday_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    await query.answer()
+
+    chat_id = query.message.chat_id
+    dow = int(query.data.split(":")[1])
+
+    # μόνο αυτή η μέρα, με την τρέχουσα ώρα αν υπάρχει (αλλιώς 08:00)
+    await activate_schedule(chat_id, (dow,))
+    logger.info("USER set_day chat_id=%s day=%s", chat_id, DAY_NAMES[dow])
+
+    await edit_menu(
+        query,
+        f"✅ Ορίστηκε μέρα: {DAY_NAMES[dow]}\n\n"
+        "Τώρα στείλε ώρα (copy/paste):\n"
+        "`21:15`\n\n"
+        "ή γράψε π.χ. `Κυριακή 23:58`",
+        parse_mode="Markdown",
+        reply_markup=main_menu(),
+    )
+
+
+# =======================
+# HTTP (clients του Bot API)
+# =======================
+# Δύο ξεχωριστά pools: το app.bot (απαντήσεις σε handlers, edit κουμπιών,
+# progress των admin jobs) και ένα bulk Bot μόνο για τον outbox worker. Ένα
+# broadcast γεμίζει μόνο το δικό του pool, οπότε το interactive έχει πάντα
+# ελεύθερες συνδέσεις. Το InstrumentedRequest μετράει αναμονή για σύνδεση
+# (ουρά στο pool), in-flight και διάρκεια ανά pool/method.
+INTERACTIVE_POOL = int(os.getenv("INTERACTIVE_POOL", "8"))
+BULK_POOL = int(os.getenv("BULK_POOL", str(BROADCAST_CONCURRENCY)))
+BULK_HTTP2 = os.getenv("BULK_HTTP2", "0") == "1"     # θέλει το πακέτο h2 (httpx[http2])
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "30"))
+INTERACTIVE_TIMEOUTS = {"read_timeout": 5.0, "write_timeout": 5.0, "connect_timeout": 5.0, "pool_timeout": 5.0}
+BULK_TIMEOUTS = {"read_timeout": 10.0, "write_timeout": 10.0, "connect_timeout": 5.0, "pool_timeout": 30.0}
+
+
+@functools.cache
+def instrumented_request() -> type:
+    # η κλάση φτιάχνεται με την πρώτη κλήση: το HTTPXRequest θέλει το load_telegram
+    class InstrumentedRequest(HTTPXRequest):
+        def __init__(self, pool: str, connection_pool_size: int, **kwargs) -> None:
+            super().__init__(
+                connection_pool_size=connection_pool_size,
+                httpx_kwargs={"limits": httpx.Limits(
+                    max_connections=connection_pool_size,
+                    max_keepalive_connections=connection_pool_size,
+                    keepalive_expiry=HTTP_KEEPALIVE,
+                )},
+                **kwargs,
+            )
+            self.pool = pool
+            # ίδιο όριο με το httpx pool, για να φαίνεται πόσο περιμένει ένα request
+            self._slots = asyncio.Semaphore(connection_pool_size)
+            self._in_flight = 0
+
+        async def do_request(self, url: str, method: str, request_data=None, **timeouts) -> tuple[int, bytes]:
+            api_method = url.rsplit("/", 1)[-1]
+            queued = time.perf_counter()
+            async with self._slots:
+                start = time.perf_counter()
+                metrics.observe("bot_http_pool_wait_seconds", start - queued, pool=self.pool)
+                self._in_flight += 1
+                metrics.set("bot_http_in_flight", self._in_flight, pool=self.pool)
+                try:
+                    return await super().do_request(url, method, request_data, **timeouts)
+                finally:
+                    self._in_flight -= 1
+                    metrics.set("bot_http_in_flight", self._in_flight, pool=self.pool)
+                    metrics.observe(
+                        "bot_http_request_seconds", time.perf_counter() - start, pool=self.pool, method=api_method
+                    )
+
+    return InstrumentedRequest
+
+
+def build_request(pool: str) -> HTTPXRequest:
+    if pool == "bulk":
+        http_version = "1.1"
+        if BULK_HTTP2:
+            if importlib.util.find_spec("h2") is None:
+                logger.warning("HTTP BULK_HTTP2=1 χωρίς το πακέτο h2, μένει HTTP/1.1")
+            else:
+                http_version = "2"
+        return instrumented_request()(pool, BULK_POOL, http_version=http_version, **BULK_TIMEOUTS)
+    return instrumented_request()(pool, INTERACTIVE_POOL, **INTERACTIVE_TIMEOUTS)
+
+
+def bulk_bot(app: Application) -> Bot:
+    return app.bot_data["bulk_bot"]
+
+
+# =======================
+# WEBHOOK
+# =======================
+# BOT_MODE=webhook: ενσωματωμένος HTTP server αντί για long polling. Δέχεται
+# μόνο POST στο WEBHOOK_PATH με σωστό X-Telegram-Bot-Api-Secret-Token και
+# βάζει το update στο (bounded) update_queue· αν είναι γεμάτο απαντάει 503
+# και το Telegram το ξαναστέλνει αργότερα. Χωρίς WEBHOOK_URL δεν γίνεται
+# setWebhook, οπότε δοκιμάζεται τοπικά με curl/POST recorded updates.
+BOT_MODE = os.getenv("BOT_MODE", "polling")            # polling | webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")             # δημόσιο https://… (χωρίς path)
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+
+# μόνο ό,τι πιάνουν οι handlers του build_application
+ALLOWED_UPDATES = ["message", "callback_query"]   # Update.MESSAGE, Update.CALLBACK_QUERY
+
+
+def _webhook_server(app: Application, secret: str):
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while request := await read_http_request(reader):
+                method, path, headers, body = request
+                if path.split("?")[0] != WEBHOOK_PATH:
+                    await write_http_response(writer, 404, b"not found")
+                    continue
+                if method != "POST":
+                    await write_http_response(writer, 405, b"method not allowed")
+                    continue
+                token = headers.get("x-telegram-bot-api-secret-token", "")
+                if not hmac.compare_digest(token, secret):
+                    metrics.inc("bot_webhook_total", result="unauthorized")
+                    await write_http_response(writer, 401, b"unauthorized")
+                    continue
+                try:
+                    update = Update.de_json(json.loads(body), app.bot)
+                except Exception:
+                    metrics.inc("bot_webhook_total", result="bad_request")
+                    await write_http_response(writer, 400, b"bad request")
+                    continue
+                try:
+                    app.update_queue.put_nowait(update)
+                except asyncio.QueueFull:
+                    metrics.inc("bot_webhook_total", result="overloaded")
+                    await write_http_response(writer, 503, b"busy")
+                    continue
+                metrics.inc("bot_webhook_total", result="accepted")
+                metrics.set("bot_update_queue_size", app.update_queue.qsize())
+                await write_http_response(writer, 200, b"ok")
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError, TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    return handle
+
+
+async def start_webhook(app: Application) -> asyncio.AbstractServer:
+    secret = WEBHOOK_SECRET
+    if not secret:
+        secret = secrets.token_urlsafe(32)
+        if not WEBHOOK_URL:
+            logger.warning("WEBHOOK_SECRET λείπει: τοπικά POST θα απορρίπτονται (401)")
+    if WEBHOOK_URL:
+        await app.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            allowed_updates=ALLOWED_UPDATES,
+            secret_token=secret,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+    server = await asyncio.start_server(
+        http_limited(_webhook_server(app, secret), "webhook"), WEBHOOK_LISTEN, WEBHOOK_PORT
+    )
+    logger.info("WEBHOOK listening on %s:%d%s", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+    return server
+
+
+async def run_app(app: Application, ingest=None) -> None:
+    # Ο κύκλος ζωής του run_polling χωρίς το polling: ingest=start_webhook
+    # για webhook, None για BOT_ROLE=worker (μόνο scheduler/αποστολή).
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):   # Windows: μένει το KeyboardInterrupt
+            loop.add_signal_handler(sig, stop.set)
+
+    await app.initialize()
+    server = None
+    try:
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        if ingest is not None:
+            server = await ingest(app)
+        await stop.wait()
+    finally:
+        if server is not None:
+            server.close()
+        if app.running:
+            await app.stop()
+            if app.post_stop:
+                await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+def build_application(token: str, base_url: str | None = None) -> Application:
+    load_telegram()
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(build_request("interactive"))
+        .update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)   # π.χ. τοπικός fake Bot API (bench.py)
+    app = builder.build()
+    app.bot_data["bulk_bot"] = Bot(token, base_url=base_url or "https://api.telegram.org/bot", request=build_request("bulk"))
+
+    app.add_handler(CommandHandler("start", chat_handler(start_cmd)))
+    app.add_handler(CommandHandler("stop", chat_handler(stop_cmd)))
+    app.add_handler(CommandHandler("sendnow", chat_handler(sendnow_cmd)))
+    app.add_handler(CommandHandler("stats", chat_handler(stats_cmd)))
+    app.add_handler(CommandHandler("set", chat_handler(set_cmd)))
+    app.add_handler(CommandHandler("when", chat_handler(when_cmd)))
+    app.add_handler(CommandHandler("add", chat_handler(add_cmd)))
+    app.add_handler(CommandHandler("del", chat_handler(del_cmd)))
+    app.add_handler(CommandHandler("tz", chat_handler(tz_cmd)))
+    app.add_handler(CommandHandler("logs", chat_handler(logs_cmd)))       # /logs 80
+    app.add_handler(CommandHandler("errors", chat_handler(errors_cmd)))   # /errors 120
+    app.add_handler(CommandHandler("logsearch", chat_handler(logsearch_cmd)))  # /logsearch set 50
+    app.add_handler(CommandHandler("metrics", chat_handler(metrics_cmd)))
+    app.add_handler(CommandHandler("eta", chat_handler(eta_cmd)))
+    app.add_handler(CommandHandler("delivery", chat_handler(delivery_cmd)))   # /delivery 12345
+    app.add_handler(CommandHandler("slotrate", chat_handler(slotrate_cmd)))   # /slotrate Δευτέρα 08:00
+    app.add_handler(CommandHandler("export", chat_handler(export_cmd)))   # /export jsonl
+    app.add_handler(CommandHandler("import", chat_handler(import_cmd)))
+    app.add_handler(CommandHandler("backup", chat_handler(backup_cmd)))
+    app.add_handler(CommandHandler("cluster", chat_handler(cluster_cmd)))
+    app.add_handler(CommandHandler("jobs", chat_handler(jobs_cmd)))
+    app.add_handler(CommandHandler("cancel", chat_handler(cancel_cmd)))
+    app.add_handler(CommandHandler("help", chat_handler(help_cmd)))
+    app.add_handler(CallbackQueryHandler(chat_handler(setday_callback), pattern=r"^setday:\d$"))
+    app.add_handler(CallbackQueryHandler(chat_handler(settz_callback), pattern=r"^settz:"))
+    app.add_handler(CallbackQueryHandler(chat_handler(menu_callback), pattern=r"^action:"))
+    # μόνο μηνύματα με ώρα φτάνουν στον handler (και στο per-chat lock)
+    app.add_handler(MessageHandler(
+        filters.TEXT & ~filters.COMMAND & filters.Regex(_TIME_RE), chat_handler(text_handler)
+    ))
+    return app
+
+
+def log_cli(args: argparse.Namespace) -> None:
+    # χωρίς βάση και χωρίς Telegram: διαβάζει μόνο τα αρχεία
+    path = ERROR_LOG if args.errors else ACTIVITY_LOG
+    if args.command == "logs":
+        print(tail_lines(path, args.n))
+        return
+    since, until = (_parse_log_time(value) if value else None for value in (args.since, args.until))
+    for value, ts in ((args.since, since), (args.until, until)):
+        if value and ts is None:
+            raise SystemExit(f"❌ Λάθος ώρα: {value} (π.χ. 2026-01-04T18:00)")
+    try:
+        match = log_matcher(args.pattern)
+    except re.error as e:
+        raise SystemExit(f"❌ Λάθος regex: {e}")
+    print("\n".join(search_logs(path, match, since, until, args.n)) or "(δεν βρέθηκε)")
+
+
+async def run_cli(args: argparse.Namespace) -> None:
+    if args.command == "migrate":
+        db = await db_open()
+        try:
+            before = await schema_version(db)
+            after = before if args.check else await migrate(db)
+            print(f"schema v{before} -> v{after} (κώδικας: v{SCHEMA_VERSION})")
+        finally:
+            await db_close()
+        return
+    await init_db()
+    try:
+        if args.command == "export":
+            print(f"exported {await export_chats(args.path)} chats -> {args.path}")
+        elif args.command == "import":
+            imported, skipped = await import_chats(args.path)
+            print(f"imported {imported} chats, skipped {skipped} lines")
+        elif args.command == "backup":
+            dest, size = await backup_db(args.path)
+            print(f"backup {dest} ({size} bytes)")
+    finally:
+        await db_close()
+
+
+def cli(argv: list[str]) -> None:
+    # εργαλεία χωρίς Telegram: python bot.py export|import|backup|migrate|logs|logsearch ...
+    parser = argparse.ArgumentParser(prog="bot.py", description="Εργαλεία βάσης και logs (χωρίς Telegram)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("export", help="chats σε .csv/.jsonl (και .gz)").add_argument("path")
+    sub.add_parser("import", help="chats από .csv/.jsonl (και .gz), upsert").add_argument("path")
+    sub.add_parser("backup", help="online backup του bot.db").add_argument("path", nargs="?")
+    p = sub.add_parser("migrate", help="αναβάθμιση schema (PRAGMA user_version)")
+    p.add_argument("--check", action="store_true", help="μόνο εμφάνιση της έκδοσης")
+    p = sub.add_parser("logs", help="οι τελευταίες γραμμές του log")
+    p.add_argument("-n", type=int, default=80)
+    p.add_argument("--errors", action="store_true", help="errors.log αντί για activity.log")
+    p = sub.add_parser("logsearch", help="αναζήτηση στα logs (και στα rotated)")
+    p.add_argument("pattern", help="λέξη ή re:regex")
+    p.add_argument("-n", type=int, default=MAX_SEARCH_HITS)
+    p.add_argument("--since")
+    p.add_argument("--until")
+    p.add_argument("--errors", action="store_true", help="errors.log αντί για activity.log")
+    args = parser.parse_args(argv)
+    if args.command in ("logs", "logsearch"):
+        log_cli(args)
+        return
+    setup_logging()
+    asyncio.run(run_cli(args))
+
+
+def main() -> None:
+    if len(sys.argv) > 1:
+        cli(sys.argv[1:])
+        return
     token = os.getenv("TELEGRAM_BOT_TOKEN")
     if not token:
         raise SystemExit("❌ Λείπει το TELEGRAM_BOT_TOKEN (θα το βάλουμε σε .env)")
+    setup_logging()
 
-    app = Application.builder().token(token).post_init(on_startup).build()
-    app.add_handler(CommandHandler("start", start_cmd))
-    app.add_handler(CommandHandler("stop", stop_cmd))
-    app.add_handler(CommandHandler("sendnow", sendnow_cmd))
-    app.add_handler(CommandHandler("stats", stats_cmd))
-    app.add_handler(CommandHandler("set", set_cmd))
-    app.add_handler(CommandHandler("when", when_cmd))
-    app.add_handler(CommandHandler("logs", logs_cmd))       # /logs 80
-    app.add_handler(CommandHandler("errors", errors_cmd))   # /errors 120
-    app.add_handler(CommandHandler("logsearch", logsearch_cmd))  # /logsearch set 500
-    app.add_handler(CommandHandler("help", help_cmd))
-    app.add_handler(CallbackQueryHandler(setday_callback, pattern=r"^setday:\d$"))
-    app.add_handler(CallbackQueryHandler(menu_callback, pattern=r"^action:"))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, text_handler))
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    app = build_application(token)
+    if BOT_ROLE == "worker":
+        asyncio.run(run_app(app))
+    elif BOT_MODE == "webhook":
+        asyncio.run(run_app(app, start_webhook))
+    else:
+        app.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == "__main__":